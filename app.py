@@ -8,14 +8,36 @@ import base64
 import json
 from pathlib import Path
 from flask import Flask, request, jsonify, send_from_directory, send_file, Response
-from openai import OpenAI
 import dashscope
 import tempfile
 import subprocess
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from response_parser import parse_response
+from transcoder import run_ffmpeg, submit_ffmpeg, probe_media, get_transcode_stats, TranscodeError, TranscodeRejected, FFMPEG_WORKERS
+import video_ingest
+import media_budget
+from media_budget import get_budget
+from frame_sampler import video_content_parts, resolve_video_input_mode, record_video_turn, get_video_input_stats
+from request_encoder import DataURI, create_chat_completion
+from upload_limits import install_upload_limits, read_upload, get_upload_stats
+from session_store import create_session_store
+from history_window import build_history_window, schedule_summary, get_history_window_stats
+from prompt_builder import record_prompt_usage, get_prefix_cache_stats
+from response_cache import create_response_cache
+from tts_cache import cached_tts, get_tts_cache_stats
+from upstream_http import get_openai_client, dashscope_options, get_upstream_stats
+from tts_pipeline import SentencePipeline, is_pipeline_requested, iter_content_deltas, pcm_to_wav
+from stream_protocol import open_response_stream, get_stream_stats, LEGACY_WAV, LEGACY_METADATA_WAV, LEGACY_BLOCKS
+from pcm_chunker import PCMChunker, get_chunker_stats
+from audio_encoder import get_audio_encoder_stats
 
 app = Flask(__name__, static_folder='static')
 
+# 上传按接口限制大小，大文件落盘后以 mmap 读取（见 upload_limits）
+install_upload_limits(app)
+
 # 配置（从环境变量读取）
 API_KEY = os.getenv('API_KEY')
 if not API_KEY:
@@ -29,8 +51,16 @@ MODEL = os.getenv('MODEL', 'qwen3-omni-flash')  # 支持音频输出的模型
 # 'mp3' - 使用 FFmpeg 转换为 MP3（延迟较高，兼容性好）
 AUDIO_FORMAT = os.getenv('AUDIO_FORMAT', 'wav')
 
+# 转码方式配置
+# 'pipe' - 通过 stdin/stdout 管道交给 FFmpeg，不落盘（推荐；失败时自动回退到 file）
+# 'file' - 写临时文件再转码（旧方式）
+TRANSCODE_MODE = os.getenv('TRANSCODE_MODE', 'pipe')
+
+# 多片段视频单次请求内最多同时转码的片段数（默认与转码工作线程数相同）
+SEGMENT_PARALLELISM = max(1, int(os.getenv('SEGMENT_PARALLELISM', FFMPEG_WORKERS)))
+
 # OpenAI 客户端
-client = OpenAI(api_key=API_KEY, base_url=API_BASE)
+client = get_openai_client(API_KEY, API_BASE)  # 与 multimodal_engine 共用同一个客户端和连接池
 
 # 配置 DashScope SDK
 dashscope.api_key = API_KEY
@@ -65,39 +95,120 @@ latest_videos = {
     'timestamp': None
 }
 
-# 对话历史管理（内存存储，简单实现）
-# 生产环境应该使用 Redis 或数据库
-conversation_history = {}  # {session_id: [messages]}
+# 对话历史管理（有界存储：最大会话数 + 空闲过期 + LRU 淘汰，每个会话保留最近 20 条，见 session_store）
+conversation_store = create_session_store()
 
 def get_conversation_history(session_id):
-    """获取会话的对话历史"""
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-    return conversation_history[session_id]
-
-def add_to_conversation_history(session_id, role, content):
-    """添加一条消息到对话历史"""
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-
-    conversation_history[session_id].append({
-        'role': role,
-        'content': content
-    })
-
-    # 限制历史长度（保留最近 20 条，避免 token 过多）
-    MAX_HISTORY = 20
-    if len(conversation_history[session_id]) > MAX_HISTORY:
-        conversation_history[session_id] = conversation_history[session_id][-MAX_HISTORY:]
+    """获取会话的对话历史（副本）"""
+    return conversation_store.get_history(session_id)
+
+def get_history_window(session_id):
+    """获取本轮请求使用的历史：摘要 + token 预算内最近的完整轮次（见 history_window）"""
+    return build_history_window(conversation_store, session_id)
+
+def save_conversation_turn(session_id, user_content, assistant_content):
+    """保存一轮对话（用户 + 助手两条消息原子写入），返回会话当前消息数；历史过长时在后台生成摘要"""
+    count = conversation_store.append(
+        session_id,
+        {'role': 'user', 'content': user_content},
+        {'role': 'assistant', 'content': assistant_content}
+    )
+    schedule_summary(conversation_store, session_id, client, MODEL)
+    return count
 
 def clear_conversation_history(session_id):
     """清空会话的对话历史"""
-    if session_id in conversation_history:
-        conversation_history[session_id] = []
+    conversation_store.clear(session_id)
+
+
+# 管道输出 MP4 需要分片格式（moov 放在开头，无需回写）
+MP4_PIPE_FLAGS = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']
+
+
+def prepare_video(webm_data, budget=None):
+    """
+    按输入编码和媒体预算选择 passthrough / remux / transcode，得到可发送给大模型的视频
+
+    参数:
+        budget: 媒体预算（media_budget.get_budget），None 表示不限制
+
+    返回:
+        (视频数据, MIME 类型, 预算报告或 None)
+    """
+    info = probe_media(data=webm_data)
+    strategy = video_ingest.choose_strategy([info])
+    plan = media_budget.plan_budget([info], budget, len(webm_data)) if budget else None
+    if plan and plan['reencode']:
+        strategy = video_ingest.TRANSCODE
+    elif plan and plan['trim'] and strategy == video_ingest.PASSTHROUGH:
+        strategy = video_ingest.REMUX
+    print(f'🎞️ 输入视频 {video_ingest.describe(info)} → {strategy}')
+    if plan and plan['reductions']:
+        print(f'📐 媒体预算: {"，".join(plan["reductions"])}')
+
+    def finish(video_data, video_mime):
+        video_ingest.record_strategy(strategy)
+        report = media_budget.budget_report(plan, len(webm_data), len(video_data)) if plan else None
+        return video_data, video_mime, report
+
+    if strategy == video_ingest.PASSTHROUGH:
+        return finish(webm_data, f'video/{video_ingest.accepted_container(info)}')
+
+    trim = media_budget.trim_args(plan) if plan else []
+    if strategy == video_ingest.REMUX:
+        try:
+            mp4_data = convert_webm_to_mp4(
+                webm_data, codec_args=video_ingest.codec_args(strategy, [info]) + trim, probe=False
+            )
+            return finish(mp4_data, 'video/mp4')
+        except TranscodeRejected:
+            raise
+        except Exception as e:
+            print(f'⚠️ 换封装失败，改为完整重编码: {e}')
+            strategy = video_ingest.TRANSCODE
+
+    budget_args = media_budget.video_budget_args(plan) if plan else []
+    mp4_data = convert_webm_to_mp4(
+        webm_data, codec_args=video_ingest.TRANSCODE_ARGS + budget_args + trim, probe=False
+    )
+    return finish(mp4_data, 'video/mp4')
+
+
+def convert_webm_to_mp4(webm_data, codec_args=None, probe=True):
+    """
+    将 WebM 视频转换为 MP4 格式
+
+    参数:
+        codec_args: ffmpeg 编码参数（默认完整重编码 libx264 + aac）
+        probe: 是否先用 ffprobe 预检输入
+    """
+    codec_args = codec_args or video_ingest.TRANSCODE_ARGS
+    # 普通 MP4（ftyp 开头）的 moov 可能在文件末尾，无法从管道读取，直接走临时文件
+    if TRANSCODE_MODE == 'pipe' and webm_data[4:8] != b'ftyp':
+        try:
+            return convert_webm_to_mp4_pipe(webm_data, codec_args, probe)
+        except subprocess.CalledProcessError as e:
+            print(f'⚠️ 管道转码失败 (退出码 {e.returncode})，回退到临时文件方式: {e.stderr[-200:]}')
+    return convert_webm_to_mp4_file(webm_data, codec_args, probe)
+
 
+def convert_webm_to_mp4_pipe(webm_data, codec_args=None, probe=True):
+    """将 WebM 视频转换为分片 MP4（stdin/stdout 管道，不落盘）"""
+    print(f'🔄 开始转换视频（管道），输入大小: {len(webm_data)} bytes')
 
-def convert_webm_to_mp4(webm_data):
-    """将 WebM 视频转换为 MP4 格式"""
+    result = run_ffmpeg([
+        'ffmpeg', '-y', '-i', 'pipe:0',
+        *(codec_args or video_ingest.TRANSCODE_ARGS),
+        *MP4_PIPE_FLAGS, 'pipe:1'
+    ], input_data=webm_data, probe_input=probe)
+
+    mp4_data = result.stdout
+    print(f'📦 转换后 MP4 大小: {len(mp4_data)} bytes')
+    return mp4_data
+
+
+def convert_webm_to_mp4_file(webm_data, codec_args=None, probe=True):
+    """将 WebM 视频转换为 MP4 格式（临时文件方式）"""
     print(f'🔄 开始转换视频，输入大小: {len(webm_data)} bytes')
 
     with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as input_file:
@@ -112,12 +223,11 @@ def convert_webm_to_mp4(webm_data):
     print(f'📁 临时输出文件: {output_path}')
 
     try:
-        result = subprocess.run([
+        result = run_ffmpeg([
             'ffmpeg', '-y', '-i', input_path,
-            '-vcodec', 'libx264', '-acodec', 'aac',
-            '-preset', 'ultrafast', '-crf', '28',
+            *(codec_args or video_ingest.TRANSCODE_ARGS),
             output_path
-        ], check=True, capture_output=True, text=True)
+        ], probe_path=input_path if probe else None)
 
         print(f'✅ FFmpeg 转换成功')
 
@@ -141,6 +251,67 @@ def convert_webm_to_mp4(webm_data):
             os.unlink(output_path)
 
 
+def convert_webm_to_wav(webm_data):
+    """将 WebM 音频转换为 WAV 格式（24kHz 16-bit mono，阿里云 API 推荐）"""
+    if TRANSCODE_MODE == 'pipe':
+        try:
+            return convert_webm_to_wav_pipe(webm_data)
+        except subprocess.CalledProcessError as e:
+            print(f'⚠️ 管道转码失败 (退出码 {e.returncode})，回退到临时文件方式: {e.stderr[-200:]}')
+    return convert_webm_to_wav_file(webm_data)
+
+
+def convert_webm_to_wav_pipe(webm_data):
+    """
+    将 WebM 音频转换为 WAV（管道方式）
+
+    管道输出无法回写 WAV 头中的长度，因此让 FFmpeg 输出裸 PCM，再由 add_wav_header 补上文件头
+    """
+    print('🔄 正在将 WebM 转换为 WAV 格式（管道）...')
+    result = run_ffmpeg([
+        'ffmpeg', '-y', '-i', 'pipe:0',
+        '-ar', '24000',  # 采样率 24kHz (阿里云推荐)
+        '-ac', '1',  # 单声道
+        '-f', 's16le',  # 16位采样
+        'pipe:1'
+    ], input_data=webm_data, probe_input=True)
+
+    wav_data = add_wav_header(result.stdout)
+    print(f'📦 转换后 WAV 大小: {len(wav_data)} bytes')
+    return wav_data
+
+
+def convert_webm_to_wav_file(webm_data):
+    """将 WebM 音频转换为 WAV（临时文件方式）"""
+    with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as input_file:
+        input_file.write(webm_data)
+        input_path = input_file.name
+
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as output_file:
+        output_path = output_file.name
+
+    try:
+        print('🔄 正在将 WebM 转换为 WAV 格式...')
+        # 转换为 WAV 格式
+        run_ffmpeg([
+            'ffmpeg', '-y', '-i', input_path,
+            '-ar', '24000',  # 采样率 24kHz (阿里云推荐)
+            '-ac', '1',  # 单声道
+            '-sample_fmt', 's16',  # 16位采样
+            output_path
+        ], probe_path=input_path)
+
+        with open(output_path, 'rb') as f:
+            wav_data = f.read()
+
+        print(f'📦 转换后 WAV 大小: {len(wav_data)} bytes')
+        return wav_data
+    finally:
+        os.unlink(input_path)
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+
+
 def add_wav_header(pcm_data, sample_rate=24000, bits_per_sample=16, channels=1):
     """
     给 PCM 数据添加 WAV 文件头
@@ -154,35 +325,9 @@ def add_wav_header(pcm_data, sample_rate=24000, bits_per_sample=16, channels=1):
     返回:
         带 WAV 文件头的完整音频数据
     """
-    import struct
-
     print(f'🔄 添加 WAV 文件头，PCM 大小: {len(pcm_data)} bytes')
 
-    # 计算各种参数
-    byte_rate = sample_rate * channels * bits_per_sample // 8
-    block_align = channels * bits_per_sample // 8
-    data_size = len(pcm_data)
-    file_size = data_size + 36  # 44 bytes header - 8 bytes
-
-    # 构建 WAV 文件头 (44 bytes)
-    header = struct.pack(
-        '<4sI4s4sIHHIIHH4sI',
-        b'RIFF',           # ChunkID
-        file_size,         # ChunkSize
-        b'WAVE',           # Format
-        b'fmt ',           # Subchunk1ID
-        16,                # Subchunk1Size (16 for PCM)
-        1,                 # AudioFormat (1 for PCM)
-        channels,          # NumChannels
-        sample_rate,       # SampleRate
-        byte_rate,         # ByteRate
-        block_align,       # BlockAlign
-        bits_per_sample,   # BitsPerSample
-        b'data',           # Subchunk2ID
-        data_size          # Subchunk2Size
-    )
-
-    wav_data = header + pcm_data
+    wav_data = pcm_to_wav(pcm_data, sample_rate, bits_per_sample, channels)
     print(f'✅ WAV 文件头添加完成，总大小: {len(wav_data)} bytes')
 
     return wav_data
@@ -190,6 +335,37 @@ def add_wav_header(pcm_data, sample_rate=24000, bits_per_sample=16, channels=1):
 
 def convert_pcm_to_mp3(pcm_data):
     """将 PCM 音频数据转换为 MP3 格式 (使用 FFmpeg)"""
+    if TRANSCODE_MODE == 'pipe':
+        try:
+            return convert_pcm_to_mp3_pipe(pcm_data)
+        except subprocess.CalledProcessError as e:
+            print(f'⚠️ 管道转码失败 (退出码 {e.returncode})，回退到临时文件方式: {e.stderr[-200:]}')
+    return convert_pcm_to_mp3_file(pcm_data)
+
+
+def convert_pcm_to_mp3_pipe(pcm_data):
+    """将 PCM 音频数据转换为 MP3 格式（管道方式）"""
+    print(f'🔄 开始转换音频 PCM -> MP3（管道），输入大小: {len(pcm_data)} bytes')
+
+    # 阿里云返回的应该是 16-bit, 24kHz, mono PCM
+    result = run_ffmpeg([
+        'ffmpeg', '-y',
+        '-f', 's16le',  # 16-bit signed little-endian
+        '-ar', '24000',  # 24kHz sample rate
+        '-ac', '1',  # mono
+        '-i', 'pipe:0',
+        '-codec:a', 'libmp3lame',
+        '-b:a', '128k',
+        '-f', 'mp3', 'pipe:1'
+    ], input_data=pcm_data)
+
+    mp3_data = result.stdout
+    print(f'📦 转换后 MP3 大小: {len(mp3_data)} bytes')
+    return mp3_data
+
+
+def convert_pcm_to_mp3_file(pcm_data):
+    """将 PCM 音频数据转换为 MP3 格式（临时文件方式）"""
     print(f'🔄 开始转换音频 PCM -> MP3，输入大小: {len(pcm_data)} bytes')
 
     # 保存 PCM 数据到临时文件
@@ -203,7 +379,7 @@ def convert_pcm_to_mp3(pcm_data):
     try:
         # 使用 ffmpeg 将 PCM 转换为 MP3
         # 阿里云返回的应该是 16-bit, 24kHz, mono PCM
-        result = subprocess.run([
+        result = run_ffmpeg([
             'ffmpeg', '-y',
             '-f', 's16le',  # 16-bit signed little-endian
             '-ar', '24000',  # 24kHz sample rate
@@ -212,7 +388,7 @@ def convert_pcm_to_mp3(pcm_data):
             '-codec:a', 'libmp3lame',
             '-b:a', '128k',
             output_path
-        ], check=True, capture_output=True, text=True)
+        ])
 
         print(f'✅ 音频转换成功')
 
@@ -233,6 +409,218 @@ def convert_pcm_to_mp3(pcm_data):
             os.unlink(output_path)
 
 
+def _probe_segment(index, path):
+    """预检一个片段，损坏时返回 None"""
+    try:
+        return probe_media(path=path)
+    except TranscodeRejected:
+        raise
+    except TranscodeError as e:
+        print(f'  ⚠️ 跳过损坏的片段 {index+1}: {e}')
+        return None
+
+
+def _convert_segments(temp_webm_files, indexes, args, mp4_paths, in_flight):
+    """
+    按 SEGMENT_PARALLELISM 并发转换指定片段
+
+    返回:
+        (按片段下标排列的 MP4 路径列表（失败为 None）, 转换失败的片段数)
+    """
+    converted = [None] * len(temp_webm_files)
+    failed = 0
+    pending = list(indexes)
+    while pending or in_flight:
+        while pending and len(in_flight) < SEGMENT_PARALLELISM:
+            i = pending.pop(0)
+            mp4_paths[i] = temp_webm_files[i][:-len('.webm')] + '.mp4'
+            future = submit_ffmpeg(['ffmpeg', '-y', '-i', temp_webm_files[i], *args, mp4_paths[i]])
+            in_flight[future] = i
+
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = in_flight.pop(future)
+            try:
+                future.result()
+                converted[i] = mp4_paths[i]
+                print(f'  ✅ 片段 {i+1} 已转换为 MP4')
+            except TranscodeRejected:
+                raise
+            except TranscodeError as e:
+                failed += 1
+                print(f'  ⚠️ 跳过损坏的片段 {i+1}: {e}')
+            except subprocess.CalledProcessError as e:
+                failed += 1
+                print(f'  ❌ 片段 {i+1} 转换失败 (退出码 {e.returncode}):')
+                print(f'  === FFmpeg stderr (片段 {i+1}) ===')
+                print(e.stderr if e.stderr else '(无输出)')
+                print(f'  ⚠️ 跳过损坏的片段 {i+1}，继续处理其他片段...')
+    return converted, failed
+
+
+def merge_video_segments(segments, budget=None):
+    """
+    将多个 WebM 片段并行转换为 MP4，再按原顺序合并
+
+    先探测各片段编码，所有片段统一选择 remux 或 transcode（保证 concat 时参数一致）；
+    每个请求最多同时提交 SEGMENT_PARALLELISM 个转码任务，总并发仍受转码服务限制；
+    损坏的片段会被跳过，不影响其余片段。
+
+    参数:
+        segments: WebM 数据列表（按录制顺序）
+        budget: 媒体预算（media_budget.get_budget），分辨率/帧率/码率在片段转码时限制，
+                时长在合并时截断；None 表示不限制
+
+    返回:
+        (合并后的 MP4 数据, 预算报告或 None)
+
+    异常:
+        TranscodeRejected: 转码队列已满
+    """
+    temp_webm_files = []
+    mp4_paths = [None] * len(segments)
+    in_flight = {}
+    concat_file_path = None
+    output_path = None
+
+    try:
+        # 保存所有 WebM 文件到临时文件
+        for i, webm_data in enumerate(segments):
+            with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as f:
+                f.write(webm_data)
+                temp_webm_files.append(f.name)
+                print(f'  📁 片段 {i+1}: {f.name} ({len(webm_data)} bytes)')
+
+        # 并行预检，同时得到编码信息
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=SEGMENT_PARALLELISM) as pool:
+            infos = list(pool.map(_probe_segment, range(len(temp_webm_files)), temp_webm_files))
+        valid = [i for i, info in enumerate(infos) if info]
+        if not valid:
+            raise Exception('所有视频片段都转换失败，无法继续处理')
+
+        valid_infos = [infos[i] for i in valid]
+        source_bytes = sum(len(segments[i]) for i in valid)
+        strategy = video_ingest.choose_strategy(valid_infos)
+        if strategy == video_ingest.PASSTHROUGH:
+            # concat 需要统一的 MP4 文件，换封装即可
+            strategy = video_ingest.REMUX
+        plan = media_budget.plan_budget(valid_infos, budget, source_bytes) if budget else None
+        if plan and plan['reencode']:
+            strategy = video_ingest.TRANSCODE
+        budget_args = media_budget.video_budget_args(plan) if plan else []
+        print(f'🎞️ 输入视频 {video_ingest.describe(valid_infos[0])} → {strategy}')
+        if plan and plan['reductions']:
+            print(f'📐 媒体预算: {"，".join(plan["reductions"])}')
+
+        # 将所有 WebM 并行转换为 MP4（ffmpeg 合并 MP4 更可靠）
+        print(f'🔄 第一步：并行转换 {len(valid)} 个片段为 MP4（最多 {SEGMENT_PARALLELISM} 个同时进行）...')
+        segment_args = video_ingest.codec_args(strategy, valid_infos)
+        if strategy == video_ingest.TRANSCODE:
+            segment_args += budget_args
+        converted, failed = _convert_segments(temp_webm_files, valid, segment_args, mp4_paths, in_flight)
+        if strategy == video_ingest.REMUX and failed:
+            print('⚠️ 部分片段换封装失败，改为全部完整重编码')
+            strategy = video_ingest.TRANSCODE
+            converted, failed = _convert_segments(
+                temp_webm_files, valid, video_ingest.TRANSCODE_ARGS + budget_args, mp4_paths, in_flight
+            )
+        video_ingest.record_strategy(strategy)
+
+        temp_mp4_files = [path for path in converted if path]
+        print(f'⏱️ 片段转换耗时 {time.perf_counter() - started:.2f}s，成功 {len(temp_mp4_files)}/{len(segments)} 个')
+
+        # 检查是否有有效的 MP4 文件
+        if not temp_mp4_files:
+            raise Exception('所有视频片段都转换失败，无法继续处理')
+
+        # 创建 ffmpeg concat 文件列表（保持原始顺序）
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as concat_file:
+            for mp4_path in temp_mp4_files:
+                concat_file.write(f"file '{mp4_path}'\n")
+            concat_file_path = concat_file.name
+
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as output_file:
+            output_path = output_file.name
+
+        print('🔄 第二步：合并所有 MP4 文件...')
+        run_ffmpeg([
+            'ffmpeg', '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', concat_file_path,
+            '-c', 'copy',  # 直接复制流，不重新编码（更快）
+            *(media_budget.trim_args(plan) if plan else []),
+            output_path
+        ])
+
+        with open(output_path, 'rb') as f:
+            video_data = f.read()
+
+        print(f'📦 合并后 MP4 大小: {len(video_data)} bytes')
+        report = media_budget.budget_report(plan, source_bytes, len(video_data)) if plan else None
+        return video_data, report
+    finally:
+        # 出错时等仍在运行的转码结束，再清理临时文件
+        if in_flight:
+            wait(in_flight)
+        for path in temp_webm_files + mp4_paths + [concat_file_path, output_path]:
+            if path and os.path.exists(path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+TTS_MODEL = 'qwen3-tts-flash'
+
+
+class _TTSStatusError(Exception):
+    """DashScope 返回了非 200 状态（只结束本段合成，不向调用方抛出）"""
+
+
+def synthesize_speech(text, voice='Cherry', language='Chinese'):
+    """
+    调用 Qwen3-TTS 流式合成语音
+
+    相同的 (文本, 音色, 语言) 合成过一次后从本地缓存直接产出（见 tts_cache.py）
+
+    返回:
+        generator: 产出 PCM 数据（24kHz 16-bit mono）
+    """
+    try:
+        yield from cached_tts(text, voice, language, TTS_MODEL, _synthesize_speech_upstream)
+    except _TTSStatusError as e:
+        print(f'❌ TTS 错误: {e}')
+
+
+def _synthesize_speech_upstream(text, voice, language):
+    """调用 DashScope 流式合成（不经过缓存）"""
+    # 注意：Qwen3-TTS 使用 text 参数，不是 messages
+    responses = dashscope.MultiModalConversation.call(
+        model=TTS_MODEL,
+        text=text,
+        voice=voice,
+        language_type=language,
+        stream=True,
+        **dashscope_options()
+    )
+
+    for response in responses:
+        if response.status_code == 200:
+            audio = response.output.get('audio', {})
+            if audio and audio.data:
+                # DashScope 返回 base64 编码的 PCM 数据
+                yield base64.b64decode(audio.data)
+
+            if response.output.get('finish_reason') == 'stop':
+                print(f'✅ TTS 流式生成完成')
+                break
+        else:
+            # 抛出异常而不是直接结束，出错的结果不会写入缓存
+            raise _TTSStatusError(response.message)
+
+
 @app.route('/')
 def index():
     """主页"""
@@ -251,11 +639,17 @@ def serve_test_audio(filename):
     return send_from_directory('test/audios', filename)
 
 
+# 图片点评使用固定的提示词和音色，同一张图片的响应可以直接重放（见 response_cache）
+IMAGE_COMMENTARY_PROMPT = '请详细点评这张图片，描述图片的内容、构图、色彩、意境等方面。'
+IMAGE_COMMENTARY_VOICE = 'Cherry'
+image_commentary_cache = create_response_cache('image_commentary')
+
+
 @app.route('/api/image-commentary-streaming', methods=['POST'])
 def image_commentary_streaming():
     """
     处理图片点评（流式返回）
-    接收图片，实时流式返回音频点评
+    接收图片，实时流式返回音频点评（protocol=2 时为类型化帧，见 stream_protocol）
     """
     try:
         print('\n' + '='*80)
@@ -268,12 +662,9 @@ def image_commentary_streaming():
             return jsonify({'error': '缺少图片文件'}), 400
 
         # 读取图片数据
-        image_data = image_file.read()
+        image_data = read_upload(image_file)
         print(f'📦 图片大小: {len(image_data)} bytes')
 
-        # Base64 编码图片
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
-
         # 获取图片格式（从文件名）
         filename = image_file.filename.lower()
         if filename.endswith('.jpg') or filename.endswith('.jpeg'):
@@ -289,15 +680,37 @@ def image_commentary_streaming():
             image_format = 'jpeg'
 
         print(f'🖼️ 图片格式: {image_format}')
-        print(f'🔐 Base64 编码长度: {len(image_base64)} 字符')
+        output = open_response_stream(request.form, request.headers, LEGACY_WAV)
+
+        # 相同图片 + 模型 + 音色 + 提示词命中缓存时直接重放，不调用大模型
+        cache_key = None
+        if image_commentary_cache:
+            cache_key = image_commentary_cache.make_key(
+                image_data, image_format, MODEL, IMAGE_COMMENTARY_VOICE, IMAGE_COMMENTARY_PROMPT
+            )
+            cached = image_commentary_cache.get(cache_key)
+            if cached:
+                print(f'💾 命中响应缓存，重放 {len(cached.chunk_sizes)} 个音频块')
+                print(f'📝 完整文本: {cached.text}')
+
+                def replay():
+                    yield from output.start({'message': '', 'actions': [], 'cached': True})
+                    yield from output.text(cached.text)
+                    for pcm in cached.replay():
+                        yield from output.audio(pcm)
+                    yield from output.end(cache_hit=True)
+
+                return Response(output.guard(replay()), mimetype='application/octet-stream', headers=output.headers)
+
+        # 使用 data URI 格式（与官方示例类似），发送时边编码边上传
+        image_data_uri = DataURI(f'image/{image_format}', image_data)
+        print(f'🔐 Base64 编码长度: {len(image_data_uri)} 字符')
 
         # 调用大模型（qwen3-omni-flash 支持图片输入和音频输出）
         print(f'⏳ 调用大模型 {MODEL}...')
 
-        # 使用 data URI 格式（与官方示例类似）
-        image_data_uri = f'data:image/{image_format};base64,{image_base64}'
-
-        stream = client.chat.completions.create(
+        stream = create_chat_completion(
+            client,
             model=MODEL,
             messages=[
                 {
@@ -311,27 +724,30 @@ def image_commentary_streaming():
                         },
                         {
                             'type': 'text',
-                            'text': '请详细点评这张图片，描述图片的内容、构图、色彩、意境等方面。'
+                            'text': IMAGE_COMMENTARY_PROMPT
                         }
                     ]
                 }
             ],
             modalities=['text', 'audio'],  # 请求音频输出
-            audio={'voice': 'Cherry', 'format': 'wav'},
+            audio={'voice': IMAGE_COMMENTARY_VOICE, 'format': 'wav'},
             stream=True,
             stream_options={'include_usage': True}
         )
 
         print('✅ 开始流式返回音频片段')
 
+        # 未命中：边返回边写入缓存，完整结束后才对其他请求可见
+        cache_writer = image_commentary_cache.writer(cache_key) if cache_key else None
+
         def generate():
             """生成器函数，累积音频后返回较大的片段"""
             text_content = ''
             audio_chunk_count = 0
-            pcm_buffer = b''  # PCM 缓冲区
-            MIN_CHUNK_SIZE = 24000  # 最小块大小：24KB (约 0.5 秒音频 @ 24kHz 16-bit mono)
-            # 更小的块可以减少队列积压，避免 "Queue is full" 警告
+            # 第一块很小以尽快开始播放，之后逐渐增大到 24KB（约 0.5 秒），避免客户端 "Queue is full" 警告
+            chunker = PCMChunker()
 
+            yield from output.start({'message': '', 'actions': []})
             for chunk in stream:
                 if chunk.choices:
                     delta = chunk.choices[0].delta
@@ -340,6 +756,7 @@ def image_commentary_streaming():
                     if hasattr(delta, 'content') and delta.content:
                         text_content += delta.content
                         print(f'📝 文本片段: {delta.content}')
+                        yield from output.text(delta.content)
 
                     # 累积音频片段
                     if hasattr(delta, 'audio') and delta.audio:
@@ -348,34 +765,40 @@ def image_commentary_streaming():
 
                             # 解码 base64 音频数据并累积到缓冲区
                             pcm_chunk = base64.b64decode(audio_data_chunk)
-                            pcm_buffer += pcm_chunk
-                            print(f'🔊 累积音频数据: +{len(pcm_chunk)} bytes, 总计: {len(pcm_buffer)} bytes')
+                            print(f'🔊 累积音频数据: +{len(pcm_chunk)} bytes')
 
-                            # 当缓冲区达到最小大小时，返回一个完整的 WAV 块
-                            if len(pcm_buffer) >= MIN_CHUNK_SIZE:
+                            # 凑满一块时返回
+                            for pcm in chunker.feed(pcm_chunk):
                                 audio_chunk_count += 1
-                                wav_chunk = add_wav_header(pcm_buffer)
-                                print(f'✅ 返回音频块 #{audio_chunk_count}: {len(wav_chunk)} bytes')
-                                yield wav_chunk
-                                pcm_buffer = b''  # 清空缓冲区
+                                print(f'✅ 返回音频块 #{audio_chunk_count}: {len(pcm)} bytes')
+                                if cache_writer:
+                                    cache_writer.add_chunk(pcm)
+                                yield from output.audio(pcm)
                 else:
                     # 打印使用统计
                     if hasattr(chunk, 'usage') and chunk.usage:
                         print(f'📊 Token 使用: {chunk.usage}')
+                        record_prompt_usage(chunk.usage)
 
             # 返回剩余的音频数据（如果有）
-            if pcm_buffer:
+            pcm = chunker.flush()
+            if pcm:
                 audio_chunk_count += 1
-                wav_chunk = add_wav_header(pcm_buffer)
-                print(f'✅ 返回最后的音频块 #{audio_chunk_count}: {len(wav_chunk)} bytes')
-                yield wav_chunk
+                print(f'✅ 返回最后的音频块 #{audio_chunk_count}: {len(pcm)} bytes')
+                if cache_writer:
+                    cache_writer.add_chunk(pcm)
+                yield from output.audio(pcm)
 
             print(f'✅ 流式返回完成')
             print(f'📝 完整文本: {text_content}')
             print(f'🔊 总共返回 {audio_chunk_count} 个音频块')
+            if cache_writer:
+                cache_writer.commit(text_content)
+            yield from output.end(cache_hit=False)
 
-        # 返回流式响应
-        return Response(generate(), mimetype='application/octet-stream')
+        # 返回流式响应（出错或客户端断开时 guard 放弃写入缓存）
+        body = cache_writer.guard(generate()) if cache_writer else generate()
+        return Response(output.guard(body), mimetype='application/octet-stream', headers=output.headers)
 
     except Exception as e:
         print(f'❌ 错误: {str(e)}')
@@ -388,7 +811,7 @@ def image_commentary_streaming():
 def audio_chat_streaming():
     """
     处理音频对话（流式返回）
-    接收音频，实时流式返回音频片段
+    接收音频，实时流式返回音频片段（protocol=2 时为类型化帧，见 stream_protocol）
     """
     try:
         print('\n' + '='*80)
@@ -401,50 +824,22 @@ def audio_chat_streaming():
             return jsonify({'error': '缺少音频文件'}), 400
 
         # 读取音频数据（WebM 格式）
-        webm_data = audio_file.read()
+        webm_data = read_upload(audio_file)
         print(f'📦 WebM 音频大小: {len(webm_data)} bytes')
+        output = open_response_stream(request.form, request.headers, LEGACY_WAV)
 
         # 转换 WebM 音频为 WAV 格式（阿里云 API 支持 WAV 格式）
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as input_file:
-            input_file.write(webm_data)
-            input_path = input_file.name
-
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as output_file:
-            output_path = output_file.name
-
-        try:
-            print('🔄 正在将 WebM 转换为 WAV 格式...')
-            # 转换为 WAV 格式
-            subprocess.run([
-                'ffmpeg', '-y', '-i', input_path,
-                '-ar', '24000',  # 采样率 24kHz (阿里云推荐)
-                '-ac', '1',  # 单声道
-                '-sample_fmt', 's16',  # 16位采样
-                output_path
-            ], check=True, capture_output=True, text=True)
-
-            with open(output_path, 'rb') as f:
-                wav_data = f.read()
-
-            print(f'📦 转换后 WAV 大小: {len(wav_data)} bytes')
-
-            # Base64 编码
-            audio_base64 = base64.b64encode(wav_data).decode('utf-8')
-            print(f'🔐 Base64 编码长度: {len(audio_base64)} 字符')
-
-        finally:
-            os.unlink(input_path)
-            if os.path.exists(output_path):
-                os.unlink(output_path)
+        wav_data = convert_webm_to_wav(webm_data)
 
         # 调用大模型（qwen3-omni-flash 支持音频输入和输出）
         print(f'⏳ 调用大模型 {MODEL}...')
 
-        # 使用 data URI 格式（与视频输入相同的方式）
-        audio_data_uri = f'data:audio/wav;base64,{audio_base64}'
+        # 使用 data URI 格式（与视频输入相同的方式），发送时边编码边上传
+        audio_data_uri = DataURI('audio/wav', wav_data)
         print(f'🔗 音频 Data URI 长度: {len(audio_data_uri)} 字符')
 
-        stream = client.chat.completions.create(
+        stream = create_chat_completion(
+            client,
             model=MODEL,
             messages=[
                 {
@@ -476,10 +871,10 @@ def audio_chat_streaming():
             """生成器函数，累积音频后返回较大的片段"""
             text_content = ''
             audio_chunk_count = 0
-            pcm_buffer = b''  # PCM 缓冲区
-            MIN_CHUNK_SIZE = 24000  # 最小块大小：24KB (约 0.5 秒音频 @ 24kHz 16-bit mono)
-            # 更小的块可以减少队列积压，避免 "Queue is full" 警告
+            # 第一块很小以尽快开始播放，之后逐渐增大到 24KB（约 0.5 秒），避免客户端 "Queue is full" 警告
+            chunker = PCMChunker()
 
+            yield from output.start({'message': '', 'actions': []})
             for chunk in stream:
                 if chunk.choices:
                     delta = chunk.choices[0].delta
@@ -488,6 +883,7 @@ def audio_chat_streaming():
                     if hasattr(delta, 'content') and delta.content:
                         text_content += delta.content
                         print(f'📝 文本片段: {delta.content}')
+                        yield from output.text(delta.content)
 
                     # 累积音频片段
                     if hasattr(delta, 'audio') and delta.audio:
@@ -496,35 +892,37 @@ def audio_chat_streaming():
 
                             # 解码 base64 音频数据并累积到缓冲区
                             pcm_chunk = base64.b64decode(audio_data_chunk)
-                            pcm_buffer += pcm_chunk
-                            print(f'🔊 累积音频数据: +{len(pcm_chunk)} bytes, 总计: {len(pcm_buffer)} bytes')
+                            print(f'🔊 累积音频数据: +{len(pcm_chunk)} bytes')
 
-                            # 当缓冲区达到最小大小时，返回一个完整的 WAV 块
-                            if len(pcm_buffer) >= MIN_CHUNK_SIZE:
+                            # 凑满一块时返回
+                            for pcm in chunker.feed(pcm_chunk):
                                 audio_chunk_count += 1
-                                wav_chunk = add_wav_header(pcm_buffer)
-                                print(f'✅ 返回音频块 #{audio_chunk_count}: {len(wav_chunk)} bytes')
-                                yield wav_chunk
-                                pcm_buffer = b''  # 清空缓冲区
+                                print(f'✅ 返回音频块 #{audio_chunk_count}: {len(pcm)} bytes')
+                                yield from output.audio(pcm)
                 else:
                     # 打印使用统计
                     if hasattr(chunk, 'usage') and chunk.usage:
                         print(f'📊 Token 使用: {chunk.usage}')
+                        record_prompt_usage(chunk.usage)
 
             # 返回剩余的音频数据（如果有）
-            if pcm_buffer:
+            pcm = chunker.flush()
+            if pcm:
                 audio_chunk_count += 1
-                wav_chunk = add_wav_header(pcm_buffer)
-                print(f'✅ 返回最后的音频块 #{audio_chunk_count}: {len(wav_chunk)} bytes')
-                yield wav_chunk
+                print(f'✅ 返回最后的音频块 #{audio_chunk_count}: {len(pcm)} bytes')
+                yield from output.audio(pcm)
 
             print(f'✅ 流式返回完成')
             print(f'📝 完整文本: {text_content}')
             print(f'🔊 总共返回 {audio_chunk_count} 个音频块')
+            yield from output.end()
 
         # 返回流式响应
-        return Response(generate(), mimetype='application/octet-stream')
+        return Response(output.guard(generate()), mimetype='application/octet-stream', headers=output.headers)
 
+    except TranscodeRejected as e:
+        print(f'⚠️ 转码服务繁忙: {e}')
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f'❌ 错误: {str(e)}')
         import traceback
@@ -549,47 +947,22 @@ def audio_chat():
             return jsonify({'error': '缺少音频文件'}), 400
 
         # 读取音频数据（WebM 格式）
-        webm_data = audio_file.read()
+        webm_data = read_upload(audio_file)
         print(f'📦 WebM 音频大小: {len(webm_data)} bytes')
 
         # 转换 WebM 音频为 WAV 格式（阿里云 API 支持 WAV 格式）
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as input_file:
-            input_file.write(webm_data)
-            input_path = input_file.name
+        wav_data = convert_webm_to_wav(webm_data)
 
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as output_file:
-            output_path = output_file.name
-
-        try:
-            print('🔄 正在将 WebM 转换为 WAV 格式...')
-            # 转换为 WAV 格式
-            subprocess.run([
-                'ffmpeg', '-y', '-i', input_path,
-                '-ar', '24000',  # 采样率 24kHz (阿里云推荐)
-                '-ac', '1',  # 单声道
-                '-sample_fmt', 's16',  # 16位采样
-                output_path
-            ], check=True, capture_output=True, text=True)
-
-            with open(output_path, 'rb') as f:
-                wav_data = f.read()
-
-            print(f'📦 转换后 WAV 大小: {len(wav_data)} bytes')
-
-            # Base64 编码
-            audio_base64 = base64.b64encode(wav_data).decode('utf-8')
-            print(f'🔐 Base64 编码长度: {len(audio_base64)} 字符')
-
-        finally:
-            os.unlink(input_path)
-            if os.path.exists(output_path):
-                os.unlink(output_path)
+        # Base64 编码（不带 data: 前缀，发送时边编码边上传）
+        audio_base64 = DataURI(None, wav_data)
+        print(f'🔐 Base64 编码长度: {len(audio_base64)} 字符')
 
         # 调用大模型（qwen3-omni-flash 支持音频输入和输出）
         print(f'⏳ 调用大模型 {MODEL}...')
 
         # 使用官方文档中的 input_audio 类型
-        stream = client.chat.completions.create(
+        stream = create_chat_completion(
+            client,
             model=MODEL,
             messages=[
                 {
@@ -640,6 +1013,7 @@ def audio_chat():
                 # 打印使用统计
                 if hasattr(chunk, 'usage') and chunk.usage:
                     print(f'📊 Token 使用: {chunk.usage}')
+                    record_prompt_usage(chunk.usage)
 
         print(f'✅ 流式响应接收完成')
         print(f'📝 完整文本: {text_content}')
@@ -694,6 +1068,9 @@ def audio_chat():
             'audioFormat': audio_format
         })
 
+    except TranscodeRejected as e:
+        print(f'⚠️ 转码服务繁忙: {e}')
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f'❌ 错误: {str(e)}')
         import traceback
@@ -708,7 +1085,7 @@ def audio_chat():
 def video_auto_chat():
     """
     处理视频自动采集对话（流式返回）
-    接收单个或多个视频片段，自动合并后发送给 AI，实时流式返回音频片段
+    接收单个或多个视频片段，自动合并后发送给 AI，实时流式返回音频片段（protocol=2 时为类型化帧，见 stream_protocol）
     """
     try:
         print('\n' + '='*80)
@@ -721,103 +1098,29 @@ def video_auto_chat():
             return jsonify({'error': '缺少视频文件'}), 400
 
         print(f'📦 收到 {len(video_files)} 个视频片段')
+        output = open_response_stream(request.form, request.headers, LEGACY_WAV)
 
         # 如果只有一个视频，转换为 MP4（Qwen API 不支持 WebM）
         if len(video_files) == 1:
-            print('📹 单个视频片段，转换为 MP4（Qwen API 要求）')
-            webm_data = video_files[0].read()
+            print('📹 单个视频片段，按编码选择直传 / 换封装 / 重编码（Qwen API 不支持 WebM）')
+            webm_data = read_upload(video_files[0])
             print(f'📦 WebM 大小: {len(webm_data)} bytes')
 
-            # 转换为 MP4
-            video_data = convert_webm_to_mp4(webm_data)
-            video_mime = 'video/mp4'
-            print(f'✅ MP4 转换成功，大小: {len(video_data)} bytes')
+            # 按编码和媒体预算选择直传 / 换封装 / 重编码
+            video_data, video_mime, media_report = prepare_video(webm_data, get_budget('video-auto-chat'))
+            print(f'✅ 视频准备完成（{video_mime}），大小: {len(video_data)} bytes')
         else:
             # 多个视频，使用 ffmpeg 合并为 MP4
             print(f'🔀 多个视频片段，开始合并 {len(video_files)} 个片段')
 
-            # 保存所有 WebM 文件到临时文件
-            temp_webm_files = []
-            temp_mp4_files = []
-
-            for i, video_file in enumerate(video_files):
-                webm_data = video_file.read()
-                with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as f:
-                    f.write(webm_data)
-                    temp_webm_files.append(f.name)
-                    print(f'  📁 片段 {i+1}: {f.name} ({len(webm_data)} bytes)')
-
-            # 将所有 WebM 转换为 MP4（ffmpeg 合并 MP4 更可靠）
-            print('🔄 第一步：将所有 WebM 转换为 MP4...')
-            for i, webm_path in enumerate(temp_webm_files):
-                mp4_path = webm_path.replace('.webm', '.mp4')
-                try:
-                    print(f'  🔄 正在转换片段 {i+1}...')
-                    result = subprocess.run([
-                        'ffmpeg', '-y', '-i', webm_path,
-                        '-vcodec', 'libx264', '-acodec', 'aac',
-                        '-preset', 'ultrafast', '-crf', '28',
-                        mp4_path
-                    ], check=True, capture_output=True, text=True)
-                    temp_mp4_files.append(mp4_path)
-                    print(f'  ✅ 片段 {i+1} 已转换为 MP4')
-                except subprocess.CalledProcessError as e:
-                    print(f'  ❌ 片段 {i+1} 转换失败 (退出码 {e.returncode}):')
-                    print(f'  === FFmpeg stdout (片段 {i+1}) ===')
-                    print(e.stdout if e.stdout else '(无输出)')
-                    print(f'  === FFmpeg stderr (片段 {i+1}) ===')
-                    print(e.stderr if e.stderr else '(无输出)')
-                    print(f'  ================================')
-
-                    # 跳过损坏的片段，继续处理其他片段
-                    print(f'  ⚠️ 跳过损坏的片段 {i+1}，继续处理其他片段...')
-                    continue
-
-            # 检查是否有有效的 MP4 文件
-            if not temp_mp4_files:
-                raise Exception('所有视频片段都转换失败，无法继续处理')
-
-            # 创建 ffmpeg concat 文件列表
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as concat_file:
-                for mp4_path in temp_mp4_files:
-                    concat_file.write(f"file '{mp4_path}'\n")
-                concat_file_path = concat_file.name
-
-            print(f'📝 Concat 文件: {concat_file_path}')
-
-            # 合并所有 MP4 文件
-            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as output_file:
-                output_path = output_file.name
-
-            print('🔄 第二步：合并所有 MP4 文件...')
-            subprocess.run([
-                'ffmpeg', '-y',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', concat_file_path,
-                '-c', 'copy',  # 直接复制流，不重新编码（更快）
-                output_path
-            ], check=True, capture_output=True, text=True)
-
-            print(f'✅ 视频合并完成: {output_path}')
-
-            # 读取合并后的 MP4 数据
-            with open(output_path, 'rb') as f:
-                video_data = f.read()
-                video_mime = 'video/mp4'
-
-            print(f'📦 合并后 MP4 大小: {len(video_data)} bytes')
-
-            # 清理临时文件
-            for path in temp_webm_files + temp_mp4_files + [concat_file_path, output_path]:
-                try:
-                    os.unlink(path)
-                except:
-                    pass
+            video_data, media_report = merge_video_segments(
+                [read_upload(video_file) for video_file in video_files], get_budget('video-auto-chat')
+            )
+            video_mime = 'video/mp4'
 
-        # 编码为 base64
-        video_base64 = base64.b64encode(video_data).decode('utf-8')
-        print(f'🔐 Base64 编码长度: {len(video_base64)} 字符')
+        # data URI 在发送时边编码边上传（见 request_encoder），不在内存中生成 base64 副本
+        video_uri = DataURI(video_mime, video_data)
+        print(f'🔐 Base64 编码长度: {len(video_uri)} 字符')
 
         # 调用大模型（流式返回）
         print(f'⏳ 调用大模型 {MODEL}...')
@@ -825,13 +1128,14 @@ def video_auto_chat():
         print(f'   - model: {MODEL}')
         print(f'   - video_format: {video_mime}')
         print(f'   - video_size: {len(video_data)} bytes ({len(video_data) / 1024 / 1024:.2f} MB)')
-        print(f'   - base64_length: {len(video_base64)} 字符')
+        print(f'   - base64_length: {len(video_uri)} 字符')
         print(f'   - modalities: [text, audio]')
         print(f'   - audio_voice: Cherry')
         print(f'   - audio_format: wav')
         print(f'   - stream: True')
 
-        stream = client.chat.completions.create(
+        stream = create_chat_completion(
+            client,
             model=MODEL,
             messages=[
                 {
@@ -839,7 +1143,7 @@ def video_auto_chat():
                     'content': [
                         {
                             'type': 'video_url',
-                            'video_url': {'url': f'data:{video_mime};base64,{video_base64}'}
+                            'video_url': {'url': video_uri}
                         },
                         {
                             'type': 'text',
@@ -860,9 +1164,9 @@ def video_auto_chat():
             """生成器函数，累积音频后返回较大的片段"""
             text_content = ''
             audio_chunk_count = 0
-            pcm_buffer = b''
-            MIN_CHUNK_SIZE = 24000  # 24KB (约 0.5 秒音频)
+            chunker = PCMChunker()  # 第一块很小，之后逐渐增大到 24KB（约 0.5 秒音频）
 
+            yield from output.start({'message': '', 'actions': [], 'media_budget': media_report})
             for chunk in stream:
                 if chunk.choices:
                     delta = chunk.choices[0].delta
@@ -871,6 +1175,7 @@ def video_auto_chat():
                     if hasattr(delta, 'content') and delta.content:
                         text_content += delta.content
                         print(f'📝 文本片段: {delta.content}')
+                        yield from output.text(delta.content)
 
                     # 累积音频片段
                     if hasattr(delta, 'audio') and delta.audio:
@@ -879,35 +1184,40 @@ def video_auto_chat():
 
                             # 解码 base64 音频数据并累积到缓冲区
                             pcm_chunk = base64.b64decode(audio_data_chunk)
-                            pcm_buffer += pcm_chunk
-                            print(f'🔊 累积音频数据: +{len(pcm_chunk)} bytes, 总计: {len(pcm_buffer)} bytes')
+                            print(f'🔊 累积音频数据: +{len(pcm_chunk)} bytes')
 
-                            # 当缓冲区达到最小大小时，返回一个完整的 WAV 块
-                            if len(pcm_buffer) >= MIN_CHUNK_SIZE:
+                            # 凑满一块时返回
+                            for pcm in chunker.feed(pcm_chunk):
                                 audio_chunk_count += 1
-                                wav_chunk = add_wav_header(pcm_buffer)
-                                print(f'✅ 返回音频块 #{audio_chunk_count}: {len(wav_chunk)} bytes')
-                                yield wav_chunk
-                                pcm_buffer = b''
+                                print(f'✅ 返回音频块 #{audio_chunk_count}: {len(pcm)} bytes')
+                                yield from output.audio(pcm)
                 else:
                     # 打印使用统计
                     if hasattr(chunk, 'usage') and chunk.usage:
                         print(f'📊 Token 使用: {chunk.usage}')
+                        record_prompt_usage(chunk.usage)
 
             # 返回剩余的音频数据
-            if pcm_buffer:
+            pcm = chunker.flush()
+            if pcm:
                 audio_chunk_count += 1
-                wav_chunk = add_wav_header(pcm_buffer)
-                print(f'✅ 返回最后的音频块 #{audio_chunk_count}: {len(wav_chunk)} bytes')
-                yield wav_chunk
+                print(f'✅ 返回最后的音频块 #{audio_chunk_count}: {len(pcm)} bytes')
+                yield from output.audio(pcm)
 
             print(f'✅ 流式返回完成')
             print(f'📝 完整文本: {text_content}')
             print(f'🔊 总共返回 {audio_chunk_count} 个音频块')
+            yield from output.end()
 
-        # 返回流式响应
-        return Response(generate(), mimetype='application/octet-stream')
+        # 返回流式响应（v1 只返回音频，媒体预算报告放在响应头中）
+        headers = dict(output.headers)
+        if media_report:
+            headers['X-Media-Budget'] = json.dumps(media_report)
+        return Response(output.guard(generate()), mimetype='application/octet-stream', headers=headers)
 
+    except TranscodeRejected as e:
+        print(f'⚠️ 转码服务繁忙: {e}')
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f'❌ 错误: {str(e)}')
         import traceback
@@ -932,17 +1242,18 @@ def chat():
             return jsonify({'error': '缺少视频文件'}), 400
 
         # 转换视频格式
-        webm_data = video_file.read()
+        webm_data = read_upload(video_file)
         print(f'📦 WebM 文件大小: {len(webm_data)} bytes')
 
-        mp4_data = convert_webm_to_mp4(webm_data)
-        video_base64 = base64.b64encode(mp4_data).decode('utf-8')
-        print(f'🔐 Base64 编码长度: {len(video_base64)} 字符')
+        video_data, video_mime, media_report = prepare_video(webm_data, get_budget('chat'))
+        video_uri = DataURI(video_mime, video_data)
+        print(f'🔐 Base64 编码长度: {len(video_uri)} 字符')
 
         # 调用大模型（qwen3-omni-flash 支持视频输入和音频输出）
         # 重要：stream 必须为 True 才能返回音频！
         print(f'⏳ 调用大模型 {MODEL}...')
-        stream = client.chat.completions.create(
+        stream = create_chat_completion(
+            client,
             model=MODEL,
             messages=[
                 {
@@ -950,7 +1261,7 @@ def chat():
                     'content': [
                         {
                             'type': 'video_url',
-                            'video_url': {'url': f'data:video/mp4;base64,{video_base64}'}
+                            'video_url': {'url': video_uri}
                         },
                         {
                             'type': 'text',
@@ -991,6 +1302,7 @@ def chat():
                 # 打印使用统计
                 if hasattr(chunk, 'usage') and chunk.usage:
                     print(f'📊 Token 使用: {chunk.usage}')
+                    record_prompt_usage(chunk.usage)
 
         print(f'✅ 流式响应接收完成')
         print(f'📝 完整文本: {text_content}')
@@ -1036,7 +1348,8 @@ def chat():
             return jsonify({
                 'success': True,
                 'text': text_content,
-                'hasAudio': False
+                'hasAudio': False,
+                'mediaBudget': media_report
             })
 
         # 返回音频（base64）
@@ -1045,9 +1358,13 @@ def chat():
             'text': text_content,
             'hasAudio': True,
             'audio': base64.b64encode(audio_data).decode('utf-8'),
-            'audioFormat': audio_format
+            'audioFormat': audio_format,
+            'mediaBudget': media_report
         })
 
+    except TranscodeRejected as e:
+        print(f'⚠️ 转码服务繁忙: {e}')
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f'❌ 错误: {str(e)}')
         import traceback
@@ -1063,20 +1380,22 @@ def video_auto_chat_with_tts():
     """
     视频理解 + 流式 TTS 合成
     分离式架构：视频理解（纯文本）+ Qwen3-TTS 流式合成
-    支持多轮对话（通过 session_id）
+    支持多轮对话（通过 session_id）；protocol=2 时为类型化帧（见 stream_protocol）
     """
     try:
         print('\n' + '='*80)
         print('🎯 收到视频理解 + 流式 TTS 请求')
         print('='*80)
 
+        started_at = time.perf_counter()
+
         # 0. 获取会话 ID（用于对话历史管理）
         session_id = request.form.get('session_id', 'default')
         print(f'🔑 会话 ID: {session_id}')
 
         # 获取当前会话的历史对话
-        history = get_conversation_history(session_id)
-        print(f'📚 当前会话历史: {len(history)} 条消息')
+        history = get_history_window(session_id)
+        print(f'📚 当前会话历史: {len(history)} 条消息（token 预算内）')
 
         # 1. 获取并合并视频片段（复用现有逻辑）
         video_files = request.files.getlist('videos')
@@ -1087,66 +1406,20 @@ def video_auto_chat_with_tts():
 
         # 合并视频（与现有 video_auto_chat 相同的逻辑）
         if len(video_files) == 1:
-            print('📹 单个视频片段，转换为 MP4')
-            webm_data = video_files[0].read()
-            video_data = convert_webm_to_mp4(webm_data)
-            video_mime = 'video/mp4'
+            print('📹 单个视频片段，按编码选择直传 / 换封装 / 重编码')
+            webm_data = read_upload(video_files[0])
+            video_data, video_mime, media_report = prepare_video(webm_data, get_budget('video-auto-chat-with-tts'))
         else:
             print(f'🔀 多个视频片段，开始合并 {len(video_files)} 个片段')
-            temp_webm_files = []
-            temp_mp4_files = []
-
-            for i, video_file in enumerate(video_files):
-                webm_data = video_file.read()
-                with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as f:
-                    f.write(webm_data)
-                    temp_webm_files.append(f.name)
-
-            # 转换所有 WebM 为 MP4
-            for i, webm_path in enumerate(temp_webm_files):
-                mp4_path = webm_path.replace('.webm', '.mp4')
-                try:
-                    subprocess.run([
-                        'ffmpeg', '-y', '-i', webm_path,
-                        '-vcodec', 'libx264', '-acodec', 'aac',
-                        '-preset', 'ultrafast', '-crf', '28',
-                        mp4_path
-                    ], check=True, capture_output=True, text=True)
-                    temp_mp4_files.append(mp4_path)
-                except subprocess.CalledProcessError:
-                    print(f'  ⚠️ 跳过损坏的片段 {i+1}')
-                    continue
-
-            if not temp_mp4_files:
-                raise Exception('所有视频片段都转换失败')
-
-            # 创建 concat 文件并合并
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as concat_file:
-                for mp4_path in temp_mp4_files:
-                    concat_file.write(f"file '{mp4_path}'\n")
-                concat_file_path = concat_file.name
-
-            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as output_file:
-                output_path = output_file.name
-
-            subprocess.run([
-                'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
-                '-i', concat_file_path, '-c', 'copy', output_path
-            ], check=True, capture_output=True, text=True)
-
-            with open(output_path, 'rb') as f:
-                video_data = f.read()
-                video_mime = 'video/mp4'
-
-            # 清理临时文件
-            for path in temp_webm_files + temp_mp4_files + [concat_file_path, output_path]:
-                try:
-                    os.unlink(path)
-                except:
-                    pass
+            video_data, media_report = merge_video_segments(
+                [read_upload(video_file) for video_file in video_files], get_budget('video-auto-chat-with-tts')
+            )
+            video_mime = 'video/mp4'
 
-        # 2. 视频理解（只获取文本）
-        video_base64 = base64.b64encode(video_data).decode('utf-8')
+        # 2. 视频理解（只获取文本）；可选抽帧 + 音轨代替整段视频
+        video_parts, video_report = video_content_parts(
+            video_data, video_mime, resolve_video_input_mode(request.form)
+        )
 
         print('\n' + '='*80)
         print('📤 发送给大模型的完整请求（视频理解）')
@@ -1160,7 +1433,7 @@ def video_auto_chat_with_tts():
         print(f'      {system_prompt[:200]}...')
         print(f'      (总长度: {len(system_prompt)} 字符)')
         print(f'  [2] Role: user')
-        print(f'      Content: [video] data:{video_mime};base64,...(base64 {len(video_base64)} 字符)')
+        print(f'      Content: [{video_report["mode"]}] {[part["type"] for part in video_parts]}，上传 {video_report["upload_bytes"]} 字符')
         print('='*80 + '\n')
 
         print('⏳ 步骤 1: 调用 Qwen3-Omni-Flash 进行视频理解（纯文本模式）...')
@@ -1176,19 +1449,22 @@ def video_auto_chat_with_tts():
         # 添加当前用户视频
         messages.append({
             'role': 'user',
-            'content': [
-                {
-                    'type': 'video_url',
-                    'video_url': {'url': f'data:{video_mime};base64,{video_base64}'}
-                }
-            ]
+            'content': video_parts
         })
 
         print(f'📨 完整消息列表: 1 条系统提示词 + {len(history)} 条历史对话 + 1 条当前视频')
 
-        # 注意：虽然我们可以用 stream=True，但因为需要解析完整 JSON 才能提取 message 和 actions，
-        # 所以实际上还是需要等待完整响应。使用 stream=False 更简单直接。
-        understanding_response = client.chat.completions.create(
+        # 流水线模式：流式接收 JSON，message 每凑齐一句就送去 TTS，actions 在流末尾发送
+        pipeline = is_pipeline_requested(request.form)
+        output = open_response_stream(
+            request.form, request.headers, LEGACY_BLOCKS if pipeline else LEGACY_METADATA_WAV, started_at
+        )
+        if pipeline:
+            return video_tts_pipelined(session_id, messages, output, video_report, media_report)
+
+        # 非流水线模式需要解析完整 JSON 才能提取 message 和 actions，使用 stream=False 更简单直接。
+        understanding_response = create_chat_completion(
+            client,
             model=MODEL,
             messages=messages,
             modalities=['text'],  # 只要文本！
@@ -1197,28 +1473,24 @@ def video_auto_chat_with_tts():
 
         text_response = understanding_response.choices[0].message.content
         print(f'📝 AI 文本响应 (前200字符): {text_response[:200]}...')
+        usage = getattr(understanding_response, 'usage', None)
+        record_prompt_usage(usage)
+        record_video_turn(
+            video_report,
+            prompt_tokens=getattr(usage, 'prompt_tokens', None),
+            latency=time.perf_counter() - started_at
+        )
         print(f'📝 完整响应长度: {len(text_response)} 字符')
         print(f'⏱️  视频理解完成，立即开始 TTS 流式合成...')
 
         # 尝试解析 JSON（如果 system_prompt 要求返回 JSON）
-        tts_text = text_response
-        actions = []
-        try:
-            response_json = json.loads(text_response)
-            if 'message' in response_json:
-                tts_text = response_json.get('message', text_response)
-            if 'actions' in response_json:
-                actions = response_json.get('actions', [])
-                print(f'📋 解析到的 actions: {actions}')
-        except json.JSONDecodeError:
-            print('📝 响应不是 JSON 格式，直接使用文本')
+        tts_text, actions = parse_response_json(text_response)
 
         # 💾 保存对话历史
         # 注意：用户消息存储为文本摘要（"用户上传了视频"），而不是完整视频 base64
         # 因为视频数据太大，不适合存储在内存中
-        add_to_conversation_history(session_id, 'user', '用户上传了视频片段')
-        add_to_conversation_history(session_id, 'assistant', text_response)
-        print(f'💾 已保存对话历史，当前会话共 {len(get_conversation_history(session_id))} 条消息')
+        message_count = save_conversation_turn(session_id, '用户上传了视频片段', text_response)
+        print(f'💾 已保存对话历史，当前会话共 {message_count} 条消息')
 
         # 3. 流式 TTS 合成
         print(f'\n⏳ 步骤 2: 调用 Qwen3-TTS-Flash 进行流式音频合成...')
@@ -1231,85 +1503,158 @@ def video_auto_chat_with_tts():
                 metadata = {
                     'type': 'metadata',
                     'message': tts_text,
-                    'actions': actions
+                    'actions': actions,
+                    'media_budget': media_report
                 }
-                metadata_json = json.dumps(metadata, ensure_ascii=False)
-                metadata_bytes = metadata_json.encode('utf-8')
-
                 # 发送元数据长度（4字节）+ 元数据内容
-                metadata_length = len(metadata_bytes)
-                yield metadata_length.to_bytes(4, byteorder='big')  # 长度前缀
-                yield metadata_bytes  # JSON 数据
+                yield from output.start(metadata)
 
                 print(f'📋 已发送元数据块: {len(actions)} 个 actions, 消息长度 {len(tts_text)} 字符')
 
                 # ✅ 第二步：调用 Qwen3-TTS 流式 API 生成音频
-                # 注意：Qwen3-TTS 使用 text 参数，不是 messages
-                responses = dashscope.MultiModalConversation.call(
-                    model="qwen3-tts-flash",
-                    text=tts_text,  # ✅ 直接传 text 参数！
-                    voice="Cherry",
-                    language_type="Chinese",
-                    stream=True
-                )
-
                 chunk_count = 0
-                pcm_buffer = b''
-                MIN_CHUNK_SIZE = 24000  # 24KB (约 0.5 秒音频，与旧接口一致)
-
-                for response in responses:
-                    if response.status_code == 200:
-                        audio = response.output.get('audio', {})
-                        if audio and audio.data:
-                            # DashScope 返回 base64 编码的 PCM 数据
-                            pcm_chunk = base64.b64decode(audio.data)
-                            pcm_buffer += pcm_chunk
-                            print(f'  🔊 TTS 累积音频: +{len(pcm_chunk)} bytes, 总计: {len(pcm_buffer)} bytes')
-
-                            # 当缓冲区达到最小大小时，返回一个完整的 WAV 块
-                            if len(pcm_buffer) >= MIN_CHUNK_SIZE:
-                                chunk_count += 1
-                                wav_chunk = add_wav_header(pcm_buffer, sample_rate=24000)
-                                print(f'  ✅ 返回 TTS 音频块 #{chunk_count}: {len(wav_chunk)} bytes')
-                                yield wav_chunk
-                                pcm_buffer = b''
-
-                        if response.output.get('finish_reason') == 'stop':
-                            print(f'✅ TTS 流式生成完成')
-                            break
-                    else:
-                        print(f'❌ TTS 错误: {response.message}')
-                        break
+                chunker = PCMChunker()  # 第一块很小，之后逐渐增大到 24KB（约 0.5 秒音频，与旧接口一致）
+
+                for pcm_chunk in synthesize_speech(tts_text):
+                    print(f'  🔊 TTS 累积音频: +{len(pcm_chunk)} bytes')
+
+                    # 凑满一块时返回
+                    for pcm in chunker.feed(pcm_chunk):
+                        chunk_count += 1
+                        print(f'  ✅ 返回 TTS 音频块 #{chunk_count}: {len(pcm)} bytes')
+                        yield from output.audio(pcm)
 
                 # 返回剩余的音频数据
-                if pcm_buffer:
+                pcm = chunker.flush()
+                if pcm:
                     chunk_count += 1
-                    wav_chunk = add_wav_header(pcm_buffer, sample_rate=24000)
-                    print(f'  ✅ 返回最后的 TTS 音频块 #{chunk_count}: {len(wav_chunk)} bytes')
-                    yield wav_chunk
+                    print(f'  ✅ 返回最后的 TTS 音频块 #{chunk_count}: {len(pcm)} bytes')
+                    yield from output.audio(pcm)
 
-                print(f'🎵 TTS 总共返回 {chunk_count} 个 WAV 音频块')
+                print(f'🎵 TTS 总共返回 {chunk_count} 个音频块')
 
             except Exception as e:
                 print(f'❌ TTS 生成失败: {e}')
                 traceback.print_exc()
+                yield from output.error(e, 'tts')
+            yield from output.end()
 
         # 返回流式数据：先发送元数据块，再发送音频流
         return Response(
-            generate_audio_stream(),
+            output.guard(generate_audio_stream()),
             mimetype='application/octet-stream',
             headers={
                 'Content-Type': 'application/octet-stream',
-                'Cache-Control': 'no-cache'
+                'Cache-Control': 'no-cache',
+                **output.headers
             }
         )
 
+    except TranscodeRejected as e:
+        print(f'⚠️ 转码服务繁忙: {e}')
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f'❌ 处理失败: {e}')
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 
+def parse_response_json(text_response):
+    """
+    解析模型返回的 JSON（提取 message 和 actions）
+
+    兼容代码块包裹和尾部多余内容；响应不是 JSON 时直接使用原文本
+
+    返回:
+        (tts_text, actions)
+    """
+    tts_text, actions, is_json = parse_response(text_response)
+    if is_json:
+        print(f'📋 解析到的 actions: {actions}')
+    else:
+        print('📝 响应不是 JSON 格式，直接使用文本')
+    return tts_text, actions
+
+
+def video_tts_pipelined(session_id, messages, output, video_report=None, media_report=None):
+    """
+    视频理解 + 句子级流水线 TTS（返回格式见 tts_pipeline 模块说明，output 为 stream_protocol 的编码器）
+    """
+    print('⏳ 调用 Qwen3-Omni-Flash 进行视频理解（流水线模式）...')
+    stream = create_chat_completion(
+        client,
+        model=MODEL,
+        messages=messages,
+        modalities=['text'],
+        stream=True,
+        stream_options={'include_usage': True}
+    )
+
+    def generate_audio_stream():
+        yield from output.start({
+            'type': 'metadata',
+            'message': '',
+            'actions': [],
+            'pipeline': True,
+            'media_budget': media_report
+        })
+
+        pipeline = SentencePipeline(iter_content_deltas(stream, on_usage=record_prompt_usage), synthesize_speech)
+        chunk_count = 0
+        chunker = PCMChunker()
+
+        try:
+            for kind, value in pipeline:
+                if kind == 'action':
+                    # actions 元素解析完整即发送，不必等到音频结束
+                    yield from output.action(value)
+                    continue
+                if kind == 'text':
+                    yield from output.text(value)
+                    continue
+
+                for pcm in chunker.feed(value):
+                    chunk_count += 1
+                    yield from output.audio(pcm)
+
+            pcm = chunker.flush()
+            if pcm:
+                chunk_count += 1
+                yield from output.audio(pcm)
+            print(f'🎵 流水线 TTS 完成，{pipeline.sentence_count} 句，共 {chunk_count} 个音频块')
+        except Exception as e:
+            print(f'❌ 流水线 TTS 失败: {e}')
+            traceback.print_exc()
+            yield from output.error(e, 'pipeline')
+
+        text_response = pipeline.text
+        if text_response:
+            print(f'📝 AI 文本响应 (前200字符): {text_response[:200]}...')
+            if video_report:
+                record_video_turn(video_report)
+            tts_text, actions = parse_response_json(text_response)
+
+            message_count = save_conversation_turn(session_id, '用户上传了视频片段', text_response)
+            print(f'💾 已保存对话历史，当前会话共 {message_count} 条消息')
+
+            yield from output.update({
+                'type': 'metadata_update',
+                'message': tts_text,
+                'actions': actions
+            })
+        yield from output.end(sentences=pipeline.sentence_count)
+
+    return Response(
+        output.guard(generate_audio_stream()),
+        mimetype='application/octet-stream',
+        headers={
+            'Content-Type': 'application/octet-stream',
+            'Cache-Control': 'no-cache',
+            **output.headers
+        }
+    )
+
+
 @app.route('/api/system-prompt', methods=['GET'])
 def get_system_prompt():
     """获取当前的系统提示词"""
@@ -1367,6 +1712,70 @@ def get_latest_videos():
     return jsonify(result)
 
 
+@app.route('/api/transcoder/stats', methods=['GET'])
+def get_transcoder_stats():
+    """获取 FFmpeg 转码服务指标（排队等待、编码耗时、拒绝/超时/损坏计数、输入视频处理策略）"""
+    stats = get_transcode_stats()
+    stats['video_strategies'] = video_ingest.get_strategy_stats()
+    return jsonify(stats)
+
+
+@app.route('/api/video-input/stats', methods=['GET'])
+def get_video_input_stats_api():
+    """按视频输入方式（整段视频 / 抽帧 + 音轨）对比平均上传字节数、输入 token 数和耗时"""
+    return jsonify(get_video_input_stats())
+
+
+@app.route('/api/uploads/stats', methods=['GET'])
+def get_upload_stats_api():
+    """上传统计：处理中的上传总量、峰值、因超限 / 配额被拒绝的次数及各接口上限"""
+    return jsonify(get_upload_stats())
+
+
+@app.route('/api/response-cache/stats', methods=['GET'])
+def get_response_cache_stats_api():
+    """图片点评响应缓存统计：命中 / 未命中 / 写入 / 淘汰次数、条目数和总大小"""
+    if not image_commentary_cache:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **image_commentary_cache.get_stats()})
+
+
+@app.route('/api/tts-cache/stats', methods=['GET'])
+def get_tts_cache_stats_api():
+    """TTS 缓存统计：命中 / 未命中 / 写入 / 淘汰次数、命中产出的字节数、条目数和总大小"""
+    return jsonify(get_tts_cache_stats())
+
+
+@app.route('/api/upstream/stats', methods=['GET'])
+def get_upstream_stats_api():
+    """上游连接池统计：请求数、进行中的请求及峰值、新建连接 / 复用率、等待空闲连接次数和饱和度"""
+    return jsonify(get_upstream_stats())
+
+
+@app.route('/api/audio-encoder/stats', methods=['GET'])
+def get_audio_encoder_stats_api():
+    """流式音频压缩统计：各格式的协商次数、编码流数、拒绝 / 失败次数和压缩比"""
+    return jsonify(get_audio_encoder_stats())
+
+
+@app.route('/api/pcm-chunker/stats', methods=['GET'])
+def get_pcm_chunker_stats_api():
+    """PCM 分块统计：流数、块数、平均块大小、第一块的平均 / 最大等待时间"""
+    return jsonify(get_chunker_stats())
+
+
+@app.route('/api/stream-protocol/stats', methods=['GET'])
+def get_stream_protocol_stats_api():
+    """流式响应协议统计：v1 / v2 响应数、v2 出错的响应数、音频帧数和省下的 WAV 头字节数"""
+    return jsonify(get_stream_stats())
+
+
+@app.route('/api/prompt-cache/stats', methods=['GET'])
+def get_prompt_cache_stats_api():
+    """上游前缀缓存统计：输入 token 数、命中缓存的 token 数及占比"""
+    return jsonify(get_prefix_cache_stats())
+
+
 @app.route('/api/conversation/history', methods=['GET'])
 def get_conversation_history_api():
     """获取会话的对话历史"""
@@ -1404,16 +1813,18 @@ def clear_conversation_history_api():
         }), 500
 
 
+@app.route('/api/conversation/stats', methods=['GET'])
+def get_conversation_stats():
+    """会话存储统计：会话数、消息数、估算内存占用、淘汰次数，以及历史窗口 token 数和摘要统计"""
+    stats = conversation_store.get_stats()
+    stats['history_window'] = get_history_window_stats()
+    return jsonify(stats)
+
+
 @app.route('/api/conversation/sessions', methods=['GET'])
 def get_all_sessions():
-    """获取所有会话列表"""
-    sessions = []
-    for session_id, history in conversation_history.items():
-        sessions.append({
-            'session_id': session_id,
-            'message_count': len(history),
-            'last_update': 'N/A'  # 可以后续添加时间戳
-        })
+    """获取所有会话列表（不含已过期 / 被淘汰的会话）"""
+    sessions = conversation_store.sessions()
 
     return jsonify({
         'success': True,
@@ -9,50 +9,259 @@ Agent 应用层 - 对外服务接口
 
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import json
-import base64
 import os
 import tempfile
+import time
 
 # 导入内部模块
-from multimodal_engine import multimodal_chat, stream_tts
+from multimodal_engine import multimodal_chat, stream_tts, client, MODEL
 from mock_data import get_student, get_all_students, get_knowledge, get_all_knowledge
-from prompt_builder import build_system_prompt
+from prompt_builder import build_system_prompt, get_prompt_cache_stats, record_prompt_usage, get_prefix_cache_stats
+from tts_cache import get_tts_cache_stats
+from upstream_http import get_upstream_stats
+from filler_audio import is_filler_requested, get_filler_clip, warm_fillers, LatencyTracker, get_latency_stats
+from response_parser import parse_response
+from frame_sampler import video_content_parts, resolve_video_input_mode, record_video_turn, get_video_input_stats
+from request_encoder import DataURI
+from upload_limits import install_upload_limits, read_upload, get_upload_stats
+from session_store import create_session_store
+from history_window import build_history_window, schedule_summary, get_history_window_stats
+from tts_pipeline import (
+    SentencePipeline,
+    is_pipeline_requested,
+    iter_content_deltas,
+)
+from stream_protocol import open_response_stream, get_stream_stats, LEGACY_BLOCKS, LEGACY_METADATA_PCM
+from pcm_chunker import PCMChunker, get_chunker_stats
+from audio_encoder import get_audio_encoder_stats
 
 app = Flask(__name__)
 CORS(app)
 
-# 对话历史管理（内存存储）
-conversation_history = {}  # {session_id: [messages]}
-MAX_HISTORY = 20
+# 上传按接口限制大小，大文件落盘后以 mmap 读取（见 upload_limits）
+install_upload_limits(app)
+
+# 对话历史管理（有界存储：最大会话数 + 空闲过期 + LRU 淘汰，见 session_store；ASGI 模式共用）
+conversation_store = create_session_store()
 
 
 def get_conversation_history(session_id):
-    """获取会话的对话历史"""
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-    return conversation_history[session_id]
+    """获取会话的对话历史（副本）"""
+    return conversation_store.get_history(session_id)
 
 
-def add_to_conversation_history(session_id, role, content):
-    """添加一条消息到对话历史"""
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
+def get_history_window(session_id):
+    """获取本轮请求使用的历史：摘要 + token 预算内最近的完整轮次（见 history_window）"""
+    return build_history_window(conversation_store, session_id)
 
-    conversation_history[session_id].append({
-        'role': role,
-        'content': content
-    })
 
-    # 限制历史长度
-    if len(conversation_history[session_id]) > MAX_HISTORY:
-        conversation_history[session_id] = conversation_history[session_id][-MAX_HISTORY:]
+def save_conversation_turn(session_id, user_content, assistant_content):
+    """保存一轮对话（用户 + 助手两条消息原子写入），返回会话当前消息数；历史过长时在后台生成摘要"""
+    count = conversation_store.append(
+        session_id,
+        {'role': 'user', 'content': user_content},
+        {'role': 'assistant', 'content': assistant_content}
+    )
+    schedule_summary(conversation_store, session_id, client, MODEL)
+    return count
 
 
 # ============================================
 # 1. 聊天接口
 # ============================================
 
+class AgentRequestError(Exception):
+    """请求参数错误（携带返回给客户端的 HTTP 状态码）"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def prepare_agent_turn(form, files):
+    """
+    解析一次对话请求，构建发送给多模态引擎的消息列表
+
+    Flask 与 ASGI（app_agent_async.py）两种服务模式共用
+
+    参数:
+        form: 表单字段（MultiDict）
+        files: 上传文件（MultiDict[FileStorage]）
+
+    返回:
+        turn: {'student_id', 'session_id', 'messages', 'video_report', 'started_at'}
+
+    异常:
+        AgentRequestError: 参数缺失或资源不存在
+    """
+    started_at = time.perf_counter()
+
+    # 1. 获取参数
+    student_id = form.get('student_id')
+    session_id = form.get('session_id', f'session_{os.urandom(4).hex()}')
+    topic = form.get('topic')  # 可选：指定当前教学知识点
+
+    if not student_id:
+        raise AgentRequestError('缺少 student_id 参数', 400)
+
+    print(f'🔑 学生 ID: {student_id}')
+    print(f'🔑 会话 ID: {session_id}')
+    print(f'📚 话题: {topic or "无"}')
+
+    # 2. 获取学生信息（动态）
+    student = get_student(student_id)
+    if not student:
+        raise AgentRequestError(f'学生 {student_id} 不存在', 404)
+
+    print(f'👤 学生: {student["name"]} ({student["level"]})')
+
+    # 3. 获取知识点（动态，如果指定了 topic）
+    knowledge = None
+    if topic:
+        knowledge = get_knowledge(topic)
+        if knowledge:
+            print(f'📖 知识点: {knowledge["title"]}')
+
+    # 4. 动态构建 System Prompt
+    system_prompt = build_system_prompt(student, knowledge)
+    print(f'📝 System Prompt 长度: {len(system_prompt)} 字符')
+
+    # 5. 获取会话历史
+    history = get_history_window(session_id)
+    print(f'📚 会话历史: {len(history)} 条消息（token 预算内）')
+
+    # 6. 处理用户输入（视频/音频/图像/文本）
+    user_content = []
+
+    # 视频（整段发送，或抽帧 + 音轨，见 frame_sampler）
+    video_report = None
+    if 'video' in files:
+        video_file = files['video']
+        print(f'🎥 收到视频: {video_file.filename}')
+
+        video_data = read_upload(video_file)
+        video_mime = video_file.content_type or 'video/webm'
+
+        video_parts, video_report = video_content_parts(
+            video_data, video_mime, resolve_video_input_mode(form)
+        )
+        user_content.extend(video_parts)
+
+    # 音频
+    if 'audio' in files:
+        audio_file = files['audio']
+        print(f'🎤 收到音频: {audio_file.filename}')
+
+        audio_data = read_upload(audio_file)
+        audio_mime = audio_file.content_type or 'audio/webm'
+
+        user_content.append({
+            'type': 'audio_url',
+            'audio_url': {'url': DataURI(audio_mime, audio_data)}
+        })
+
+    # 图像
+    if 'image' in files:
+        image_file = files['image']
+        print(f'🖼️  收到图像: {image_file.filename}')
+
+        image_data = read_upload(image_file)
+        image_mime = image_file.content_type or 'image/jpeg'
+
+        user_content.append({
+            'type': 'image_url',
+            'image_url': {'url': DataURI(image_mime, image_data)}
+        })
+
+    # 文本
+    if 'text' in form:
+        text = form.get('text')
+        print(f'💬 收到文本: {text[:50]}...')
+        user_content.append({'type': 'text', 'text': text})
+
+    if not user_content:
+        raise AgentRequestError('未提供任何输入内容', 400)
+
+    # 7. 构建完整消息列表
+    messages = [
+        {'role': 'system', 'content': system_prompt}
+    ]
+
+    # 添加历史对话
+    messages.extend(history)
+
+    # 添加当前用户输入
+    messages.append({
+        'role': 'user',
+        'content': user_content
+    })
+
+    print(f'📨 完整消息列表: {len(messages)} 条')
+
+    return {
+        'student_id': student_id,
+        'session_id': session_id,
+        'messages': messages,
+        'video_report': video_report,
+        'started_at': started_at
+    }
+
+
+def record_turn_usage(turn, response=None):
+    """记录输入 / 前缀缓存命中 token 数，以及视频输入的上传字节数和耗时（仅含视频的请求）"""
+    usage = getattr(response, 'usage', None) if response is not None else None
+    if response is not None:
+        record_prompt_usage(usage)
+    if not turn.get('video_report'):
+        return
+    record_video_turn(
+        turn['video_report'],
+        prompt_tokens=getattr(usage, 'prompt_tokens', None),
+        latency=time.perf_counter() - turn['started_at'] if response is not None else None
+    )
+
+
+def parse_agent_response(text_response):
+    """
+    解析 JSON 响应（提取 message 和 actions）
+
+    兼容代码块包裹和尾部多余内容；响应不是 JSON 时直接使用原文本
+
+    返回:
+        (tts_text, actions)
+    """
+    tts_text, actions, is_json = parse_response(text_response)
+    if is_json:
+        print(f'📋 解析到 {len(actions)} 个 actions')
+    else:
+        print('📝 响应不是 JSON 格式，直接使用文本')
+
+    return tts_text, actions
+
+
+def finish_agent_turn(turn, text_response):
+    """
+    处理模型响应：解析 message/actions 并保存对话历史
+
+    返回:
+        (tts_text, metadata)
+    """
+    tts_text, actions = parse_agent_response(text_response)
+
+    # 保存对话历史
+    message_count = save_conversation_turn(turn['session_id'], '用户上传了多模态内容', text_response)
+    print(f'💾 已保存对话历史，当前会话共 {message_count} 条消息')
+
+    metadata = {
+        'type': 'metadata',
+        'message': tts_text,
+        'actions': actions,
+        'session_id': turn['session_id'],
+        'student_id': turn['student_id']
+    }
+    return tts_text, metadata
+
+
 @app.route('/api/chat', methods=['POST'])
 def agent_chat():
     """
@@ -66,183 +275,77 @@ def agent_chat():
         - image: 图像文件（可选）
         - text: 文本消息（可选）
         - topic: 当前话题（可选，用于加载特定知识点）
+        - pipeline: 是否开启句子级流水线 TTS（可选，1/true）
+        - video_input_mode: 视频输入方式（可选，video 整段 / frames 抽帧 + 音轨，默认见 VIDEO_INPUT_MODE）
+        - filler: 是否在模型思考期间先发送垫话音频（可选，1/true；使用分块格式，见 filler_audio）
+        - protocol: 2 时使用类型化帧协议（可选，也可用请求头 X-Stream-Protocol: 2，见 stream_protocol）
 
     返回（流式）:
         [4字节长度][元数据 JSON][音频流...]
+        流水线 / 垫话模式见 tts_pipeline 模块说明，protocol=2 见 stream_protocol 模块说明
     """
     try:
         print('\n' + '='*80)
         print('📥 收到 Agent 对话请求')
         print('='*80)
 
-        # 1. 获取参数
-        student_id = request.form.get('student_id')
-        session_id = request.form.get('session_id', f'session_{os.urandom(4).hex()}')
-        topic = request.form.get('topic')  # 可选：指定当前教学知识点
-
-        if not student_id:
-            return jsonify({'success': False, 'error': '缺少 student_id 参数'}), 400
-
-        print(f'🔑 学生 ID: {student_id}')
-        print(f'🔑 会话 ID: {session_id}')
-        print(f'📚 话题: {topic or "无"}')
-
-        # 2. 获取学生信息（动态）
-        student = get_student(student_id)
-        if not student:
-            return jsonify({'success': False, 'error': f'学生 {student_id} 不存在'}), 404
-
-        print(f'👤 学生: {student["name"]} ({student["level"]})')
-
-        # 3. 获取知识点（动态，如果指定了 topic）
-        knowledge = None
-        if topic:
-            knowledge = get_knowledge(topic)
-            if knowledge:
-                print(f'📖 知识点: {knowledge["title"]}')
-
-        # 4. 动态构建 System Prompt
-        system_prompt = build_system_prompt(student, knowledge)
-        print(f'📝 System Prompt 长度: {len(system_prompt)} 字符')
-
-        # 5. 获取会话历史
-        history = get_conversation_history(session_id)
-        print(f'📚 会话历史: {len(history)} 条消息')
-
-        # 6. 处理用户输入（视频/音频/图像/文本）
-        user_content = []
-
-        # 视频
-        if 'video' in request.files:
-            video_file = request.files['video']
-            print(f'🎥 收到视频: {video_file.filename}')
-
-            # 读取视频并转为 base64
-            video_data = video_file.read()
-            video_base64 = base64.b64encode(video_data).decode('utf-8')
-            video_mime = video_file.content_type or 'video/webm'
-
-            user_content.append({
-                'type': 'video_url',
-                'video_url': {'url': f'data:{video_mime};base64,{video_base64}'}
-            })
-
-        # 音频
-        if 'audio' in request.files:
-            audio_file = request.files['audio']
-            print(f'🎤 收到音频: {audio_file.filename}')
-
-            audio_data = audio_file.read()
-            audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-            audio_mime = audio_file.content_type or 'audio/webm'
-
-            user_content.append({
-                'type': 'audio_url',
-                'audio_url': {'url': f'data:{audio_mime};base64,{audio_base64}'}
-            })
-
-        # 图像
-        if 'image' in request.files:
-            image_file = request.files['image']
-            print(f'🖼️  收到图像: {image_file.filename}')
-
-            image_data = image_file.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            image_mime = image_file.content_type or 'image/jpeg'
-
-            user_content.append({
-                'type': 'image_url',
-                'image_url': {'url': f'data:{image_mime};base64,{image_base64}'}
-            })
-
-        # 文本
-        if 'text' in request.form:
-            text = request.form.get('text')
-            print(f'💬 收到文本: {text[:50]}...')
-            user_content.append({'type': 'text', 'text': text})
-
-        if not user_content:
-            return jsonify({'success': False, 'error': '未提供任何输入内容'}), 400
-
-        # 7. 构建完整消息列表
-        messages = [
-            {'role': 'system', 'content': system_prompt}
-        ]
-
-        # 添加历史对话
-        messages.extend(history)
-
-        # 添加当前用户输入
-        messages.append({
-            'role': 'user',
-            'content': user_content
-        })
-
-        print(f'📨 完整消息列表: {len(messages)} 条')
+        try:
+            turn = prepare_agent_turn(request.form, request.files)
+        except AgentRequestError as e:
+            return jsonify({'success': False, 'error': str(e)}), e.status_code
+
+        filler = is_filler_requested(request.form)
+        pipeline = is_pipeline_requested(request.form)
+        output = open_response_stream(
+            request.form, request.headers,
+            LEGACY_BLOCKS if pipeline or filler else LEGACY_METADATA_PCM,
+            turn['started_at']
+        )
+        if pipeline:
+            return agent_chat_pipelined(turn, output, filler=filler)
+        if filler:
+            return agent_chat_with_filler(turn, output)
 
         # 8. 调用多模态引擎（内部工具）
         print('⏳ 调用多模态引擎进行视频理解...')
         response = multimodal_chat(
-            messages=messages,
+            messages=turn['messages'],
             modalities=['text'],
             stream=False
         )
 
         text_response = response.choices[0].message.content
         print(f'✅ AI 响应（前200字符）: {text_response[:200]}...')
+        record_turn_usage(turn, response)
 
-        # 9. 解析 JSON 响应（提取 message 和 actions）
-        tts_text = text_response
-        actions = []
-
-        try:
-            response_json = json.loads(text_response)
-            if 'message' in response_json:
-                tts_text = response_json.get('message', text_response)
-            if 'actions' in response_json:
-                actions = response_json.get('actions', [])
-                print(f'📋 解析到 {len(actions)} 个 actions')
-        except json.JSONDecodeError:
-            print('📝 响应不是 JSON 格式，直接使用文本')
-
-        # 10. 保存对话历史
-        add_to_conversation_history(session_id, 'user', '用户上传了多模态内容')
-        add_to_conversation_history(session_id, 'assistant', text_response)
-        print(f'💾 已保存对话历史')
+        # 9. 解析 JSON 响应 + 10. 保存对话历史
+        tts_text, metadata = finish_agent_turn(turn, text_response)
 
         # 11. 流式返回（元数据 + TTS 音频）
         def generate():
             # 第一步：发送元数据块
-            metadata = {
-                'type': 'metadata',
-                'message': tts_text,
-                'actions': actions,
-                'session_id': session_id,
-                'student_id': student_id
-            }
-            metadata_json = json.dumps(metadata, ensure_ascii=False)
-            metadata_bytes = metadata_json.encode('utf-8')
-
-            # 发送元数据长度（4字节）+ 元数据内容
-            metadata_length = len(metadata_bytes)
-            yield metadata_length.to_bytes(4, byteorder='big')
-            yield metadata_bytes
+            yield from output.start(metadata)
 
             print(f'📋 已发送元数据块')
 
             # 第二步：流式 TTS 合成
             print(f'⏳ 开始 TTS 流式合成...')
+            tracker = LatencyTracker(turn['started_at'])
             try:
                 audio_stream = stream_tts(tts_text)
                 chunk_count = 0
                 for chunk in audio_stream:
                     chunk_count += 1
-                    yield chunk
+                    tracker.audio()
+                    yield from output.audio(chunk)
                 print(f'✅ TTS 完成，共 {chunk_count} 个音频片段')
             except Exception as e:
                 print(f'❌ TTS 失败: {e}')
+                yield from output.error(e, 'tts')
+            tracker.finish()
+            yield from output.end()
 
-        return Response(generate(), content_type='application/octet-stream')
+        return Response(output.guard(generate()), content_type='application/octet-stream', headers=output.headers)
 
     except Exception as e:
         print(f'❌ Agent 对话失败: {e}')
@@ -251,6 +354,164 @@ def agent_chat():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def encode_filler_blocks(tracker, output, voice='Cherry'):
+    """
+    取一条垫话并编码（v1 为 filler JSON 块 + WAV 块，v2 为 FILLER 帧 + AUDIO 帧）
+
+    返回:
+        块列表；该音色的垫话尚未就绪时返回空元组
+    """
+    clip = get_filler_clip(stream_tts, voice)
+    if not clip:
+        print('🗨️  垫话尚未就绪，本次不发送')
+        return ()
+    phrase, pcm = clip
+    tracker.audio(filler=True)
+    print(f'🗨️  已发送垫话: {phrase}')
+    return output.filler(phrase, pcm)
+
+
+def framed_metadata(turn, filler=False):
+    """分块格式的首块：message 为空，完整内容在 metadata_update 块（v2 为 METADATA 更新帧）中发送"""
+    metadata = {
+        'type': 'metadata',
+        'message': '',
+        'actions': [],
+        'pipeline': True,
+        'session_id': turn['session_id'],
+        'student_id': turn['student_id']
+    }
+    if filler:
+        metadata['filler'] = True
+    return metadata
+
+
+def agent_chat_pipelined(turn, output, filler=False):
+    """
+    流水线模式：流式调用大模型，message 中每凑齐一句就送去 TTS
+
+    元数据首块只包含会话信息，完整的 message 和 actions 在流末尾以 metadata_update 块发送；
+    filler 为 true 时先发送垫话，再调用模型（模型调用失败以 error 块返回）
+    """
+    def open_stream():
+        print('⏳ 调用多模态引擎（流水线模式）...')
+        return multimodal_chat(
+            messages=turn['messages'],
+            modalities=['text'],
+            stream=True
+        )
+
+    # 不发垫话时在返回响应之前调用模型，调用失败仍返回 500
+    opened = None if filler else open_stream()
+
+    def generate():
+        tracker = LatencyTracker(turn['started_at'])
+        yield from output.start(framed_metadata(turn, filler))
+
+        stream = opened
+        if stream is None:
+            yield from encode_filler_blocks(tracker, output)
+            try:
+                stream = open_stream()
+            except Exception as e:
+                print(f'❌ Agent 对话失败: {e}')
+                yield from output.error(e, 'model')
+                yield from output.end()
+                return
+
+        pipeline = SentencePipeline(iter_content_deltas(stream, on_usage=record_prompt_usage), stream_tts)
+        chunk_count = 0
+        chunker = PCMChunker()  # 第一块很小，之后逐渐增大到 24KB（约 0.5 秒音频）
+
+        try:
+            for kind, value in pipeline:
+                if kind == 'action':
+                    # actions 元素解析完整即发送，不必等到音频结束
+                    yield from output.action(value)
+                    continue
+                if kind == 'text':
+                    yield from output.text(value)
+                    continue
+
+                for pcm in chunker.feed(value):
+                    chunk_count += 1
+                    tracker.audio()
+                    yield from output.audio(pcm)
+
+            pcm = chunker.flush()
+            if pcm:
+                chunk_count += 1
+                tracker.audio()
+                yield from output.audio(pcm)
+            print(f'✅ 流水线 TTS 完成，{pipeline.sentence_count} 句，共 {chunk_count} 个音频块')
+        except Exception as e:
+            print(f'❌ 流水线 TTS 失败: {e}')
+            yield from output.error(e, 'pipeline')
+        tracker.finish()
+
+        if pipeline.text:
+            print(f'✅ AI 响应（前200字符）: {pipeline.text[:200]}...')
+            record_turn_usage(turn)
+            _, metadata = finish_agent_turn(turn, pipeline.text)
+            yield from output.update(metadata)
+        yield from output.end(sentences=pipeline.sentence_count)
+
+    return Response(output.guard(generate()), content_type='application/octet-stream', headers=output.headers)
+
+
+def agent_chat_with_filler(turn, output):
+    """
+    垫话模式（非流水线）：分块格式，先发送垫话，再调用模型，回复完整后整段合成 TTS
+
+    返回顺序: metadata → filler → WAV（垫话）→ metadata_update → WAV...
+    """
+    def generate():
+        tracker = LatencyTracker(turn['started_at'])
+        yield from output.start(framed_metadata(turn, filler=True))
+        yield from encode_filler_blocks(tracker, output)
+
+        try:
+            print('⏳ 调用多模态引擎进行视频理解...')
+            response = multimodal_chat(
+                messages=turn['messages'],
+                modalities=['text'],
+                stream=False
+            )
+            text_response = response.choices[0].message.content
+            print(f'✅ AI 响应（前200字符）: {text_response[:200]}...')
+            record_turn_usage(turn, response)
+            tts_text, metadata = finish_agent_turn(turn, text_response)
+        except Exception as e:
+            print(f'❌ Agent 对话失败: {e}')
+            yield from output.error(e, 'model')
+            yield from output.end()
+            return
+
+        yield from output.update(metadata)
+
+        chunk_count = 0
+        chunker = PCMChunker()  # 第一块很小，之后逐渐增大到 24KB（约 0.5 秒音频）
+        try:
+            for pcm_chunk in stream_tts(tts_text):
+                for pcm in chunker.feed(pcm_chunk):
+                    chunk_count += 1
+                    tracker.audio()
+                    yield from output.audio(pcm)
+            pcm = chunker.flush()
+            if pcm:
+                chunk_count += 1
+                tracker.audio()
+                yield from output.audio(pcm)
+            print(f'✅ TTS 完成，共 {chunk_count} 个音频块')
+        except Exception as e:
+            print(f'❌ TTS 失败: {e}')
+            yield from output.error(e, 'tts')
+        tracker.finish()
+        yield from output.end()
+
+    return Response(output.guard(generate()), content_type='application/octet-stream', headers=output.headers)
+
+
 # ============================================
 # 2. 学生信息查询接口
 # ============================================
@@ -340,7 +601,19 @@ def health_check():
         'services': {
             'multimodal_engine': 'ok',
             'mock_data': 'ok'
-        }
+        },
+        'video_input': get_video_input_stats(),
+        'uploads': get_upload_stats(),
+        'sessions': conversation_store.get_stats(),
+        'history_window': get_history_window_stats(),
+        'prompt_template': get_prompt_cache_stats(),
+        'prefix_cache': get_prefix_cache_stats(),
+        'tts_cache': get_tts_cache_stats(),
+        'latency': get_latency_stats(),
+        'upstream': get_upstream_stats(),
+        'stream_protocol': get_stream_stats(),
+        'pcm_chunker': get_chunker_stats(),
+        'audio_encoder': get_audio_encoder_stats()
     })
 
 
@@ -358,4 +631,7 @@ if __name__ == '__main__':
     print(f'   - GET  /api/knowledge/<id> (知识点详情)')
     print(f'   - GET  /api/health         (健康检查)')
 
+    # 预先合成垫话（filler=1 时使用），已在 TTS 缓存中的直接从磁盘读取
+    warm_fillers(stream_tts)
+
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,482 @@
+"""
+Agent 应用层 - ASGI 服务模式
+
+与 app_agent.py 提供相同的对外接口，但基于 asyncio：
+等待大模型和 TTS 的网络 I/O 期间不占用线程，单进程可同时保持数百个流式对话。
+
+启动:
+    hypercorn app_agent_async:app --bind 0.0.0.0:5001
+"""
+
+import asyncio
+import weakref
+
+from quart import Quart, request, jsonify, Response, g
+from quart.wrappers import Request
+from quart_cors import cors
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# 导入内部模块
+from multimodal_engine import amultimodal_chat, astream_tts, stream_tts
+from mock_data import get_student, get_all_knowledge, get_knowledge
+from app_agent import (
+    AgentRequestError,
+    prepare_agent_turn,
+    finish_agent_turn,
+    framed_metadata,
+    encode_filler_blocks,
+    record_turn_usage,
+    conversation_store,
+)
+from frame_sampler import get_video_input_stats
+from history_window import get_history_window_stats
+from prompt_builder import get_prompt_cache_stats, record_prompt_usage, get_prefix_cache_stats
+from tts_cache import get_tts_cache_stats
+from upstream_http import get_upstream_stats, aclose_upstream_sessions
+from tts_pipeline import is_pipeline_requested, aiter_content_deltas, AsyncSentencePipeline
+from filler_audio import is_filler_requested, warm_fillers, LatencyTracker, get_latency_stats
+from stream_protocol import open_response_stream, get_stream_stats, LEGACY_BLOCKS, LEGACY_METADATA_PCM
+from pcm_chunker import PCMChunker, get_chunker_stats
+from audio_encoder import get_audio_encoder_stats
+from upload_limits import (
+    UploadQuotaExceeded,
+    get_upload_limit,
+    spool_stream_factory,
+    reserve_upload,
+    release_upload,
+    settle_upload,
+    record_rejected,
+    too_large_message,
+    get_upload_stats,
+)
+
+
+class SpooledRequest(Request):
+    """上传写入 spool_stream_factory（大文件落盘，见 upload_limits）"""
+
+    def make_form_data_parser(self):
+        return self.form_data_parser_class(
+            max_content_length=self.max_content_length,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.parameter_storage_class,
+            stream_factory=spool_stream_factory,
+        )
+
+
+app = cors(Quart(__name__))
+app.request_class = SpooledRequest
+# Quart 在接收请求体时按该值计数，超限立即 413（只有 /api/chat 接收上传）
+app.config['MAX_CONTENT_LENGTH'] = get_upload_limit('agent_chat')
+
+
+@app.before_request
+async def spool_upload():
+    """进入视图前完成 multipart 解析，超限的 413 由错误处理器返回，而不会被视图变成 500"""
+    if request.endpoint != 'agent_chat' or request.method != 'POST':
+        return None
+
+    limit = get_upload_limit('agent_chat')
+    if request.content_length is not None and request.content_length > limit:
+        raise RequestEntityTooLarge()
+
+    # 没有 Content-Length 时解析完再按实际大小预留（见 upload_limits.settle_upload）
+    nbytes = request.content_length or 0
+    if nbytes:
+        reserve_upload(nbytes)
+        g.upload_reserved = nbytes
+    g.upload_reserved = settle_upload(nbytes, await request.form, await request.files)
+    return None
+
+
+class QuotaReleasingBody:
+    """
+    包装响应体：发送完（或客户端断开）后才释放上传配额
+
+    Quart 的 teardown_request 在开始发送响应体之前就执行了，而流式响应体仍在使用上传的数据；
+    响应体没有被发送（请求在发送前被取消）时，对象被回收时释放
+    """
+
+    def __init__(self, body, nbytes):
+        self._body = body
+        self._release = weakref.finalize(self, release_upload, nbytes)
+
+    def __getattr__(self, name):
+        return getattr(self._body, name)
+
+    async def __aenter__(self):
+        return await self._body.__aenter__()
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            return await self._body.__aexit__(exc_type, exc_value, tb)
+        finally:
+            self._release()
+
+
+@app.after_request
+async def release_upload_after_response(response):
+    nbytes = g.pop('upload_reserved', 0)
+    if nbytes:
+        response.response = QuotaReleasingBody(response.response, nbytes)
+    return response
+
+
+@app.teardown_request
+async def release_upload_quota(exc=None):
+    # 没有生成响应（after_request 不执行）时在这里释放
+    nbytes = g.pop('upload_reserved', 0)
+    if nbytes:
+        release_upload(nbytes)
+
+
+@app.before_serving
+async def warm_filler_audio():
+    """预先合成垫话（filler=1 时使用，在后台线程中进行）"""
+    warm_fillers(stream_tts)
+
+
+@app.after_serving
+async def close_upstream_sessions():
+    """关闭 DashScope 的 aiohttp 会话（连接池）"""
+    await aclose_upstream_sessions()
+
+
+@app.errorhandler(RequestEntityTooLarge)
+async def upload_too_large(e):
+    record_rejected()
+    print(f'🚫 上传超过上限: {request.endpoint}（Content-Length {request.content_length}）')
+    return jsonify({'success': False, 'error': too_large_message(get_upload_limit('agent_chat'))}), 413
+
+
+@app.errorhandler(UploadQuotaExceeded)
+async def upload_quota_exceeded(e):
+    print(f'🚫 {e}')
+    return jsonify({'success': False, 'error': str(e)}), 503
+
+
+async def encoded_blocks(output, method, *args, **kwargs):
+    """
+    执行 output 的编码方法（start / audio / end 或 encode_filler_blocks）
+
+    协商了压缩音频（audio_encoder）时，start 要启动 ffmpeg，写入 ffmpeg 后要等待编码输出
+    （最多 AUDIO_ENCODER_WAIT_MS），放到线程中执行，不阻塞事件循环；裸 PCM 时直接执行
+    """
+    if output.codec is None:
+        return method(*args, **kwargs)
+    return await asyncio.to_thread(method, *args, **kwargs)
+
+
+# ============================================
+# 1. 聊天接口
+# ============================================
+
+@app.route('/api/chat', methods=['POST'])
+async def agent_chat():
+    """
+    Agent 对话接口（异步版本，参数与返回格式同 app_agent.agent_chat）
+
+    返回（流式）:
+        [4字节长度][元数据 JSON][音频流...]
+        pipeline=1 / filler=1 时为分块格式（见 tts_pipeline），protocol=2 见 stream_protocol
+    """
+    try:
+        print('\n' + '='*80)
+        print('📥 收到 Agent 对话请求（ASGI）')
+        print('='*80)
+
+        form = await request.form
+        files = await request.files
+
+        try:
+            # 读取上传文件、base64 编码和抽帧都是阻塞操作，放到线程中执行
+            turn = await asyncio.to_thread(prepare_agent_turn, form, files)
+        except AgentRequestError as e:
+            return jsonify({'success': False, 'error': str(e)}), e.status_code
+
+        filler = is_filler_requested(form)
+        pipeline = is_pipeline_requested(form)
+        output = open_response_stream(
+            form, request.headers, LEGACY_BLOCKS if pipeline or filler else LEGACY_METADATA_PCM, turn['started_at']
+        )
+        if pipeline:
+            return await agent_chat_pipelined(turn, output, filler=filler)
+        if filler:
+            return agent_chat_with_filler(turn, output)
+
+        print('⏳ 调用多模态引擎进行视频理解...')
+        response = await amultimodal_chat(
+            messages=turn['messages'],
+            modalities=['text'],
+            stream=False
+        )
+
+        text_response = response.choices[0].message.content
+        print(f'✅ AI 响应（前200字符）: {text_response[:200]}...')
+        record_turn_usage(turn, response)
+
+        # 保存对话历史要等待 SQLite 写线程完成，放到线程中执行
+        tts_text, metadata = await asyncio.to_thread(finish_agent_turn, turn, text_response)
+
+        async def generate():
+            # 第一步：发送元数据块
+            for block in await encoded_blocks(output, output.start, metadata):
+                yield block
+
+            print(f'📋 已发送元数据块')
+
+            # 第二步：流式 TTS 合成
+            print(f'⏳ 开始 TTS 流式合成...')
+            tracker = LatencyTracker(turn['started_at'])
+            try:
+                chunk_count = 0
+                async for chunk in astream_tts(tts_text):
+                    chunk_count += 1
+                    tracker.audio()
+                    for block in await encoded_blocks(output, output.audio, chunk):
+                        yield block
+                print(f'✅ TTS 完成，共 {chunk_count} 个音频片段')
+            except Exception as e:
+                print(f'❌ TTS 失败: {e}')
+                for block in output.error(e, 'tts'):
+                    yield block
+            tracker.finish()
+            for block in await encoded_blocks(output, output.end):
+                yield block
+
+        return Response(output.aguard(generate()), content_type='application/octet-stream', headers=output.headers)
+
+    except Exception as e:
+        print(f'❌ Agent 对话失败: {e}')
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+async def agent_chat_pipelined(turn, output, filler=False):
+    """
+    流水线模式（与 app_agent.agent_chat_pipelined 相同的分块格式）
+
+    流式调用大模型，message 中每凑齐一句就送去 TTS；filler 为 true 时先发送垫话，再调用模型
+    """
+    async def open_stream():
+        print('⏳ 调用多模态引擎（流水线模式）...')
+        return await amultimodal_chat(
+            messages=turn['messages'],
+            modalities=['text'],
+            stream=True
+        )
+
+    # 不发垫话时在返回响应之前调用模型，调用失败仍返回 500
+    opened = None if filler else await open_stream()
+
+    async def generate():
+        tracker = LatencyTracker(turn['started_at'])
+        for block in await encoded_blocks(output, output.start, framed_metadata(turn, filler)):
+            yield block
+
+        stream = opened
+        if stream is None:
+            for block in await encoded_blocks(output, encode_filler_blocks, tracker, output):
+                yield block
+            try:
+                stream = await open_stream()
+            except Exception as e:
+                print(f'❌ Agent 对话失败: {e}')
+                for block in output.error(e, 'model') + await encoded_blocks(output, output.end):
+                    yield block
+                return
+
+        pipeline = AsyncSentencePipeline(aiter_content_deltas(stream, on_usage=record_prompt_usage), astream_tts)
+        chunk_count = 0
+        chunker = PCMChunker()  # 第一块很小，之后逐渐增大到 24KB（约 0.5 秒音频）
+
+        try:
+            async for kind, value in pipeline:
+                if kind == 'action':
+                    # actions 元素解析完整即发送，不必等到音频结束
+                    for block in output.action(value):
+                        yield block
+                    continue
+                if kind == 'text':
+                    for block in output.text(value):
+                        yield block
+                    continue
+
+                for pcm in chunker.feed(value):
+                    chunk_count += 1
+                    tracker.audio()
+                    for block in await encoded_blocks(output, output.audio, pcm):
+                        yield block
+
+            pcm = chunker.flush()
+            if pcm:
+                chunk_count += 1
+                tracker.audio()
+                for block in await encoded_blocks(output, output.audio, pcm):
+                    yield block
+            print(f'✅ 流水线 TTS 完成，{pipeline.sentence_count} 句，共 {chunk_count} 个音频块')
+        except Exception as e:
+            print(f'❌ 流水线 TTS 失败: {e}')
+            for block in output.error(e, 'pipeline'):
+                yield block
+        tracker.finish()
+
+        if pipeline.text:
+            print(f'✅ AI 响应（前200字符）: {pipeline.text[:200]}...')
+            record_turn_usage(turn)
+            _, metadata = await asyncio.to_thread(finish_agent_turn, turn, pipeline.text)
+            for block in output.update(metadata):
+                yield block
+        for block in await encoded_blocks(output, output.end, sentences=pipeline.sentence_count):
+            yield block
+
+    return Response(output.aguard(generate()), content_type='application/octet-stream', headers=output.headers)
+
+
+def agent_chat_with_filler(turn, output):
+    """
+    垫话模式（与 app_agent.agent_chat_with_filler 相同的分块格式）
+
+    返回顺序: metadata → filler → WAV（垫话）→ metadata_update → WAV...
+    """
+    async def generate():
+        tracker = LatencyTracker(turn['started_at'])
+        for block in await encoded_blocks(output, output.start, framed_metadata(turn, filler=True)):
+            yield block
+        # 垫话已在内存中，不做 I/O
+        for block in await encoded_blocks(output, encode_filler_blocks, tracker, output):
+            yield block
+
+        try:
+            print('⏳ 调用多模态引擎进行视频理解...')
+            response = await amultimodal_chat(
+                messages=turn['messages'],
+                modalities=['text'],
+                stream=False
+            )
+            text_response = response.choices[0].message.content
+            print(f'✅ AI 响应（前200字符）: {text_response[:200]}...')
+            record_turn_usage(turn, response)
+            tts_text, metadata = await asyncio.to_thread(finish_agent_turn, turn, text_response)
+        except Exception as e:
+            print(f'❌ Agent 对话失败: {e}')
+            for block in output.error(e, 'model') + await encoded_blocks(output, output.end):
+                yield block
+            return
+
+        for block in output.update(metadata):
+            yield block
+
+        chunk_count = 0
+        chunker = PCMChunker()  # 第一块很小，之后逐渐增大到 24KB（约 0.5 秒音频）
+        try:
+            async for pcm_chunk in astream_tts(tts_text):
+                for pcm in chunker.feed(pcm_chunk):
+                    chunk_count += 1
+                    tracker.audio()
+                    for block in await encoded_blocks(output, output.audio, pcm):
+                        yield block
+            pcm = chunker.flush()
+            if pcm:
+                chunk_count += 1
+                tracker.audio()
+                for block in await encoded_blocks(output, output.audio, pcm):
+                    yield block
+            print(f'✅ TTS 完成，共 {chunk_count} 个音频块')
+        except Exception as e:
+            print(f'❌ TTS 失败: {e}')
+            for block in output.error(e, 'tts'):
+                yield block
+        tracker.finish()
+        for block in await encoded_blocks(output, output.end):
+            yield block
+
+    return Response(output.aguard(generate()), content_type='application/octet-stream', headers=output.headers)
+
+
+# ============================================
+# 2. 学生信息 / 知识点查询接口
+# ============================================
+
+@app.route('/api/student/<student_id>', methods=['GET'])
+async def get_student_info(student_id):
+    """获取学生信息"""
+    student = get_student(student_id)
+    if not student:
+        return jsonify({'success': False, 'error': f'学生 {student_id} 不存在'}), 404
+
+    return jsonify({'success': True, 'student': student})
+
+
+@app.route('/api/knowledge', methods=['GET'])
+async def get_knowledge_list():
+    """获取知识点列表"""
+    category = request.args.get('category')
+    items = get_all_knowledge(category)
+
+    return jsonify({
+        'success': True,
+        'total': len(items),
+        'items': items
+    })
+
+
+@app.route('/api/knowledge/<topic>', methods=['GET'])
+async def get_knowledge_detail(topic):
+    """获取知识点详情"""
+    knowledge = get_knowledge(topic)
+    if not knowledge:
+        return jsonify({'success': False, 'error': f'知识点 {topic} 不存在'}), 404
+
+    return jsonify({'success': True, 'knowledge': knowledge})
+
+
+# ============================================
+# 3. 健康检查
+# ============================================
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """健康检查"""
+    return jsonify({
+        'success': True,
+        'status': 'healthy',
+        'version': '1.0.0',
+        'mode': 'asgi',
+        'services': {
+            'multimodal_engine': 'ok',
+            'mock_data': 'ok'
+        },
+        'video_input': get_video_input_stats(),
+        'uploads': get_upload_stats(),
+        'sessions': conversation_store.get_stats(),
+        'history_window': get_history_window_stats(),
+        'prompt_template': get_prompt_cache_stats(),
+        'prefix_cache': get_prefix_cache_stats(),
+        'tts_cache': get_tts_cache_stats(),
+        'latency': get_latency_stats(),
+        'upstream': get_upstream_stats(),
+        'stream_protocol': get_stream_stats(),
+        'pcm_chunker': get_chunker_stats(),
+        'audio_encoder': get_audio_encoder_stats()
+    })
+
+
+# ============================================
+# 启动服务
+# ============================================
+
+if __name__ == '__main__':
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = ['0.0.0.0:5001']
+
+    print('🚀 Agent 应用层启动！（ASGI 模式）')
+    print(f'📡 访问地址: http://localhost:5001')
+    print(f'💡 生产部署: hypercorn app_agent_async:app --bind 0.0.0.0:5001')
+
+    asyncio.run(serve(app, config))
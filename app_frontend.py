@@ -2,17 +2,107 @@
 前端静态文件服务器
 
 只提供静态文件服务，所有 API 请求转发到 Agent 应用层（app_agent.py）
+
+转发方式:
+    - 请求体原样流式转发（不解析 multipart、不在内存中重建上传），Content-Type（含 boundary）不变
+    - 到 AGENT_URL 的连接由共享的 requests.Session 连接池保持（keep-alive），不必每个请求重新建连
+    - 响应按收到的数据块立即转发（不重新按 8KB 切块、不等凑满），音频帧到达即发往浏览器
+    - 两个方向都去掉逐跳头（Connection / Keep-Alive / Transfer-Encoding 等）
+    - 浏览器断开时关闭到 Agent 的连接，Agent 端的流式生成随之停止
+
+配置（环境变量）:
+    AGENT_URL               Agent 应用层地址（默认 http://localhost:5001）
+    PROXY_POOL_SIZE         到 Agent 的连接池大小（默认 32）
+    PROXY_CONNECT_TIMEOUT   连接超时（秒，默认 5）
+    PROXY_READ_TIMEOUT      读取超时（秒，默认 600；流式响应为两个数据块之间的最长间隔）
 """
 
-from flask import Flask, send_from_directory, request
+import os
+
+from flask import Flask, send_from_directory, request, jsonify, Response
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
 
 # Agent 应用层地址
-AGENT_URL = "http://localhost:5001"
+AGENT_URL = os.getenv('AGENT_URL', 'http://localhost:5001').rstrip('/')
+
+PROXY_POOL_SIZE = int(os.getenv('PROXY_POOL_SIZE', '32'))
+PROXY_CONNECT_TIMEOUT = float(os.getenv('PROXY_CONNECT_TIMEOUT', '5'))
+PROXY_READ_TIMEOUT = float(os.getenv('PROXY_READ_TIMEOUT', '600'))
+
+# 每次转发的最大字节数（请求体按此大小读取；响应有多少转发多少，不等凑满）
+PROXY_CHUNK_SIZE = 64 * 1024
+
+# 逐跳头（RFC 7230 6.1），只对单个连接有效，不能原样转发
+HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade',
+))
+
+# 到 Agent 应用层的连接池（keep-alive）
+agent_session = requests.Session()
+agent_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=PROXY_POOL_SIZE))
+agent_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=PROXY_POOL_SIZE))
+agent_session.trust_env = False
+agent_session.headers.clear()  # 只转发浏览器的请求头（不附加 requests 默认的 User-Agent / Accept-Encoding）
+
+
+def filter_headers(headers):
+    """去掉逐跳头（包括 Connection 头中列出的头）"""
+    # werkzeug 的 Headers 和 urllib3 的 HTTPHeaderDict 都支持 getlist / 重复头的 items
+    connection = {
+        name.strip().lower()
+        for value in headers.getlist('Connection')
+        for name in value.split(',') if name.strip()
+    }
+    return [
+        (name, value) for name, value in headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in connection
+    ]
+
+
+class _RequestBody:
+    """
+    把 WSGI 输入流交给 requests 流式发送
+
+    提供 __len__，requests 据此设置 Content-Length（而不是改用 chunked）
+    """
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=PROXY_CHUNK_SIZE):
+        return self._stream.read(size)
+
+
+def _request_body():
+    """返回请求体：有 Content-Length 时按长度流式读取，没有时（chunked 上传）逐块转发"""
+    length = request.content_length
+    if length is not None:
+        return _RequestBody(request.stream, length) if length else None
+    if request.method in ('GET', 'HEAD', 'DELETE'):
+        return None
+    return iter(lambda: request.stream.read(PROXY_CHUNK_SIZE), b'')
+
+
+def _stream_response(upstream):
+    """按收到的数据块转发响应体；浏览器断开（生成器被关闭）时关闭到 Agent 的连接"""
+    try:
+        while True:
+            chunk = upstream.raw.read1(PROXY_CHUNK_SIZE, decode_content=False)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        upstream.close()
 
 
 @app.route('/')
@@ -40,34 +130,36 @@ def proxy_api(path):
     将所有 /api/* 请求转发到 Agent 应用层
     """
     url = f"{AGENT_URL}/api/{path}"
-
-    # 转发请求
-    if request.method == 'GET':
-        resp = requests.get(url, params=request.args, stream=True)
-    elif request.method == 'POST':
-        # 处理文件上传
-        files = {}
-        for key in request.files:
-            file = request.files[key]
-            files[key] = (file.filename, file.stream, file.content_type)
-
-        resp = requests.post(
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+
+    headers = [
+        (name, value) for name, value in filter_headers(request.headers)
+        if name.lower() not in ('host', 'content-length')
+    ]
+    headers.append(('X-Forwarded-For', request.remote_addr or ''))
+    headers.append(('X-Forwarded-Host', request.host))
+
+    try:
+        upstream = agent_session.request(
+            request.method,
             url,
-            data=request.form,
-            files=files if files else None,
-            stream=True
+            headers=dict(headers),
+            data=_request_body(),
+            stream=True,
+            allow_redirects=False,
+            timeout=(PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT)
         )
-    elif request.method == 'PUT':
-        resp = requests.put(url, json=request.get_json(), stream=True)
-    elif request.method == 'DELETE':
-        resp = requests.delete(url, params=request.args)
+    except requests.RequestException as e:
+        print(f'❌ 转发到 Agent 失败: {request.method} {url}: {e}')
+        return jsonify({'success': False, 'error': f'Agent 应用层不可用: {e}'}), 502
 
-    # 返回响应
-    from flask import Response
+    # 响应体原样转发（不解压），Content-Encoding / Content-Length 保持一致
     return Response(
-        resp.iter_content(chunk_size=8192),
-        status=resp.status_code,
-        headers=dict(resp.headers)
+        _stream_response(upstream),
+        status=upstream.status_code,
+        headers=filter_headers(upstream.raw.headers),
+        direct_passthrough=True
     )
 
 
@@ -0,0 +1,413 @@
+"""
+流式音频压缩（Opus / MP3），按客户端声明的可解码格式协商
+
+流式接口的音频是 24kHz 16-bit 单声道 PCM，约 384 kbit/s；弱网下的移动端最容易因此卡顿，出口带宽也是成本。
+帧协议 v2（见 stream_protocol）的请求可以再带上可接受的音频格式（类似 Accept 头，按 q 值排序）:
+    表单字段 audio_accept 或请求头 X-Audio-Accept，例如 "opus, mp3;q=0.9, pcm;q=0.5"
+服务端选出双方都支持的 q 值最高的格式（相同时按 AUDIO_STREAM_CODECS 的顺序），默认及协商不出结果时仍为 PCM。
+
+压缩时每个响应启动一个常驻的 ffmpeg 进程，PCM 到达一块就写入一块（边合成边编码），后台线程把输出
+拆成独立的编码包（Opus 包 / MP3 帧）。AUDIO 帧负载为一个或多个 [2字节长度（big-endian）][编码包]，
+客户端逐包交给解码器（浏览器端为 WebCodecs AudioDecoder，见 static/stream_protocol.js）。
+    - 写入一块后最多等待 AUDIO_ENCODER_WAIT_MS，把这块对应的编码包随同一个 AUDIO 帧发出，
+      不会把音频拖到下一块才发送；编码器内部缓冲的尾巴在流结束时发出
+    - 同时运行的编码进程数有上限，超过时本次响应退回 PCM（不排队、不拒绝请求）
+    - ffmpeg 在发送首帧时才启动（与等待 TTS 首包重叠），请求在开始发送响应之前就出错返回时不占用进程；
+      响应中途结束（客户端断开、生成器异常）时立即终止进程并归还名额
+
+配置（环境变量）:
+    AUDIO_STREAM_CODECS         服务端可用的压缩格式及优先顺序（默认 "opus,mp3"；留空则只返回 PCM）
+    OPUS_BITRATE                Opus 码率（bit/s，默认 24000）
+    MP3_BITRATE                 MP3 码率（bit/s，默认 48000）
+    AUDIO_ENCODER_MAX_STREAMS   同时运行的编码进程数上限（默认 32）
+    AUDIO_ENCODER_WAIT_MS       写入一块后等待编码输出的最长时间（毫秒，默认 50）
+
+示例:
+    codec = negotiate_audio_codec(request.form, request.headers)
+    encoder = open_audio_encoder(codec) if codec else None
+    payload = encoder.encode(pcm)    # 可能为空（数据还在编码器内部）
+    payload += encoder.close()       # 流结束时取出剩余数据
+    encoder.abort()                  # 没有正常结束时（close() 之后调用无效果）
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import weakref
+
+from transcoder import TranscodeError
+
+
+AUDIO_STREAM_CODECS = [
+    codec.strip().lower()
+    for codec in os.getenv('AUDIO_STREAM_CODECS', 'opus,mp3').split(',')
+    if codec.strip()
+]
+OPUS_BITRATE = int(os.getenv('OPUS_BITRATE', '24000'))
+MP3_BITRATE = int(os.getenv('MP3_BITRATE', '48000'))
+AUDIO_ENCODER_MAX_STREAMS = int(os.getenv('AUDIO_ENCODER_MAX_STREAMS', '32'))
+AUDIO_ENCODER_WAIT_MS = float(os.getenv('AUDIO_ENCODER_WAIT_MS', '50'))
+
+_INPUT_ARGS = [
+    'ffmpeg', '-hide_banner', '-loglevel', 'error',
+    # 输入格式已知，不做探测（否则要先攒够探测数据才开始编码）
+    '-probesize', '32', '-analyzeduration', '0',
+    # 裸 PCM 的读取粒度按码率计算（24kHz 时每次读满 4096 字节 ≈ 85 ms 才往下交），边写边编码时输出
+    # 会一直落后这么多；按 3kHz 读入（512 字节一包），再用 asetrate 原样改回 24kHz（不重采样）
+    '-f', 's16le', '-ar', '3000', '-ac', '1', '-i', 'pipe:0', '-af', 'asetrate=24000',
+]
+
+# 各格式的编码参数；frame_ms 为每个编码包的时长，lag_ms 为编码器正常的输出滞后
+CODECS = {
+    'opus': {
+        'args': ['-c:a', 'libopus', '-b:a', str(OPUS_BITRATE), '-application', 'voip', '-frame_duration', '20',
+                 '-page_duration', '20000', '-flush_packets', '1', '-f', 'ogg', 'pipe:1'],
+        'format': {'encoding': 'opus', 'sample_rate': 48000, 'channels': 1, 'bitrate': OPUS_BITRATE, 'frame_ms': 20},
+        'frame_ms': 20,
+        'lag_ms': 40,  # 一个 20 ms 的帧 + 输入读取粒度 + 编码器前瞻
+    },
+    'mp3': {
+        'args': ['-c:a', 'libmp3lame', '-b:a', str(MP3_BITRATE), '-write_xing', '0', '-id3v2_version', '0',
+                 '-flush_packets', '1', '-f', 'mp3', 'pipe:1'],
+        'format': {'encoding': 'mp3', 'sample_rate': 24000, 'channels': 1, 'bitrate': MP3_BITRATE, 'frame_ms': 24},
+        'frame_ms': 24,  # MPEG-2 Layer III：每帧 576 个采样点 @ 24kHz
+        'lag_ms': 100,  # LAME 内部缓冲约 3 帧
+    },
+}
+
+_ALIASES = {
+    'opus': 'opus', 'audio/opus': 'opus', 'audio/ogg': 'opus',
+    'mp3': 'mp3', 'audio/mpeg': 'mp3', 'audio/mp3': 'mp3',
+    'pcm': 'pcm', 'audio/pcm': 'pcm', 'audio/l16': 'pcm', 'wav': 'pcm', 'audio/wav': 'pcm',
+}
+
+_FFMPEG_AVAILABLE = shutil.which('ffmpeg') is not None
+
+_slots = threading.BoundedSemaphore(AUDIO_ENCODER_MAX_STREAMS)
+_stats_lock = threading.Lock()
+_stats = {
+    'negotiated': {},
+    'streams': 0,
+    'active': 0,
+    'rejected': 0,
+    'failures': 0,
+    'aborted': 0,
+    'pcm_bytes': 0,
+    'encoded_bytes': 0,
+    'wait_timeouts': 0,
+}
+
+
+def _incr(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+def _parse_accept(value):
+    """解析 "opus, mp3;q=0.9, pcm;q=0.5" → [(格式, q 值, 顺序)]；不认识的格式忽略，* 匹配其余所有格式"""
+    accepted = []
+    for index, item in enumerate(value.split(',')):
+        token, *params = [part.strip().lower() for part in item.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, param_value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(param_value)
+                except ValueError:
+                    q = 0.0
+            elif name.strip() == 'codecs' and param_value.strip('"') in _ALIASES:
+                token = param_value.strip('"')
+        if token == '*' or token in _ALIASES:
+            accepted.append((_ALIASES.get(token, '*'), q, index))
+    return accepted
+
+
+def negotiate_audio_codec(form, headers=None):
+    """
+    按表单字段 audio_accept 或请求头 X-Audio-Accept 选择流式音频的压缩格式
+
+    返回:
+        'opus' / 'mp3'；未声明、只接受 PCM 或服务端不可用（未配置 / 没有 ffmpeg）时返回 None
+    """
+    value = form.get('audio_accept') or (headers.get('X-Audio-Accept') if headers is not None else None)
+    if not value:
+        return None
+
+    server_order = [codec for codec in AUDIO_STREAM_CODECS if codec in CODECS and _FFMPEG_AVAILABLE] + ['pcm']
+    quality = {}
+    wildcard = None
+    for codec, q, _ in _parse_accept(value):
+        if codec == '*':
+            wildcard = q if wildcard is None else max(wildcard, q)
+        else:
+            quality[codec] = max(quality.get(codec, 0.0), q)
+    if wildcard is not None:
+        for codec in server_order:
+            quality.setdefault(codec, wildcard)
+
+    candidates = [codec for codec in server_order if quality.get(codec, 0.0) > 0]
+    codec = max(candidates, key=lambda c: (quality[c], -server_order.index(c))) if candidates else 'pcm'
+    with _stats_lock:
+        _stats['negotiated'][codec] = _stats['negotiated'].get(codec, 0) + 1
+    return None if codec == 'pcm' else codec
+
+
+class _OggPackets:
+    """把 Ogg 字节流拆成 Opus 包（跳过 OpusHead / OpusTags 两个头包）"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._packet = bytearray()
+        self._headers = 2
+
+    def feed(self, data):
+        self._buffer += data
+        packets = []
+        while len(self._buffer) >= 27:
+            if self._buffer[:4] != b'OggS':
+                raise TranscodeError('Opus 编码输出不是有效的 Ogg 流')
+            segments = self._buffer[26]
+            header_size = 27 + segments
+            if len(self._buffer) < header_size:
+                break
+            lacing = self._buffer[27:header_size]
+            if len(self._buffer) < header_size + sum(lacing):
+                break
+            offset = header_size
+            for size in lacing:
+                self._packet += self._buffer[offset:offset + size]
+                offset += size
+                if size < 255:
+                    if self._headers:
+                        self._headers -= 1
+                    else:
+                        packets.append(bytes(self._packet))
+                    self._packet.clear()
+            del self._buffer[:offset]
+        return packets
+
+
+# MPEG 音频 Layer III 的码率表（kbit/s）和采样率表
+_MP3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),   # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),       # MPEG-2
+    0: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),       # MPEG-2.5
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+class _MP3Frames:
+    """把 MP3 字节流按帧头拆成独立的帧"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def _frame_size(self, offset):
+        header = int.from_bytes(self._buffer[offset:offset + 4], 'big')
+        version = (header >> 19) & 0x3
+        layer = (header >> 17) & 0x3
+        bitrate_index = (header >> 12) & 0xF
+        rate_index = (header >> 10) & 0x3
+        if (header >> 21) != 0x7FF or version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            return None
+        bitrate = _MP3_BITRATES[version][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        padding = (header >> 9) & 0x1
+        return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= 4:
+            size = self._frame_size(offset)
+            if size is None:
+                offset += 1  # 不是帧头，向后同步
+                continue
+            if len(self._buffer) - offset < size:
+                break
+            frames.append(bytes(self._buffer[offset:offset + size]))
+            offset += size
+        del self._buffer[:offset]
+        return frames
+
+
+class _EncoderOutput:
+    """后台读取线程和编码器共享的输出状态（不引用编码器本身，编码器被回收时进程随之终止）"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.packets = []
+        self.produced_ms = 0.0
+        self.done = False
+        self.error = None
+
+
+def _read_output(stdout, packetizer, output, frame_ms):
+    try:
+        while True:
+            data = stdout.read1(65536)
+            if not data:
+                break
+            packets = packetizer.feed(data)
+            if packets:
+                with output.condition:
+                    output.packets.extend(packets)
+                    output.produced_ms += len(packets) * frame_ms
+                    output.condition.notify_all()
+    except Exception as e:
+        output.error = e
+    finally:
+        with output.condition:
+            output.done = True
+            output.condition.notify_all()
+
+
+def _shutdown(process):
+    """终止编码进程并归还名额（只执行一次：close() 或编码器被回收时）"""
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+    with _stats_lock:
+        _stats['active'] -= 1
+    _slots.release()
+
+
+class StreamingAudioEncoder:
+    """
+    一个响应的流式编码器（常驻 ffmpeg 进程）
+
+    参数:
+        codec: 'opus' / 'mp3'
+
+    属性:
+        format: 客户端解码需要的格式信息（放进首个 METADATA 帧的 audio 字段）
+
+    异常:
+        TranscodeError: ffmpeg 启动失败或中途退出
+    """
+
+    def __init__(self, codec):
+        spec = CODECS[codec]
+        self.codec = codec
+        self.format = dict(spec['format'])
+        self._frame_ms = spec['frame_ms']
+        self._lag_ms = spec['lag_ms']
+        self._fed_ms = 0.0
+        self.pcm_bytes = 0
+        self.encoded_bytes = 0
+        self._process = subprocess.Popen(
+            _INPUT_ARGS + spec['args'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self._output = _EncoderOutput()
+        self._finalizer = weakref.finalize(self, _shutdown, self._process)
+        packetizer = _OggPackets() if codec == 'opus' else _MP3Frames()
+        threading.Thread(
+            target=_read_output, args=(self._process.stdout, packetizer, self._output, self._frame_ms),
+            daemon=True, name=f'{codec}-encoder'
+        ).start()
+
+    def _take(self):
+        with self._output.condition:
+            packets, self._output.packets = self._output.packets, []
+        payload = b''.join(struct.pack('>H', len(packet)) + packet for packet in packets)
+        self.encoded_bytes += len(payload)
+        return payload
+
+    def encode(self, pcm):
+        """
+        写入一块 PCM，返回已经编码好的包（AUDIO 帧负载，可能为空）
+
+        写入后最多等待 AUDIO_ENCODER_WAIT_MS，让这块 PCM 对应的编码包赶上同一个 AUDIO 帧
+        """
+        try:
+            self._process.stdin.write(pcm)
+            self._process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            raise TranscodeError(f'{self.codec} 编码进程已退出: {e}')
+        self.pcm_bytes += len(pcm)
+        self._fed_ms += len(pcm) / 48  # 24kHz 16-bit：48 字节 / 毫秒
+
+        deadline = time.monotonic() + AUDIO_ENCODER_WAIT_MS / 1000
+        output = self._output
+        with output.condition:
+            while output.produced_ms < self._fed_ms - self._lag_ms and not output.done:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    _incr('wait_timeouts')
+                    break
+                output.condition.wait(remaining)
+            if output.done and self._process.poll() not in (None, 0):
+                raise TranscodeError(f'{self.codec} 编码进程异常退出（退出码 {self._process.returncode}）')
+        return self._take()
+
+    def close(self):
+        """
+        结束输入并取出编码器内部剩余的包（流结束时调用，不抛出异常）
+
+        返回:
+            AUDIO 帧负载（可能为空）
+        """
+        if not self._finalizer.alive:
+            return b''
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        with self._output.condition:
+            self._output.condition.wait_for(lambda: self._output.done, timeout=5)
+        payload = self._take()
+        self._finalizer()
+        with _stats_lock:
+            _stats['pcm_bytes'] += self.pcm_bytes
+            _stats['encoded_bytes'] += self.encoded_bytes
+            if self._process.returncode != 0 or self._output.error:
+                _stats['failures'] += 1
+        return payload
+
+    def abort(self):
+        """终止编码进程并归还名额，丢弃尚未取出的数据（响应中途结束时调用；close() 之后调用无效果）"""
+        if not self._finalizer.alive:
+            return
+        self._finalizer()
+        _incr('aborted')
+
+
+def open_audio_encoder(codec):
+    """
+    为一个响应启动流式编码器
+
+    返回:
+        StreamingAudioEncoder；编码进程数已达上限或启动失败时返回 None（本次响应使用 PCM）
+    """
+    if not _slots.acquire(blocking=False):
+        _incr('rejected')
+        print(f'⚠️ 音频编码进程已达上限（{AUDIO_ENCODER_MAX_STREAMS}），本次响应使用 PCM')
+        return None
+    try:
+        encoder = StreamingAudioEncoder(codec)
+    except Exception as e:
+        _slots.release()
+        _incr('failures')
+        print(f'❌ 启动 {codec} 编码器失败，本次响应使用 PCM: {e}')
+        return None
+    with _stats_lock:
+        _stats['streams'] += 1
+        _stats['active'] += 1
+    return encoder
+
+
+def get_audio_encoder_stats():
+    """返回各格式的协商次数、编码流数 / 拒绝 / 失败 / 中途终止次数和压缩比"""
+    with _stats_lock:
+        stats = dict(_stats, negotiated=dict(_stats['negotiated']))
+    stats.update(
+        compression_ratio=stats['pcm_bytes'] / stats['encoded_bytes'] if stats['encoded_bytes'] else None,
+        codecs=[codec for codec in AUDIO_STREAM_CODECS if codec in CODECS] if _FFMPEG_AVAILABLE else [],
+        max_streams=AUDIO_ENCODER_MAX_STREAMS,
+    )
+    return stats
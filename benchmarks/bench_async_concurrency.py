@@ -0,0 +1,171 @@
+"""
+并发能力基准测试：线程模式（app_agent） vs ASGI 模式（app_agent_async）
+
+用固定延迟模拟上游（大模型 + 流式 TTS），在进程内同时发起 N 个 /api/chat 对话，
+对比两种服务模式的总耗时、单请求延迟和峰值线程数。
+
+线程模式按常见部署（gunicorn gthread）限制工作线程数，ASGI 模式只用一个事件循环。
+
+运行:
+    python benchmarks/bench_async_concurrency.py --conversations 300 --threads 32
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('API_KEY', 'bench')
+
+import app_agent
+import app_agent_async
+
+LLM_LATENCY = 1.0       # 模拟大模型响应时间（秒）
+TTS_CHUNKS = 10         # 模拟 TTS 音频片段数
+TTS_CHUNK_INTERVAL = 0.1
+PCM_CHUNK = b'\x00' * 4800
+
+FAKE_RESPONSE_TEXT = '{"message": "你好，我们开始练习吧。", "actions": []}'
+
+
+class _FakeMessage:
+    content = FAKE_RESPONSE_TEXT
+
+
+class _FakeChoice:
+    message = _FakeMessage()
+
+
+class _FakeResponse:
+    choices = [_FakeChoice()]
+
+
+def fake_multimodal_chat(messages, modalities=['text'], stream=False):
+    time.sleep(LLM_LATENCY)
+    return _FakeResponse()
+
+
+def fake_stream_tts(text, voice='Cherry', language='Chinese'):
+    for _ in range(TTS_CHUNKS):
+        time.sleep(TTS_CHUNK_INTERVAL)
+        yield PCM_CHUNK
+
+
+async def fake_amultimodal_chat(messages, modalities=['text'], stream=False):
+    await asyncio.sleep(LLM_LATENCY)
+    return _FakeResponse()
+
+
+async def fake_astream_tts(text, voice='Cherry', language='Chinese'):
+    for _ in range(TTS_CHUNKS):
+        await asyncio.sleep(TTS_CHUNK_INTERVAL)
+        yield PCM_CHUNK
+
+
+def _form(i):
+    return {
+        'student_id': 'student_001',
+        'session_id': f'bench_{i}',
+        'text': '你好'
+    }
+
+
+class PeakThreadSampler:
+    """后台采样进程线程数峰值"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.01)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_threaded(conversations, threads):
+    app_agent.multimodal_chat = fake_multimodal_chat
+    app_agent.stream_tts = fake_stream_tts
+    client = app_agent.app.test_client()
+
+    def one(i):
+        response = client.post('/api/chat', data=_form(i))
+        body = response.get_data()
+        assert response.status_code == 200 and len(body) > TTS_CHUNKS * len(PCM_CHUNK)
+        # 从统一起点计时，包含排队等待工作线程的时间
+        return time.perf_counter() - start
+
+    with PeakThreadSampler() as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(one, range(conversations)))
+        elapsed = time.perf_counter() - start
+
+    return elapsed, latencies, sampler.peak
+
+
+def run_async(conversations):
+    app_agent_async.amultimodal_chat = fake_amultimodal_chat
+    app_agent_async.astream_tts = fake_astream_tts
+    client = app_agent_async.app.test_client()
+
+    async def one(i):
+        response = await client.post('/api/chat', form=_form(i))
+        body = await response.get_data()
+        assert response.status_code == 200 and len(body) > TTS_CHUNKS * len(PCM_CHUNK)
+        return time.perf_counter() - start
+
+    async def main():
+        return await asyncio.gather(*(one(i) for i in range(conversations)))
+
+    with PeakThreadSampler() as sampler:
+        start = time.perf_counter()
+        latencies = asyncio.run(main())
+        elapsed = time.perf_counter() - start
+
+    return elapsed, latencies, sampler.peak
+
+
+def report(name, conversations, elapsed, latencies, peak_threads):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f'{name:<10} 对话数 {conversations:>4} | 总耗时 {elapsed:6.2f}s | '
+          f'吞吐 {conversations / elapsed:6.1f} 对话/s | '
+          f'p50 {statistics.median(latencies):5.2f}s | p95 {p95:5.2f}s | '
+          f'峰值线程 {peak_threads}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=300, help='并发对话数')
+    parser.add_argument('--threads', type=int, default=32, help='线程模式的工作线程数')
+    args = parser.parse_args()
+
+    # 屏蔽请求处理中的调试输出，只保留结果
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        threaded = run_threaded(args.conversations, args.threads)
+        asgi = run_async(args.conversations)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    ideal = LLM_LATENCY + TTS_CHUNKS * TTS_CHUNK_INTERVAL
+    print(f'📊 模拟上游: 大模型 {LLM_LATENCY}s + TTS {TTS_CHUNKS}×{TTS_CHUNK_INTERVAL}s（单对话理想耗时 {ideal:.1f}s）')
+    report(f'线程({args.threads})', args.conversations, *threaded)
+    report('ASGI', args.conversations, *asgi)
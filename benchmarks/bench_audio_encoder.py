@@ -0,0 +1,117 @@
+"""
+流式音频压缩基准：v2 帧协议下裸 PCM vs Opus vs MP3（audio_encoder）
+
+生成一段类似语音的 PCM（带基频滑动的谐波 + 音节包络 + 停顿，24kHz 16-bit 单声道），按 PCMChunker
+的分块依次写入 stream_protocol.FrameStream（与流式接口相同），统计每种格式:
+    - 线上字节数和码率（含帧头，不含 METADATA / STATS）
+    - 每次 audio() 调用的耗时（写入 ffmpeg + 等待这块的编码输出）和每块发出后编码器仍缓冲的音频时长
+    - 在 --link-kbps 的弱网下传完第一个 AUDIO 帧和全部音频需要的时间，以及相对实时播放的卡顿时长
+编码器需要 ffmpeg（libopus / libmp3lame）。
+
+运行:
+    python benchmarks/bench_audio_encoder.py --seconds 20 --link-kbps 256
+"""
+
+import argparse
+import math
+import os
+import random
+import statistics
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from audio_encoder import get_audio_encoder_stats
+from pcm_chunker import PCMChunker
+from stream_protocol import FrameStream
+
+SAMPLE_RATE = 24000
+
+
+def speech_like_pcm(seconds, seed=0):
+    """音节（150–300 ms，基频 100–250 Hz 滑动，前 8 个谐波逐渐衰减）之间夹着短停顿"""
+    rng = random.Random(seed)
+    samples = []
+    while len(samples) < seconds * SAMPLE_RATE:
+        length = int(rng.uniform(0.15, 0.3) * SAMPLE_RATE)
+        f0, f1 = rng.uniform(100, 250), rng.uniform(100, 250)
+        phase = 0.0
+        for i in range(length):
+            f = f0 + (f1 - f0) * i / length
+            phase += 2 * math.pi * f / SAMPLE_RATE
+            envelope = math.sin(math.pi * i / length)
+            value = sum(math.sin(k * phase) / k for k in range(1, 9)) * envelope
+            samples.append(int(6000 * value + rng.gauss(0, 200)))
+        samples.extend(int(rng.gauss(0, 100)) for _ in range(int(rng.uniform(0.03, 0.12) * SAMPLE_RATE)))
+    samples = samples[:int(seconds * SAMPLE_RATE)]
+    return struct.pack(f'<{len(samples)}h', *(max(-32768, min(32767, s)) for s in samples))
+
+
+def upstream_chunks(pcm, fragment_bytes):
+    """上游按固定大小的片段产出，经 PCMChunker 整理成接口实际发送的块"""
+    chunker = PCMChunker()
+    for offset in range(0, len(pcm), fragment_bytes):
+        yield from chunker.feed(pcm[offset:offset + fragment_bytes])
+    tail = chunker.flush()
+    if tail:
+        yield tail
+
+
+def run(codec, chunks):
+    """返回 (AUDIO 帧字节数列表, 每次 audio() 耗时, 每块发出后编码器缓冲的毫秒数)"""
+    output = FrameStream(codec=codec)
+    output.start({})
+    encoder = output.encoder
+    if codec and encoder is None:
+        raise RuntimeError(f'无法启动 {codec} 编码器（需要 ffmpeg）')
+    time.sleep(0.2)  # 接口中 ffmpeg 在发送首帧时启动，与等待 TTS 首包重叠，这里不计入进程启动时间
+    frames, calls, buffered = [], [], []
+    fed = 0
+    for pcm in chunks:
+        started = time.perf_counter()
+        frames.extend(len(frame) for frame in output.audio(pcm))
+        calls.append(time.perf_counter() - started)
+        fed += len(pcm)
+        if encoder is not None:
+            buffered.append(max(0.0, fed / 48 - encoder._output.produced_ms))
+    frames.extend(len(frame) for frame in output.end()[:-2])  # 去掉 STATS / END
+    return frames, calls, buffered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=20, help='音频时长（秒）')
+    parser.add_argument('--fragment-bytes', type=int, default=4800, help='上游片段大小（字节）')
+    parser.add_argument('--link-kbps', type=float, default=256, help='模拟弱网的下行带宽（kbit/s）')
+    args = parser.parse_args()
+
+    pcm = speech_like_pcm(args.seconds)
+    chunks = list(upstream_chunks(pcm, args.fragment_bytes))
+
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        results = {label: run(codec, chunks) for label, codec in (('PCM', None), ('Opus', 'opus'), ('MP3', 'mp3'))}
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    print(f'📊 {args.seconds:.0f} 秒类语音音频，{len(chunks)} 块（第一块 {len(chunks[0])} 字节），'
+          f'弱网 {args.link_kbps:.0f} kbit/s')
+    link = args.link_kbps * 1000 / 8  # 字节 / 秒
+    for label, (frames, calls, buffered) in results.items():
+        total = sum(frames)
+        transfer = total / link
+        print(f'\n🔹 {label}')
+        print(f'   线上字节     {total / 1024:8.1f} KB（{total * 8 / args.seconds / 1000:6.1f} kbit/s，'
+              f'{len(frames)} 个 AUDIO 帧）')
+        print(f'   audio() 耗时 平均 {statistics.mean(calls) * 1000:6.2f} ms | 最大 {max(calls) * 1000:6.2f} ms')
+        if buffered:
+            print(f'   编码器缓冲   平均 {statistics.mean(buffered):6.1f} ms | 最大 {max(buffered):6.1f} ms')
+        print(f'   弱网传输     第一帧 {frames[0] / link * 1000:7.1f} ms | 全部 {transfer:6.2f} s'
+              f' | 卡顿约 {max(0.0, transfer - args.seconds):6.2f} s')
+    stats = get_audio_encoder_stats()
+    print(f'\n🔹 编码器: {stats["streams"]} 个流 | 压缩比 {stats["compression_ratio"]:.1f}x'
+          f' | 等待超时 {stats["wait_timeouts"]} 次 | 失败 {stats["failures"]} 次')
@@ -0,0 +1,94 @@
+"""
+视频输入精简基准：整段视频 vs 抽帧 + 音轨
+
+对不同时长的测试视频（lavfi 生成，带音轨）比较两种输入方式:
+    - 上传字节数（data URI 总长度）
+    - 本地预处理耗时（抽帧 + 音轨提取）
+    - --live 时实际调用大模型，额外比较输入 token 数（usage.prompt_tokens）和端到端耗时
+      （需要真实的 API_KEY，会产生费用）
+
+运行:
+    python benchmarks/bench_frame_sampler.py --durations 5 15 30
+    API_KEY=sk-xxx python benchmarks/bench_frame_sampler.py --durations 10 --live
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('API_KEY', 'bench')
+
+import frame_sampler
+from frame_sampler import video_content_parts
+
+
+def make_clip(duration, size):
+    """生成带音轨的 MP4 测试视频（画面持续变化）"""
+    workdir = tempfile.mkdtemp(prefix='bench_frames_')
+    path = os.path.join(workdir, 'clip.mp4')
+    try:
+        subprocess.run([
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30',
+            '-f', 'lavfi', '-i', 'sine=frequency=440',
+            '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28',
+            '-c:a', 'aac', path
+        ], check=True)
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        shutil.rmtree(workdir)
+
+
+def call_model(parts):
+    """实际调用大模型，返回 (prompt_tokens, 耗时)"""
+    from multimodal_engine import multimodal_chat
+    started = time.perf_counter()
+    response = multimodal_chat([{
+        'role': 'user',
+        'content': parts + [{'type': 'text', 'text': '用一句话描述视频内容。'}]
+    }])
+    return response.usage.prompt_tokens, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=int, nargs='+', default=[5, 15, 30], help='测试视频时长（秒）')
+    parser.add_argument('--size', default='1280x720', help='测试视频分辨率')
+    parser.add_argument('--live', action='store_true', help='实际调用大模型统计 token 和耗时')
+    args = parser.parse_args()
+
+    print(f'📊 抽帧配置: {frame_sampler.FRAME_SAMPLE_FPS:g} fps，最多 {frame_sampler.FRAME_MAX_COUNT} 帧，'
+          f'宽度 ≤ {frame_sampler.FRAME_MAX_WIDTH}，场景阈值 {frame_sampler.FRAME_SCENE_THRESHOLD:g}')
+
+    for duration in args.durations:
+        clip = make_clip(duration, args.size)
+
+        real_stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            results = {}
+            for mode in ('video', 'frames'):
+                started = time.perf_counter()
+                parts, report = video_content_parts(clip, 'video/mp4', mode)
+                prepare_time = time.perf_counter() - started
+                live = call_model(parts) if args.live else None
+                results[mode] = (report, prepare_time, live)
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+        print(f'\n🔹 {duration}s {args.size}（MP4 {len(clip) / 1024:.0f} KB）')
+        full_bytes = results['video'][0]['upload_bytes']
+        for mode, (report, prepare_time, live) in results.items():
+            label = '整段视频' if mode == 'video' else f'抽帧 {report["frames"]} 帧 + 音轨'
+            line = (f'   {label:<14} 上传 {report["upload_bytes"] / 1024:8.0f} KB '
+                    f'({report["upload_bytes"] / full_bytes:5.0%}) | 预处理 {prepare_time * 1000:6.0f} ms')
+            if live:
+                line += f' | 输入 token {live[0]:6d} | 端到端 {prepare_time + live[1]:5.2f}s'
+            print(line)
@@ -0,0 +1,132 @@
+"""
+前端代理基准：原转发方式 vs 流式转发（首个音频帧延迟、上传内存）
+
+本地起一个模拟 Agent（HTTP/1.0，与 Flask 开发服务器一样以关闭连接结束响应体），读完上传后每隔
+--frame-interval-ms 发送一个 --frame-bytes 字节的音频帧；代理分别用:
+    - 原方式: 每个请求单独 requests.post，从 request.files 重建 multipart，响应按 8KB 重新切块
+    - 流式转发: app_frontend.proxy_api（请求体原样流式转发、连接池、收到即转发）
+在同一进程中用 werkzeug 服务器启动，客户端上传 --upload-mb 的视频，统计首帧延迟、总耗时和代理
+处理请求期间 Python 堆内存峰值（tracemalloc；multipart 请求体在计时前构建好，不计入）。
+
+运行:
+    python benchmarks/bench_frontend_proxy.py --upload-mb 20 --requests 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import requests
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+
+class FakeAgent(BaseHTTPRequestHandler):
+    """读完请求体后按固定间隔发送音频帧"""
+
+    frame_bytes = 4000
+    frame_interval = 0.05
+    frames = 10
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.end_headers()
+        for i in range(self.frames):
+            self.wfile.write(bytes([i]) * self.frame_bytes)
+            self.wfile.flush()
+            time.sleep(self.frame_interval)
+
+
+def make_old_proxy(agent_url):
+    """原 app_frontend.proxy_api 的 POST 分支"""
+    old = Flask('old_proxy')
+
+    @old.route('/api/<path:path>', methods=['POST'])
+    def proxy_api(path):
+        files = {}
+        for key in request.files:
+            file = request.files[key]
+            files[key] = (file.filename, file.stream, file.content_type)
+        resp = requests.post(f'{agent_url}/api/{path}', data=request.form, files=files or None, stream=True)
+        return Response(resp.iter_content(chunk_size=8192), status=resp.status_code, headers=dict(resp.headers))
+
+    return old
+
+
+def serve(wsgi_app):
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def run(url, upload, count):
+    """返回 (首帧延迟列表, 总耗时列表, 内存峰值)"""
+    first_frame, elapsed = [], []
+    tracemalloc.start()
+    for _ in range(count):
+        started = time.perf_counter()
+        response = requests.post(f'{url}/api/chat', data=upload.body, headers=upload.headers, stream=True)
+        first = None
+        for _ in response.raw.stream(1024, decode_content=False):
+            if first is None:
+                first = time.perf_counter() - started
+        first_frame.append(first)
+        elapsed.append(time.perf_counter() - started)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first_frame, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--upload-mb', type=float, default=20, help='上传视频大小（MB）')
+    parser.add_argument('--requests', type=int, default=5, help='每种方式的请求数')
+    parser.add_argument('--frame-bytes', type=int, default=4000, help='每个音频帧的字节数')
+    parser.add_argument('--frame-interval-ms', type=float, default=50, help='音频帧间隔（毫秒）')
+    args = parser.parse_args()
+
+    FakeAgent.frame_bytes = args.frame_bytes
+    FakeAgent.frame_interval = args.frame_interval_ms / 1000
+    agent = ThreadingHTTPServer(('127.0.0.1', 0), FakeAgent)
+    threading.Thread(target=agent.serve_forever, daemon=True).start()
+    agent_url = f'http://127.0.0.1:{agent.server_port}'
+
+    os.environ['AGENT_URL'] = agent_url
+    import app_frontend
+
+    video = os.urandom(int(args.upload_mb * 1024 * 1024))
+    upload = requests.Request('POST', agent_url, data={'student_id': 'student_001'},
+                              files={'video': ('video.webm', video, 'video/webm')}).prepare()
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        results = {}
+        for label, wsgi_app in (('原方式', make_old_proxy(agent_url)), ('流式转发', app_frontend.app)):
+            server, url = serve(wsgi_app)
+            results[label] = run(url, upload, args.requests)
+            server.shutdown()
+    finally:
+        sys.stdout.close()
+        sys.stdout, sys.stderr = real_stdout, real_stderr
+
+    print(f'📊 上传 {args.upload_mb:.0f} MB × {args.requests} 次，Agent 每 {args.frame_interval_ms:.0f} ms '
+          f'发送 {args.frame_bytes} 字节的音频帧')
+    for label, (first_frame, elapsed, peak) in results.items():
+        print(f'\n🔹 {label}')
+        print(f'   首帧延迟 平均 {statistics.mean(first_frame) * 1000:7.1f} ms')
+        print(f'   总耗时   平均 {statistics.mean(elapsed) * 1000:7.1f} ms')
+        print(f'   代理内存峰值   {peak / 1024 / 1024:7.1f} MB')
@@ -0,0 +1,99 @@
+"""
+历史窗口基准：长会话中每轮请求的历史 token 数，按条数截断 vs token 预算 + 滚动摘要
+
+模拟一个回复长短不一的长会话（回复长度在短句和长段落之间随机变化），逐轮统计送给模型的历史部分
+估算 token 数:
+    - 按条数截断: 原方式，保留最近 20 条消息
+    - token 预算 + 摘要: build_history_window，每轮保存后 schedule_summary（摘要由本地假模型生成，
+      不访问网络；为了结果可复现，每轮等待后台摘要完成后再进入下一轮）
+
+运行:
+    python benchmarks/bench_history_window.py --turns 40 --budget 1500
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import history_window
+from history_window import build_history_window, schedule_summary, estimate_message_tokens, estimate_tokens
+from session_store import MemorySessionStore
+
+SENTENCE = '你的眼神交流比上一轮自然多了，回答结构也更清晰，下一步可以试着放慢语速。'
+
+
+def fake_summarize(client, model, summary, messages):
+    """假摘要：固定长度的文本，模拟 SUMMARY_MAX_TOKENS 限制下的模型输出"""
+    return ('学生已完成多轮练习，' + SENTENCE * 4)[:history_window.SUMMARY_MAX_TOKENS]
+
+
+def make_reply(rng):
+    """长度在 1 ~ 12 句之间随机变化的回复"""
+    return '{"message": "' + SENTENCE * rng.randint(1, 12) + '", "actions": ["nod"]}'
+
+
+def run(turns, window_func, save_func, seed=0):
+    """逐轮构建历史并保存，返回每轮历史的估算 token 数"""
+    rng = random.Random(seed)
+    sizes = []
+    for turn in range(turns):
+        history = window_func()
+        sizes.append(sum(estimate_message_tokens(m) for m in history))
+        save_func(f'用户上传了视频片段（第 {turn + 1} 轮）', make_reply(rng))
+    return sizes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=40, help='对话轮数')
+    parser.add_argument('--budget', type=int, default=history_window.HISTORY_TOKEN_BUDGET, help='历史 token 预算')
+    args = parser.parse_args()
+
+    history_window.summarize = fake_summarize
+
+    count_store = MemorySessionStore(max_history=20)
+    budget_store = MemorySessionStore(max_history=20)
+
+    def save_count(user, reply):
+        count_store.append('bench', {'role': 'user', 'content': user}, {'role': 'assistant', 'content': reply})
+
+    def save_budget(user, reply):
+        budget_store.append('bench', {'role': 'user', 'content': user}, {'role': 'assistant', 'content': reply})
+        schedule_summary(budget_store, 'bench', None, 'bench', budget=args.budget)
+        while history_window.get_history_window_stats()['summaries_in_flight']:
+            time.sleep(0.001)
+
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        count_sizes = run(args.turns, lambda: count_store.get_history('bench'), save_count)
+        budget_sizes = run(args.turns, lambda: build_history_window(budget_store, 'bench', args.budget), save_budget)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    text = make_reply(random.Random(0)) * 10
+    started = time.perf_counter()
+    for _ in range(1000):
+        estimate_tokens(text)
+    estimate_us = (time.perf_counter() - started) / 1000 * 1e6
+
+    print(f'📊 {args.turns} 轮对话，每轮历史的估算 token 数（预算 {args.budget}）')
+    print(f'\n🔹 逐轮（每 5 轮）')
+    print(f'   {"轮次":>4} {"按条数截断":>10} {"预算+摘要":>10}')
+    for turn in range(0, args.turns, 5):
+        print(f'   {turn + 1:>6} {count_sizes[turn]:>14} {budget_sizes[turn]:>13}')
+
+    # 前 10 轮是会话增长阶段，只统计之后的稳定阶段
+    steady = slice(min(10, args.turns - 1), None)
+    print(f'\n🔹 第 {steady.start + 1} 轮之后')
+    for label, sizes in (('按条数截断', count_sizes), ('预算+摘要', budget_sizes)):
+        values = sizes[steady]
+        print(f'   {label:<10} 平均 {statistics.mean(values):7.0f} | 最小 {min(values):5} | 最大 {max(values):5}'
+              f' | 标准差 {statistics.pstdev(values):6.0f}')
+    print(f'\n🔹 estimate_tokens: {len(text)} 字符 {estimate_us:.1f} µs')
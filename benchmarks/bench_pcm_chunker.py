@@ -0,0 +1,143 @@
+"""
+PCM 分块基准：pcm_buffer += 片段 vs PCMChunker（预分配缓冲区 + 自适应块大小）
+
+1. 分块开销：把一段长音频切成固定大小的上游片段（默认 960 字节 ≈ 20 ms，与实时语音接口的音频增量
+   相当）依次送入，统计:
+       - 原方式: pcm_buffer += pcm_chunk，攒够 24000 字节发送一块
+       - PCMChunker: 第一块 4800 字节，之后翻倍增长到 24000 字节
+   的分配次数（新建 bytes 对象数）、复制的字节数、tracemalloc 峰值和耗时，并校验两者拼接结果一致。
+2. 首块延迟：假上游每 --interval-ms 产出一个 --tts-chunk-bytes 的片段（实时合成速度），统计从第一个
+   片段到达到第一块发出的时间。
+
+运行:
+    python benchmarks/bench_pcm_chunker.py --seconds 30 --fragment-bytes 960 --interval-ms 40
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pcm_chunker
+from pcm_chunker import PCMChunker
+
+MIN_CHUNK_SIZE = 24000  # 原来各接口的块大小
+
+
+def legacy_chunks(fragments, counters=None):
+    """原方式：bytes 累加，攒够 MIN_CHUNK_SIZE 发送"""
+    pcm_buffer = b''
+    for pcm_chunk in fragments:
+        pcm_buffer += pcm_chunk
+        if counters is not None:
+            counters['allocations'] += 1
+            counters['copied'] += len(pcm_buffer)
+        if len(pcm_buffer) >= MIN_CHUNK_SIZE:
+            yield pcm_buffer
+            pcm_buffer = b''
+    if pcm_buffer:
+        yield pcm_buffer
+
+
+def chunker_chunks(fragments, counters=None):
+    """PCMChunker：只有发出的块分配一次"""
+    chunker = PCMChunker()
+    for pcm_chunk in fragments:
+        if counters is not None:
+            counters['copied'] += len(pcm_chunk)  # 写入预分配缓冲区
+        for pcm in chunker.feed(pcm_chunk):
+            if counters is not None:
+                counters['allocations'] += 1
+                counters['copied'] += len(pcm)
+            yield pcm
+    pcm = chunker.flush()
+    if pcm:
+        if counters is not None:
+            counters['allocations'] += 1
+            counters['copied'] += len(pcm)
+        yield pcm
+
+
+def measure(split, fragments, repeat):
+    """返回 (块列表, 分配次数, 复制字节数, tracemalloc 峰值, 平均耗时)"""
+    counters = {'allocations': 0, 'copied': 0}
+    chunks = list(split(fragments, counters))
+
+    tracemalloc.start()
+    for _ in split(fragments):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    elapsed = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in split(fragments):
+            pass
+        elapsed.append(time.perf_counter() - started)
+    return chunks, counters['allocations'], counters['copied'], peak, statistics.mean(elapsed)
+
+
+def fake_upstream(count, size, interval):
+    """假 TTS：按实时速度产出片段"""
+    for i in range(count):
+        if i:
+            time.sleep(interval)
+        yield bytes([i % 256]) * size
+
+
+def first_chunk_latency(split, count, size, interval):
+    started = time.perf_counter()
+    for _ in split(fake_upstream(count, size, interval)):
+        return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=30, help='分块开销测试的音频时长（秒，24kHz 16-bit）')
+    parser.add_argument('--fragment-bytes', type=int, default=960, help='上游片段大小（字节）')
+    parser.add_argument('--repeat', type=int, default=20, help='耗时测试的重复次数')
+    parser.add_argument('--tts-chunk-bytes', type=int, default=4800, help='首块延迟测试中假上游的片段大小（字节）')
+    parser.add_argument('--interval-ms', type=float, default=40, help='首块延迟测试中假上游的片段间隔（毫秒）')
+    parser.add_argument('--streams', type=int, default=5, help='首块延迟测试的流数')
+    args = parser.parse_args()
+
+    total = int(args.seconds * 48000)
+    fragments = [bytes([i % 256]) * args.fragment_bytes for i in range(total // args.fragment_bytes)]
+    tts_count = MIN_CHUNK_SIZE // args.tts_chunk_bytes + 2
+
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        results = {label: measure(split, fragments, args.repeat)
+                   for label, split in (('pcm_buffer +=', legacy_chunks), ('PCMChunker', chunker_chunks))}
+        latency = {label: [first_chunk_latency(split, tts_count, args.tts_chunk_bytes, args.interval_ms / 1000)
+                           for _ in range(args.streams)]
+                   for label, split in (('pcm_buffer +=', legacy_chunks), ('PCMChunker', chunker_chunks))}
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    expected = b''.join(fragments)
+    for chunks, *_ in results.values():
+        assert b''.join(chunks) == expected, '分块拼接结果与输入不一致'
+
+    print(f'📊 {args.seconds:.0f} 秒音频（{total / 1024 / 1024:.1f} MB），'
+          f'{len(fragments)} 个 {args.fragment_bytes} 字节的上游片段')
+    for label, (chunks, allocations, copied, peak, elapsed) in results.items():
+        print(f'\n🔹 {label}')
+        print(f'   发出块数   {len(chunks):7}（第一块 {len(chunks[0])} 字节）')
+        print(f'   分配次数   {allocations:7}')
+        print(f'   复制字节   {copied / 1024 / 1024:7.1f} MB')
+        print(f'   内存峰值   {peak / 1024:7.1f} KB')
+        print(f'   耗时       {elapsed * 1000:7.2f} ms')
+
+    print(f'\n📊 首块延迟：假上游每 {args.interval_ms:.0f} ms 产出 {args.tts_chunk_bytes} 字节，{args.streams} 个流')
+    for label, values in latency.items():
+        print(f'🔹 {label:14} 平均 {statistics.mean(values) * 1000:7.1f} ms')
+    print(f'\n🔹 配置: {pcm_chunker.get_chunker_stats()["first_chunk_bytes"]} → '
+          f'{pcm_chunker.PCM_MAX_CHUNK_BYTES} 字节，增长 ×{pcm_chunker.PCM_CHUNK_GROWTH:g}')
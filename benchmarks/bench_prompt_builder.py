@@ -0,0 +1,109 @@
+"""
+System Prompt 构建基准：每次读取模板文件并渲染 vs 各级缓存
+
+统计 build_system_prompt 的单次耗时:
+    - 原方式: 每次 open + read system_prompt.md，再渲染学生信息 / 知识点片段并拼接
+    - 仅缓存模板: 模板按 mtime / 哈希缓存，片段每次重新渲染
+    - 全部缓存: prompt_builder 当前实现（片段按记录版本缓存，完整 Prompt 按 (学生, 知识点, 模板) 缓存）
+并演示失效行为：touch 模板（内容不变）只重新校验哈希，修改内容才重新加载；
+mock_data.update_student 后对应的片段和完整 Prompt 重新生成。
+
+运行:
+    python benchmarks/bench_prompt_builder.py --calls 20000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import prompt_builder
+from prompt_builder import build_system_prompt, get_prompt_cache_stats
+from mock_data import get_student, get_knowledge, update_student
+
+
+def build_uncached(student, knowledge):
+    """原实现：每次读取模板文件并渲染片段"""
+    with open(prompt_builder.TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+        template = f.read()
+    return template + "\n\n" + "\n\n".join(_ordered_sections(student, knowledge))
+
+
+def build_template_cached(student, knowledge):
+    """只缓存模板，片段每次渲染"""
+    _, head, _ = prompt_builder._get_template_entry()
+    return head + "\n\n".join(_ordered_sections(student, knowledge))
+
+
+def _ordered_sections(student, knowledge):
+    """按 PROMPT_LAYOUT 排列片段（prefix: 知识点在前；legacy: 学生信息在前）"""
+    sections = (prompt_builder._render_student_section(student),
+                prompt_builder._render_knowledge_section(knowledge))
+    return sections if prompt_builder.PROMPT_LAYOUT == 'legacy' else sections[::-1]
+
+
+def per_call(func, calls, *args):
+    """返回单次调用平均耗时（秒）"""
+    started = time.perf_counter()
+    for _ in range(calls):
+        func(*args)
+    return (time.perf_counter() - started) / calls
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20000, help='调用次数')
+    args = parser.parse_args()
+
+    student = get_student('student_001')
+    knowledge = get_knowledge('eye_contact')
+
+    # 使用模板副本，演示失效时不改动仓库里的文件
+    workdir = tempfile.mkdtemp(prefix='bench_prompt_')
+    prompt_builder.TEMPLATE_PATH = os.path.join(workdir, 'system_prompt.md')
+    shutil.copy(os.path.join(os.path.dirname(__file__), '..', 'system_prompt.md'), prompt_builder.TEMPLATE_PATH)
+
+    real_stdout = sys.stdout
+    try:
+        assert build_uncached(student, knowledge) == build_system_prompt(student, knowledge)
+        assert build_template_cached(student, knowledge) == build_system_prompt(student, knowledge)
+        uncached = per_call(build_uncached, args.calls, student, knowledge)
+        template_cached = per_call(build_template_cached, args.calls, student, knowledge)
+        cached = per_call(build_system_prompt, args.calls, student, knowledge)
+
+        print(f'📊 build_system_prompt 单次耗时（{args.calls} 次，模板 {len(prompt_builder.load_system_prompt_template())} 字符）')
+        print(f'   原方式（每次读文件）  {uncached * 1e6:8.1f} µs')
+        print(f'   仅缓存模板           {template_cached * 1e6:8.1f} µs（{uncached / template_cached:.1f}x）')
+        print(f'   全部缓存             {cached * 1e6:8.1f} µs（{uncached / cached:.1f}x）')
+
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            before = get_prompt_cache_stats()
+            stat = os.stat(prompt_builder.TEMPLATE_PATH)
+            os.utime(prompt_builder.TEMPLATE_PATH, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            build_system_prompt(student, knowledge)
+            with open(prompt_builder.TEMPLATE_PATH, 'a', encoding='utf-8') as f:
+                f.write('\n<!-- bench -->\n')
+            build_system_prompt(student, knowledge)
+            after = get_prompt_cache_stats()
+            update_student(student['student_id'], {'level': '中级'})
+            updated = build_system_prompt(get_student(student['student_id']), knowledge)
+            after_update = get_prompt_cache_stats()
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+        print(f'\n🔹 失效')
+        print(f'   touch（内容不变）后: 内容未变 +{after["unchanged"] - before["unchanged"]}')
+        print(f'   修改内容后:          重新加载 +{after["reloads"] - before["reloads"]}')
+        print(f'   update_student 后:   作废 +{after_update["invalidations"] - after["invalidations"]}，'
+              f'片段重新渲染 +{after_update["section_misses"] - after["section_misses"]}，'
+              f'新 Prompt 包含更新: {"**水平**: 中级" in updated}')
+        print(f'   模板命中率 {after_update["hit_rate"]:.2%} | 片段命中率 {after_update["section_hit_rate"]:.2%}'
+              f' | 完整 Prompt 命中率 {after_update["prompt_hit_rate"]:.2%}')
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,119 @@
+"""
+单次请求内存峰值基准：SDK 发送整段 data URI vs 流式编码请求体
+
+在本地启动一个模拟上游（分块读取并丢弃请求体，返回固定的 chat.completion），
+用 tracemalloc 统计一次带视频的请求在发送过程中的 Python 内存峰值:
+    - 原方式:   base64 str + f-string data URI，交给 OpenAI SDK（json.dumps 整个请求体）
+    - 流式编码: DataURI(bytes)，request_encoder 边编码边发送
+    - 流式编码（文件）: DataURI(文件路径)，原始数据也不进内存（上传落盘时的情况）
+
+运行:
+    python benchmarks/bench_request_memory.py --sizes 5 20 50
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('API_KEY', 'bench')
+
+from openai import OpenAI
+
+from request_encoder import DataURI, create_chat_completion
+
+RESPONSE = json.dumps({
+    'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': 'bench',
+    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'ok'}}],
+}).encode('utf-8')
+
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    """分块读取并丢弃请求体，不把请求体计入内存峰值"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+
+def sdk_request(client, video_data):
+    """原方式：整段 base64 + data URI 字符串，由 SDK 序列化发送"""
+    video_base64 = base64.b64encode(video_data).decode('utf-8')
+    return client.chat.completions.create(
+        model='bench',
+        messages=[{'role': 'user', 'content': [
+            {'type': 'video_url', 'video_url': {'url': f'data:video/mp4;base64,{video_base64}'}},
+            {'type': 'text', 'text': '描述视频内容'}
+        ]}]
+    )
+
+
+def streaming_request(client, source):
+    """流式编码：DataURI 占位，发送时按块编码"""
+    return create_chat_completion(
+        client,
+        model='bench',
+        messages=[{'role': 'user', 'content': [
+            {'type': 'video_url', 'video_url': {'url': DataURI('video/mp4', source)}},
+            {'type': 'text', 'text': '描述视频内容'}
+        ]}]
+    )
+
+
+def measure(func, *args):
+    """返回调用期间的内存峰值增量（bytes）"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - baseline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 50], help='视频大小（MB）')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OpenAI(api_key='bench', base_url=f'http://127.0.0.1:{server.server_port}/v1')
+
+    # 预热连接和模块导入，避免计入首次请求
+    sdk_request(client, b'warmup')
+    streaming_request(client, b'warmup')
+
+    print('📊 单次请求内存峰值（tracemalloc，不含调用前已在内存中的视频数据）')
+    for size in args.sizes:
+        video_data = os.urandom(size * 1024 * 1024)
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+            f.write(video_data)
+            video_path = f.name
+        try:
+            results = [
+                ('原方式 (SDK)', measure(sdk_request, client, video_data)),
+                ('流式编码', measure(streaming_request, client, video_data)),
+                ('流式编码（文件）', measure(streaming_request, client, video_path)),
+            ]
+        finally:
+            os.unlink(video_path)
+
+        print(f'\n🔹 视频 {size} MB')
+        for label, peak in results:
+            print(f'   {label:<12} 峰值 {peak / 1024 / 1024:8.2f} MB（视频大小的 {peak / len(video_data):5.2f} 倍）')
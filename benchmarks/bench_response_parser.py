@@ -0,0 +1,99 @@
+"""
+增量响应解析器微基准：每个 token 的解析开销
+
+把一段典型的 {message, actions} 响应按 LLM 的 token 粒度切片后逐个输入，对比:
+    - ResponseStreamParser.feed（增量解析）
+    - 每来一个 token 就对累积文本重新 json.loads（朴素的"流式"做法）
+    - 只在最后 json.loads 一次（现有非流式做法的下限）
+
+运行:
+    python benchmarks/bench_response_parser.py --repeat 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from response_parser import ResponseStreamParser
+
+SAMPLE_RESPONSE = {
+    'message': (
+        '很好，手势动作是演讲表现力的重要一环。接下来我为你播放一个示范视频，'
+        '请仔细观察正确与错误手势的对比，看完后告诉我你的感受。'
+        '记住"3-5秒法则"：与每位观众保持三到五秒的眼神接触，然后自然地转向下一位。'
+        '你今天的进步很明显，继续保持！'
+    ),
+    'actions': [
+        {'type': 'show', 'content': {'type': 'video', 'url': 'https://cdn.example.com/gesture-demo.mp4',
+                                     'title': '手势示范', 'description': '正确与错误手势对比'}},
+        {'type': 'progress_update', 'data': {'skill': 'body_language', 'score': 6.3,
+                                             'improvement': '+0.5', 'timestamp': '2025-11-12T10:30:00Z'}},
+        {'type': 'open_self_observation', 'video_segment': {'start': '00:15', 'end': '00:32',
+                                                            'highlight': '注意这里的手势'}},
+    ]
+}
+
+
+def tokenize(text, size):
+    """按固定字符数切片，近似模型的流式 token 粒度"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def bench_incremental(tokens, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser = ResponseStreamParser()
+        for token in tokens:
+            parser.feed(token)
+        assert parser.complete and len(parser.actions) == 3
+    return time.perf_counter() - start
+
+
+def bench_reparse(tokens, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text = ''
+        for token in tokens:
+            text += token
+            try:
+                json.loads(text)
+            except json.JSONDecodeError:
+                pass
+    return time.perf_counter() - start
+
+
+def bench_final_only(tokens, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        json.loads(''.join(tokens))
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200, help='每种方式重复解析的次数')
+    args = parser.parse_args()
+
+    text = '```json\n' + json.dumps(SAMPLE_RESPONSE, ensure_ascii=False, indent=2) + '\n```'
+    print(f'📊 响应长度 {len(text)} 字符')
+
+    for token_size in (1, 2, 4):
+        tokens = tokenize(text, token_size)
+        body = tokenize(text[len('```json\n'):-len('\n```')], token_size)
+        total = len(tokens) * args.repeat
+
+        incremental = bench_incremental(tokens, args.repeat)
+        reparse = bench_reparse(body, args.repeat)
+        final_only = bench_final_only(body, args.repeat)
+
+        print(f'\n🔹 token 粒度 {token_size} 字符（{len(tokens)} 个 token）')
+        print(f'   增量解析      {incremental / total * 1e6:8.2f} µs/token  '
+              f'（单次响应 {incremental / args.repeat * 1e3:6.2f} ms）')
+        print(f'   逐 token 重解析 {reparse / total * 1e6:8.2f} µs/token  '
+              f'（单次响应 {reparse / args.repeat * 1e3:6.2f} ms）')
+        print(f'   仅最终解析    {final_only / total * 1e6:8.2f} µs/token  '
+              f'（单次响应 {final_only / args.repeat * 1e3:6.2f} ms，但要等完整响应）')
@@ -0,0 +1,82 @@
+"""
+多片段视频转码基准：逐个串行 vs 并行
+
+生成 N 个 WebM 片段（lavfi 测试源），分别以并发 1 和并发 N 调用 merge_video_segments，
+对比单轮多片段请求的转码耗时，以及最慢单个片段的耗时（并行的理论下限）。
+
+注意：并行收益取决于 CPU 核数（libx264 ultrafast 基本是单核占满），
+在单核机器上两者接近。
+
+运行:
+    python benchmarks/bench_segment_parallel.py --segments 5 --duration 3
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('API_KEY', 'bench')
+
+import app
+import transcoder
+
+
+def make_segments(count, duration):
+    """用 lavfi 生成若干个 WebM 片段"""
+    workdir = tempfile.mkdtemp(prefix='bench_segments_')
+    segments = []
+    try:
+        for i in range(count):
+            path = os.path.join(workdir, f'seg{i}.webm')
+            subprocess.run([
+                'ffmpeg', '-y', '-loglevel', 'error',
+                '-f', 'lavfi', '-i', f'testsrc=size=640x480:rate=30',
+                '-f', 'lavfi', '-i', f'sine=frequency={440 + i * 110}',
+                '-t', str(duration), '-c:v', 'libvpx', '-b:v', '1M', '-c:a', 'libopus', path
+            ], check=True)
+            with open(path, 'rb') as f:
+                segments.append(f.read())
+    finally:
+        shutil.rmtree(workdir)
+    return segments
+
+
+def run(segments, parallelism):
+    """以指定并发合并一次，返回 (总耗时, 最慢单片段编码耗时)"""
+    transcoder.transcoder = transcoder.TranscodeService(workers=parallelism, max_queue=len(segments))
+    app.SEGMENT_PARALLELISM = parallelism
+    start = time.perf_counter()
+    app.merge_video_segments(segments)
+    elapsed = time.perf_counter() - start
+    return elapsed, transcoder.transcoder.stats()['encode_time_max']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=5, help='片段数量')
+    parser.add_argument('--duration', type=int, default=3, help='每个片段时长（秒）')
+    parser.add_argument('--rounds', type=int, default=3, help='每种方式运行轮数')
+    args = parser.parse_args()
+
+    segments = make_segments(args.segments, args.duration)
+
+    results = {}
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for parallelism in (1, args.segments):
+            results[parallelism] = [run(segments, parallelism) for _ in range(args.rounds)]
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    print(f'📊 {args.segments} 个片段 × {args.duration}s，CPU 核数 {os.cpu_count()}，每种方式 {args.rounds} 轮')
+    for parallelism, runs in results.items():
+        best, slowest = min(runs)
+        label = '串行' if parallelism == 1 else f'并行 ×{parallelism}'
+        print(f'   {label:<8} 合并总耗时 {best:6.2f}s | 最慢单片段编码 {slowest:5.2f}s')
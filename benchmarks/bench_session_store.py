@@ -0,0 +1,79 @@
+"""
+会话存储基准：每轮对话的存储开销，内存 vs SQLite（WAL）
+
+每轮对话模拟一次请求对存储的访问：读取历史（get_history）+ 写入一轮（user + assistant 两条）。
+分别在单线程和多线程并发下统计每轮耗时；SQLite 额外报告平均每个事务合并的写操作数
+（group commit）和读缓存命中率。
+
+运行:
+    python benchmarks/bench_session_store.py --sessions 200 --turns 20 --threads 1 8
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+REPLY = '{"message": "你的眼神交流比上一轮自然多了，继续保持。", "actions": ["nod"]}' * 3
+
+
+def run_turns(store, sessions, turns, threads):
+    """在 threads 个线程中跑完 sessions × turns 轮对话，返回每轮平均耗时（秒）"""
+    def worker(session_ids):
+        for _ in range(turns):
+            for session_id in session_ids:
+                store.get_history(session_id)
+                store.append(
+                    session_id,
+                    {'role': 'user', 'content': '用户上传了视频片段'},
+                    {'role': 'assistant', 'content': REPLY}
+                )
+
+    session_ids = [f'bench_{i}' for i in range(sessions)]
+    workers = [threading.Thread(target=worker, args=(session_ids[i::threads],)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return (time.perf_counter() - started) / (sessions * turns)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=200, help='会话数')
+    parser.add_argument('--turns', type=int, default=20, help='每个会话的轮数')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8], help='并发线程数')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_sessions_')
+    real_stdout = sys.stdout
+    try:
+        print(f'📊 {args.sessions} 个会话 × {args.turns} 轮（每轮 get_history + append 2 条），CPU 核数 {os.cpu_count()}')
+        for threads in args.threads:
+            memory = MemorySessionStore()
+            sqlite = SQLiteSessionStore(path=os.path.join(workdir, f'sessions_{threads}.db'))
+
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                memory_time = run_turns(memory, args.sessions, args.turns, threads)
+                sqlite_time = run_turns(sqlite, args.sessions, args.turns, threads)
+            finally:
+                sys.stdout.close()
+                sys.stdout = real_stdout
+
+            stats = sqlite.get_stats()
+            print(f'\n🔹 并发 {threads} 线程')
+            print(f'   内存      每轮 {memory_time * 1e6:8.1f} µs')
+            print(f'   SQLite    每轮 {sqlite_time * 1e6:8.1f} µs（+{(sqlite_time - memory_time) * 1e6:.1f} µs）'
+                  f' | 每事务 {stats["avg_batch_size"]:.1f} 个写操作 | 缓存命中率 {stats["cache_hit_rate"]:.0%}'
+                  f' | 数据库 {stats["db_bytes"] / 1024:.0f} KB')
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,134 @@
+"""
+转码方式基准：管道（stdin/stdout，不落盘） vs 临时文件
+
+对 convert_webm_to_mp4 / convert_webm_to_wav / convert_pcm_to_mp3 分别测量:
+    - 延迟（中位数 / 最小值）
+    - Python 侧文件系统操作次数（通过 audit hook 统计 open / remove 等事件）
+    - 系统调用总数（仅当安装了 strace 时统计，包含 ffmpeg 子进程）
+
+测试素材由 ffmpeg 的 lavfi 生成，无需准备文件，也不需要 API Key。
+
+运行:
+    python benchmarks/bench_transcode_pipes.py --runs 10 --duration 5
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('API_KEY', 'bench')
+
+import app
+
+FS_EVENTS = {'open', 'os.remove', 'os.unlink', 'os.rename', 'tempfile.mkstemp', 'os.truncate'}
+_fs_counter = {'count': 0, 'enabled': False}
+
+
+def _audit(event, args):
+    if _fs_counter['enabled'] and event in FS_EVENTS:
+        _fs_counter['count'] += 1
+
+
+sys.addaudithook(_audit)
+
+
+def make_samples(duration):
+    """用 lavfi 生成 WebM 视频、WebM 音频和 PCM 测试素材"""
+    workdir = tempfile.mkdtemp(prefix='bench_transcode_')
+    video = os.path.join(workdir, 'video.webm')
+    audio = os.path.join(workdir, 'audio.webm')
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=size=640x480:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', str(duration), '-c:v', 'libvpx', '-b:v', '1M', '-c:a', 'libopus', video
+    ], check=True)
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', 'sine=frequency=440',
+        '-t', str(duration), '-c:a', 'libopus', audio
+    ], check=True)
+    with open(video, 'rb') as f:
+        video_data = f.read()
+    with open(audio, 'rb') as f:
+        audio_data = f.read()
+    shutil.rmtree(workdir)
+    pcm_data = b'\x00\x10' * 24000 * duration
+    return video_data, audio_data, pcm_data
+
+
+def measure(func, data, runs):
+    latencies = []
+    _fs_counter['count'] = 0
+    _fs_counter['enabled'] = True
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(data)
+        latencies.append(time.perf_counter() - start)
+    _fs_counter['enabled'] = False
+    return latencies, _fs_counter['count'] / runs
+
+
+def count_syscalls(func_name, sample_path):
+    """在 strace 下单独运行一次转换，返回系统调用总数（含子进程）"""
+    if not shutil.which('strace'):
+        return None
+    code = (
+        'import os, sys; os.environ.setdefault("API_KEY", "bench"); '
+        f'sys.path.insert(0, {os.path.join(os.path.dirname(__file__), "..")!r}); '
+        'import app; '
+        f'app.{func_name}(open({sample_path!r}, "rb").read())'
+    )
+    with tempfile.NamedTemporaryFile(suffix='.strace') as out:
+        subprocess.run(['strace', '-f', '-c', '-o', out.name, sys.executable, '-c', code],
+                       capture_output=True)
+        for line in open(out.name):
+            if line.strip().endswith('total'):
+                return int(line.split()[2])
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='每种方式的运行次数')
+    parser.add_argument('--duration', type=int, default=5, help='测试素材时长（秒）')
+    args = parser.parse_args()
+
+    video_data, audio_data, pcm_data = make_samples(args.duration)
+    cases = [
+        ('WebM → MP4', video_data, 'convert_webm_to_mp4_pipe', 'convert_webm_to_mp4_file'),
+        ('WebM → WAV', audio_data, 'convert_webm_to_wav_pipe', 'convert_webm_to_wav_file'),
+        ('PCM → MP3', pcm_data, 'convert_pcm_to_mp3_pipe', 'convert_pcm_to_mp3_file'),
+    ]
+
+    results = []
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for name, data, pipe_func, file_func in cases:
+            with tempfile.NamedTemporaryFile(delete=False) as sample:
+                sample.write(data)
+            row = [name, len(data)]
+            for func_name in (pipe_func, file_func):
+                latencies, fs_ops = measure(getattr(app, func_name), data, args.runs)
+                row.append((latencies, fs_ops, count_syscalls(func_name, sample.name)))
+            os.unlink(sample.name)
+            results.append(row)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    print(f'📊 每种方式运行 {args.runs} 次，素材时长 {args.duration}s')
+    for name, size, *modes in results:
+        print(f'\n🔹 {name}（输入 {size / 1024:.0f} KB）')
+        for label, (latencies, fs_ops, syscalls) in zip(('管道', '临时文件'), modes):
+            syscall_text = f'{syscalls} 次' if syscalls is not None else '未安装 strace'
+            print(f'   {label:<4} 中位数 {statistics.median(latencies) * 1000:7.1f} ms | '
+                  f'最小 {min(latencies) * 1000:7.1f} ms | '
+                  f'文件操作 {fs_ops:4.1f} 次/转换 | 系统调用 {syscall_text}')
@@ -0,0 +1,122 @@
+"""
+TTS 缓存基准：按句合成时，重复句子是否还会调用上游
+
+模拟若干轮回复，每轮由若干句子组成，句子从一个固定句库中按长尾分布抽取（开场白、鼓励语等常用句
+出现得多，具体点评出现得少）。上游 TTS 由本地假合成器代替（首包延迟 + 按块间隔产出固定长度的
+PCM，不访问网络），统计:
+    - 无缓存: 每句都调用上游
+    - 有缓存: tts_cache.cached_tts（临时目录，结束后删除）
+的上游调用次数、每句首块延迟和总合成耗时，并校验命中时产出的块与首次合成完全一致。
+
+运行:
+    python benchmarks/bench_tts_cache.py --replies 30 --first-chunk-ms 300
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tts_cache
+
+SENTENCES = [
+    '你好，我是你的面试教练。',
+    '很好，继续保持。',
+    '注意保持眼神交流。',
+    '语速可以再放慢一点。',
+    '这个回答结构很清晰。',
+    '我们再来练习一次吧。',
+    '今天的练习就到这里，辛苦了。',
+] + [f'第 {i} 条具体点评：你在回答中提到的例子还可以更具体一些。' for i in range(60)]
+
+
+class FakeSynthesizer:
+    """假 TTS：首包延迟后按固定间隔产出与文本长度成正比的 PCM 块"""
+
+    def __init__(self, first_chunk_ms, chunk_interval_ms):
+        self.first_chunk = first_chunk_ms / 1000
+        self.interval = chunk_interval_ms / 1000
+        self.calls = 0
+
+    def __call__(self, text, voice, language):
+        self.calls += 1
+        time.sleep(self.first_chunk)
+        seed = sum(map(ord, text))
+        for i in range(max(1, len(text) // 4)):
+            if i:
+                time.sleep(self.interval)
+            yield bytes([(seed + i) % 256]) * 4800  # 0.1 秒 24kHz 16-bit
+
+
+def make_replies(replies, sentences_per_reply, seed=0):
+    """按长尾分布（前面的常用句权重大）抽取每轮回复的句子"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(SENTENCES))]
+    return [rng.choices(SENTENCES, weights, k=sentences_per_reply) for _ in range(replies)]
+
+
+def run(replies, synthesize):
+    """逐句合成，返回 (每句首块延迟列表, 总耗时, 每句的块列表)"""
+    first_chunk = []
+    outputs = []
+    started = time.perf_counter()
+    for reply in replies:
+        for sentence in reply:
+            sentence_started = time.perf_counter()
+            chunks = []
+            for pcm in synthesize(sentence):
+                if not chunks:
+                    first_chunk.append(time.perf_counter() - sentence_started)
+                chunks.append(pcm)
+            outputs.append(chunks)
+    return first_chunk, time.perf_counter() - started, outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replies', type=int, default=30, help='回复轮数')
+    parser.add_argument('--sentences', type=int, default=4, help='每轮回复的句子数')
+    parser.add_argument('--first-chunk-ms', type=float, default=300, help='假上游的首包延迟（毫秒）')
+    parser.add_argument('--chunk-interval-ms', type=float, default=5, help='假上游的块间隔（毫秒）')
+    args = parser.parse_args()
+
+    replies = make_replies(args.replies, args.sentences)
+    workdir = tempfile.mkdtemp(prefix='bench_tts_cache_')
+    tts_cache.TTS_CACHE_ENABLED = True
+    tts_cache.TTS_CACHE_DIR = workdir
+
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        plain = FakeSynthesizer(args.first_chunk_ms, args.chunk_interval_ms)
+        plain_first, plain_total, plain_outputs = run(replies, lambda text: plain(text, 'Cherry', 'Chinese'))
+
+        cached = FakeSynthesizer(args.first_chunk_ms, args.chunk_interval_ms)
+        cached_first, cached_total, cached_outputs = run(
+            replies, lambda text: tts_cache.cached_tts(text, 'Cherry', 'Chinese', 'fake-tts', cached))
+        stats = tts_cache.get_tts_cache_stats()
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        shutil.rmtree(workdir)
+
+    assert cached_outputs == plain_outputs, '命中时产出的块与首次合成不一致'
+
+    total = sum(map(len, replies))
+    print(f'📊 {args.replies} 轮回复 × {args.sentences} 句（共 {total} 句，'
+          f'不同句子 {len({s for reply in replies for s in reply})} 个），假上游首包 {args.first_chunk_ms:.0f} ms')
+    for label, calls, first, elapsed in (('无缓存', plain.calls, plain_first, plain_total),
+                                         ('有缓存', cached.calls, cached_first, cached_total)):
+        print(f'\n🔹 {label}')
+        print(f'   上游调用   {calls:5} 次')
+        print(f'   首块延迟   平均 {statistics.mean(first) * 1000:7.1f} ms | 中位数 '
+              f'{statistics.median(first) * 1000:7.1f} ms')
+        print(f'   总合成耗时 {elapsed:7.2f} s')
+    print(f'\n🔹 缓存: 命中率 {stats["hit_rate"]:.2%} | {stats["entries"]} 条 | {stats["bytes"] / 1024:.0f} KB'
+          f' | 命中产出 {stats["hit_bytes"] / 1024 / 1024:.1f} MB | 块大小与首次合成一致')
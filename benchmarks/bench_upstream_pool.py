@@ -0,0 +1,141 @@
+"""
+上游连接复用基准：每个请求新建连接 vs 共享连接池
+
+本地起一个模拟上游（OpenAI 兼容的流式 chat/completions），每接受一个新连接先等待 --handshake-ms
+（模拟 TCP + TLS 握手），然后连续发起流式请求（分若干批并发，模拟突发），统计:
+    - 原方式: 读到 [DONE] 就关闭响应，连接不会放回连接池（等价于每个请求都新建连接）
+    - 共享连接池: upstream_http.get_http_client + request_encoder（读完响应体，连接复用）
+的新建连接数、平均首块延迟和总耗时。
+
+运行:
+    python benchmarks/bench_upstream_pool.py --bursts 10 --concurrency 4 --handshake-ms 80
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import httpx
+
+import upstream_http
+from request_encoder import create_chat_completion, _parse_event
+
+EVENTS = [
+    json.dumps({'id': 'x', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'm',
+                'choices': [{'index': 0, 'delta': {'content': f'第 {i} 句。'}}]})
+    for i in range(5)
+]
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    """流式 SSE 响应；新连接先等待 handshake 秒"""
+
+    protocol_version = 'HTTP/1.1'
+    handshake = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        with FakeUpstream.lock:
+            FakeUpstream.connections += 1
+        time.sleep(self.handshake)
+        # 与真实上游一样关闭 Nagle（否则逐块写出的小响应会叠加客户端的延迟 ACK）
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for data in EVENTS + ['[DONE]']:
+            line = f'data: {data}\n\n'.encode()
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class _Client:
+    """create_chat_completion 只使用 base_url 和 api_key"""
+
+    def __init__(self, base_url):
+        self.base_url = httpx.URL(base_url)
+        self.api_key = 'bench'
+
+
+def request_old(http, client):
+    """原方式：[DONE] 后立即关闭响应（剩余的结束标记没有读取，连接被丢弃）"""
+    with http.stream('POST', str(client.base_url) + 'chat/completions',
+                     json={'model': 'm', 'messages': [], 'stream': True}) as response:
+        for line in response.iter_lines():
+            chunk = _parse_event(line)
+            if chunk is False:
+                break
+            if chunk is not None:
+                yield chunk
+
+
+def request_pooled(http, client):
+    return create_chat_completion(client, model='m', messages=[], stream=True)
+
+
+def run(request, http, client, bursts, concurrency):
+    """返回 (新建连接数, 首块延迟列表, 总耗时)"""
+    before = FakeUpstream.connections
+    first_chunk = []
+
+    def one():
+        started = time.perf_counter()
+        for i, _ in enumerate(request(http, client)):
+            if i == 0:
+                first_chunk.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(bursts):
+            list(pool.map(lambda _: one(), range(concurrency)))
+    return FakeUpstream.connections - before, first_chunk, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bursts', type=int, default=10, help='突发批数')
+    parser.add_argument('--concurrency', type=int, default=4, help='每批并发请求数')
+    parser.add_argument('--handshake-ms', type=float, default=80, help='模拟的新连接握手耗时（毫秒）')
+    args = parser.parse_args()
+
+    FakeUpstream.handshake = args.handshake_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = _Client(f'http://127.0.0.1:{server.server_port}/v1/')
+
+    old_http = httpx.Client(timeout=upstream_http.TIMEOUT)
+    results = {
+        '原方式（不复用连接）': run(request_old, old_http, client, args.bursts, args.concurrency),
+        '共享连接池': run(request_pooled, None, client, args.bursts, args.concurrency),
+    }
+    server.shutdown()
+
+    total = args.bursts * args.concurrency
+    print(f'📊 {args.bursts} 批 × {args.concurrency} 并发（共 {total} 个流式请求），模拟握手 {args.handshake_ms:.0f} ms')
+    for label, (connections, first_chunk, elapsed) in results.items():
+        print(f'\n🔹 {label}')
+        print(f'   新建连接 {connections:4} 个（复用率 {1 - connections / total:.0%}）')
+        print(f'   首块延迟 平均 {statistics.mean(first_chunk) * 1000:6.1f} ms | 最大 {max(first_chunk) * 1000:6.1f} ms')
+        print(f'   总耗时   {elapsed:6.2f} s')
+    stats = upstream_http.get_upstream_stats()['openai']
+    print(f'\n🔹 连接池统计: 请求 {stats["requests"]} | 新建连接 {stats["new_connections"]}'
+          f' | 峰值并发 {stats["peak_in_flight"]} | 等待空闲连接 {stats["pool_waits"]}')
@@ -0,0 +1,181 @@
+"""
+垫话音频（掩盖模型思考时间）+ 感知延迟统计
+
+从上传结束到第一个 TTS 字节之间，/api/chat 只能等模型返回，视频通话模式下数字人会"定住"好几秒。
+请求参数 filler=1 时，响应使用分块格式（见 tts_pipeline 模块说明），并且在调用模型之前先发送一段
+预先合成好的短垫话（"嗯，让我看看。"），真正的回答在其后接着发送:
+    - 垫话按音色预先合成（经过 tts_cache，重启后直接从磁盘读取），在内存中保存完整 PCM，
+      请求时不做任何 I/O；某个音色尚未合成完时本次不发垫话，并在后台开始合成
+    - 同一音色的几条垫话轮流使用，避免每次都是同一句
+    - 分别统计感知延迟（请求开始 → 第一个音频字节，可能是垫话）和真实回答延迟
+      （请求开始 → 第一个回答音频字节），垫话只改善前者
+
+配置（环境变量）:
+    FILLER_PHRASES    垫话文本，用 | 分隔（默认 "嗯，让我看看。|好的，我想一想。|嗯，稍等一下。"）
+
+示例:
+    clip = get_filler_clip(stream_tts)
+    if clip:
+        phrase, pcm = clip
+        yield encode_json_block({'type': 'filler', 'text': phrase})
+        yield wav_block(pcm)
+"""
+
+import os
+import threading
+import time
+
+
+FILLER_PHRASES = [
+    phrase.strip()
+    for phrase in os.getenv('FILLER_PHRASES', '嗯，让我看看。|好的，我想一想。|嗯，稍等一下。').split('|')
+    if phrase.strip()
+]
+
+_lock = threading.Lock()
+_clips = {}       # {voice: [(phrase, pcm), ...]}
+_next_index = {}  # {voice: 下一次使用的垫话序号}
+_warming = set()
+
+_stats = {
+    'filler_sent': 0,
+    'filler_unavailable': 0,
+    'warm_failures': 0,
+    'turns': 0,
+    'perceived_seconds': 0.0,
+    'answer_seconds': 0.0,
+    'max_perceived_seconds': 0.0,
+    'max_answer_seconds': 0.0,
+    'filler_turns': 0,
+    'masked_seconds': 0.0,
+}
+
+
+def is_filler_requested(form):
+    """判断请求是否开启垫话（filler=1/true）"""
+    return form.get('filler', '').lower() in ('1', 'true', 'yes')
+
+
+def _warm(synthesize, voice):
+    clips = []
+    try:
+        for phrase in FILLER_PHRASES:
+            pcm = b''.join(synthesize(phrase, voice=voice))
+            if pcm:
+                clips.append((phrase, pcm))
+        print(f'🗨️  垫话已就绪（{voice}）: {len(clips)} 条')
+    except Exception as e:
+        print(f'❌ 垫话合成失败（{voice}）: {e}')
+        with _lock:
+            _stats['warm_failures'] += 1
+    finally:
+        with _lock:
+            if clips:
+                _clips[voice] = clips
+            _warming.discard(voice)
+
+
+def warm_fillers(synthesize, voice='Cherry', background=True):
+    """
+    预先合成某个音色的垫话
+
+    参数:
+        synthesize: TTS 函数 synthesize(text, voice=...)，返回 PCM 块生成器（如 stream_tts）
+        voice: 音色
+        background: 是否在后台线程中合成（默认 true，立即返回）
+    """
+    with _lock:
+        if voice in _clips or voice in _warming or not FILLER_PHRASES:
+            return
+        _warming.add(voice)
+    if background:
+        threading.Thread(target=_warm, args=(synthesize, voice), daemon=True, name='filler-warm').start()
+    else:
+        _warm(synthesize, voice)
+
+
+def get_filler_clip(synthesize, voice='Cherry'):
+    """
+    取一条垫话（同一音色轮流使用）
+
+    参数:
+        synthesize: 垫话尚未合成时用于后台合成的 TTS 函数
+        voice: 音色
+
+    返回:
+        (phrase, pcm)；该音色的垫话尚未就绪时返回 None（并在后台开始合成）
+    """
+    with _lock:
+        clips = _clips.get(voice)
+        if clips:
+            index = _next_index.get(voice, 0)
+            _next_index[voice] = (index + 1) % len(clips)
+            _stats['filler_sent'] += 1
+            return clips[index % len(clips)]
+        _stats['filler_unavailable'] += 1
+    warm_fillers(synthesize, voice)
+    return None
+
+
+class LatencyTracker:
+    """
+    记录一次响应的感知延迟和真实回答延迟
+
+    示例:
+        tracker = LatencyTracker(turn['started_at'])
+        tracker.audio(filler=True)   # 发出垫话音频时
+        tracker.audio()              # 发出回答音频时
+        tracker.finish()
+    """
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.first_audio_at = None
+        self.first_answer_at = None
+        self.filler = False
+
+    def audio(self, filler=False):
+        now = time.perf_counter()
+        if self.first_audio_at is None:
+            self.first_audio_at = now
+        if filler:
+            self.filler = True
+        elif self.first_answer_at is None:
+            self.first_answer_at = now
+
+    def finish(self):
+        """响应结束时调用（没有发出回答音频的响应不计入统计）"""
+        if self.first_answer_at is None:
+            return
+        perceived = self.first_audio_at - self.started_at
+        answer = self.first_answer_at - self.started_at
+        with _lock:
+            _stats['turns'] += 1
+            _stats['perceived_seconds'] += perceived
+            _stats['answer_seconds'] += answer
+            _stats['max_perceived_seconds'] = max(_stats['max_perceived_seconds'], perceived)
+            _stats['max_answer_seconds'] = max(_stats['max_answer_seconds'], answer)
+            if self.filler:
+                _stats['filler_turns'] += 1
+                _stats['masked_seconds'] += answer - perceived
+
+
+def get_latency_stats():
+    """返回感知延迟 / 真实回答延迟（秒）和垫话统计"""
+    with _lock:
+        stats = dict(_stats)
+        ready = {voice: len(clips) for voice, clips in _clips.items()}
+    turns = stats.pop('turns')
+    filler_turns = stats.pop('filler_turns')
+    perceived = stats.pop('perceived_seconds')
+    answer = stats.pop('answer_seconds')
+    masked = stats.pop('masked_seconds')
+    stats.update(
+        turns=turns,
+        avg_perceived_seconds=perceived / turns if turns else None,
+        avg_answer_seconds=answer / turns if turns else None,
+        filler_turns=filler_turns,
+        avg_masked_seconds=masked / filler_turns if filler_turns else None,
+        fillers_ready=ready,
+    )
+    return stats
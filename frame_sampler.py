@@ -0,0 +1,263 @@
+"""
+视频输入精简：抽帧 + 独立音轨
+
+把整段视频替换为按固定帧率（或仅在场景切换时）抽取的 JPEG 帧序列，再单独附上音轨，
+作为多段内容发送给模型:
+    {'type': 'video', 'video': ['data:image/jpeg;base64,...', ...]}
+    {'type': 'input_audio', 'input_audio': {'data': 'data:;base64,...', 'format': 'mp3'}}
+
+帧数少于 MIN_VIDEO_FRAMES（上游要求图片序列至少 4 帧）时改为逐帧 image_url。
+与整段视频相比上传体积更小，模型也不必解码每一帧；每次请求的上传字节数、
+输入 token 数和耗时按模式分别统计（见 get_video_input_stats），便于按部署选择。
+
+配置（环境变量）:
+    VIDEO_INPUT_MODE        video（默认，整段视频）/ frames（抽帧 + 音轨）；请求参数 video_input_mode 可覆盖
+    FRAME_SAMPLE_FPS        抽帧帧率（默认 1）
+    FRAME_SCENE_THRESHOLD   场景切换阈值 0~1（默认 0 表示关闭；如 0.3 表示只在画面明显变化时取帧）
+    FRAME_MAX_COUNT         最多帧数（默认 16）
+    FRAME_MAX_WIDTH         帧最大宽度（默认 640）
+    FRAME_JPEG_QUALITY      JPEG 质量 2~31，越小越清晰（默认 5）
+
+示例:
+    parts, report = video_content_parts(video_data, 'video/mp4', resolve_video_input_mode(form))
+    ...
+    record_video_turn(report, prompt_tokens=response.usage.prompt_tokens, latency=elapsed)
+"""
+
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+
+from request_encoder import DataURI
+from transcoder import submit_ffmpeg, probe_media, TranscodeRejected
+
+
+VIDEO_INPUT_MODE = os.getenv('VIDEO_INPUT_MODE', 'video')
+FRAME_SAMPLE_FPS = float(os.getenv('FRAME_SAMPLE_FPS', '1'))
+FRAME_SCENE_THRESHOLD = float(os.getenv('FRAME_SCENE_THRESHOLD', '0'))
+FRAME_MAX_COUNT = int(os.getenv('FRAME_MAX_COUNT', '16'))
+FRAME_MAX_WIDTH = int(os.getenv('FRAME_MAX_WIDTH', '640'))
+FRAME_JPEG_QUALITY = int(os.getenv('FRAME_JPEG_QUALITY', '5'))
+
+MIN_VIDEO_FRAMES = 4
+
+VIDEO_INPUT_MODES = ('video', 'frames')
+
+_JPEG_START = b'\xff\xd8'
+_JPEG_END = b'\xff\xd9'
+
+_stats_lock = threading.Lock()
+_stats = {
+    mode: {'turns': 0, 'upload_bytes': 0, 'prompt_tokens': 0, 'token_turns': 0,
+           'latency': 0.0, 'latency_turns': 0, 'reduce_time': 0.0, 'fallbacks': 0}
+    for mode in VIDEO_INPUT_MODES
+}
+
+
+def resolve_video_input_mode(form):
+    """请求参数 video_input_mode 优先，其次环境变量 VIDEO_INPUT_MODE"""
+    mode = (form.get('video_input_mode') or VIDEO_INPUT_MODE).lower()
+    return mode if mode in VIDEO_INPUT_MODES else 'video'
+
+
+def _media_duration(info):
+    try:
+        return float(info.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _frame_filter(duration=None):
+    scale = f"scale='min({FRAME_MAX_WIDTH},iw)':-2"
+    if FRAME_SCENE_THRESHOLD > 0:
+        # 第一帧总是保留，之后只在场景切换时取帧
+        return f"select='eq(n\\,0)+gt(scene\\,{FRAME_SCENE_THRESHOLD})',{scale}"
+    fps = FRAME_SAMPLE_FPS
+    if duration:
+        # 时长已知时降低帧率，让 FRAME_MAX_COUNT 帧覆盖整段视频，而不是只取开头
+        fps = min(fps, FRAME_MAX_COUNT / duration)
+    return f'fps={fps:.4g},{scale}'
+
+
+def split_jpeg_stream(data):
+    """把 image2pipe 输出的连续 JPEG 数据切分为单帧"""
+    frames = []
+    start = data.find(_JPEG_START)
+    while start >= 0:
+        end = data.find(_JPEG_END + _JPEG_START, start + 2)
+        if end < 0:
+            frames.append(data[start:])
+            break
+        frames.append(data[start:end + 2])
+        start = end + 2
+    return frames
+
+
+def reduce_video(video_data, info=None):
+    """
+    抽帧并提取音轨（两个 ffmpeg 任务并行执行）
+
+    参数:
+        video_data: 视频数据（任意 ffmpeg 可解码的容器）
+        info: ffprobe 结果（可选，未提供时自动探测）
+
+    返回:
+        (帧列表[JPEG bytes], 音轨 MP3 bytes 或 None)
+    """
+    info = info or probe_media(data=video_data)
+    has_audio = any(s.get('codec_type') == 'audio' for s in info.get('streams', []))
+
+    # 普通 MP4 的 moov 可能在文件末尾，无法从管道读取，需要落盘
+    input_path = None
+    if 'mp4' in (info.get('format', {}).get('format_name') or ''):
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+            f.write(video_data)
+            input_path = f.name
+    source, input_data = (input_path, None) if input_path else ('pipe:0', video_data)
+
+    frames_future = audio_future = None
+    try:
+        frames_future = submit_ffmpeg([
+            'ffmpeg', '-y', '-i', source,
+            '-an', '-vf', _frame_filter(_media_duration(info)), '-fps_mode', 'vfr',
+            '-frames:v', str(FRAME_MAX_COUNT),
+            '-c:v', 'mjpeg', '-q:v', str(FRAME_JPEG_QUALITY),
+            '-f', 'image2pipe', 'pipe:1'
+        ], input_data=input_data)
+
+        if has_audio:
+            audio_future = submit_ffmpeg([
+                'ffmpeg', '-y', '-i', source,
+                '-vn', '-ac', '1', '-ar', '16000',
+                '-c:a', 'libmp3lame', '-b:a', '32k',
+                '-f', 'mp3', 'pipe:1'
+            ], input_data=input_data)
+
+        frames = split_jpeg_stream(frames_future.result().stdout)
+        audio = audio_future.result().stdout if audio_future else None
+    finally:
+        if input_path:
+            for future in (frames_future, audio_future):
+                if future:
+                    wait([future])
+            os.unlink(input_path)
+    return frames, audio or None
+
+
+def _data_uri(mime, data):
+    # 发送时才编码（见 request_encoder），这里不生成 base64 副本
+    return DataURI(mime, data)
+
+
+def _upload_bytes(parts):
+    total = 0
+    for part in parts:
+        if part['type'] == 'video':
+            total += sum(len(url) for url in part['video'])
+        elif part['type'] == 'input_audio':
+            total += len(part['input_audio']['data'])
+        else:
+            total += len(part[part['type']]['url'])
+    return total
+
+
+def video_content_parts(video_data, video_mime, mode='video'):
+    """
+    构建视频输入的消息内容
+
+    参数:
+        video_data: 视频数据
+        video_mime: 视频 MIME 类型（整段发送时使用）
+        mode: 'video'（整段视频）或 'frames'（抽帧 + 音轨，失败时退回整段视频）
+
+    返回:
+        (content_parts, report)
+        report: {'mode', 'source_bytes', 'upload_bytes', 'frames', 'audio_bytes', 'reduce_time'}
+    """
+    report = {'mode': 'video', 'source_bytes': len(video_data), 'frames': None,
+              'audio_bytes': None, 'reduce_time': 0.0}
+
+    if mode == 'frames':
+        started = time.perf_counter()
+        try:
+            frames, audio = reduce_video(video_data)
+            if not frames:
+                raise ValueError('未抽取到任何帧')
+        except TranscodeRejected:
+            raise
+        except Exception as e:
+            print(f'⚠️ 抽帧失败，改为发送整段视频: {e}')
+            _incr('frames', 'fallbacks')
+        else:
+            if len(frames) >= MIN_VIDEO_FRAMES:
+                parts = [{'type': 'video', 'video': [_data_uri('image/jpeg', f) for f in frames]}]
+            else:
+                parts = [{'type': 'image_url', 'image_url': {'url': _data_uri('image/jpeg', f)}}
+                         for f in frames]
+            if audio:
+                parts.append({
+                    'type': 'input_audio',
+                    'input_audio': {'data': _data_uri('', audio), 'format': 'mp3'}
+                })
+            report.update(mode='frames', frames=len(frames), audio_bytes=len(audio) if audio else 0,
+                          reduce_time=time.perf_counter() - started)
+            report['upload_bytes'] = _upload_bytes(parts)
+            print(f'🎞️ 视频精简: {len(frames)} 帧 + 音轨 {report["audio_bytes"]} bytes，'
+                  f'上传 {report["upload_bytes"]} bytes（整段视频 base64 约 {len(video_data) * 4 // 3} bytes），'
+                  f'耗时 {report["reduce_time"]:.2f}s')
+            return parts, report
+
+    parts = [{'type': 'video_url', 'video_url': {'url': _data_uri(video_mime, video_data)}}]
+    report['upload_bytes'] = _upload_bytes(parts)
+    return parts, report
+
+
+def _incr(mode, key, value=1):
+    with _stats_lock:
+        _stats[mode][key] += value
+
+
+def record_video_turn(report, prompt_tokens=None, latency=None):
+    """
+    记录一次带视频输入的对话
+
+    参数:
+        report: video_content_parts 返回的 report
+        prompt_tokens: 模型输入 token 数（usage.prompt_tokens，流式模式下可能没有）
+        latency: 从收到请求到拿到完整模型响应的耗时（秒，流水线模式下不统计）
+    """
+    with _stats_lock:
+        stats = _stats[report['mode']]
+        stats['turns'] += 1
+        stats['upload_bytes'] += report['upload_bytes']
+        stats['reduce_time'] += report['reduce_time']
+        if prompt_tokens is not None:
+            stats['prompt_tokens'] += prompt_tokens
+            stats['token_turns'] += 1
+        if latency is not None:
+            stats['latency'] += latency
+            stats['latency_turns'] += 1
+    print(f'📊 视频输入 [{report["mode"]}] 上传 {report["upload_bytes"]} bytes，'
+          f'输入 token {prompt_tokens if prompt_tokens is not None else "未知"}，'
+          f'耗时 {f"{latency:.2f}s" if latency is not None else "未知"}')
+
+
+def get_video_input_stats():
+    """按模式返回平均上传字节数、输入 token 数、耗时"""
+    with _stats_lock:
+        snapshot = {mode: dict(stats) for mode, stats in _stats.items()}
+
+    result = {'default_mode': VIDEO_INPUT_MODE}
+    for mode, stats in snapshot.items():
+        turns = stats['turns']
+        result[mode] = {
+            'turns': turns,
+            'fallbacks': stats['fallbacks'],
+            'avg_upload_bytes': stats['upload_bytes'] / turns if turns else 0,
+            'avg_prompt_tokens': stats['prompt_tokens'] / stats['token_turns'] if stats['token_turns'] else None,
+            'avg_latency': stats['latency'] / stats['latency_turns'] if stats['latency_turns'] else None,
+            'avg_reduce_time': stats['reduce_time'] / turns if turns else 0.0,
+        }
+    return result
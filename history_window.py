@@ -0,0 +1,280 @@
+"""
+按 token 预算截取对话历史 + 后台滚动摘要
+
+原来历史按条数截断（最近 20 条），每条消息长短差异很大，长会话的 prompt 大小和模型首包延迟
+随之大幅波动。这里改为:
+    - 用本地估算器（estimate_tokens，不依赖 tokenizer，单条消息约 10 微秒）估算每条消息的 token 数
+    - 请求时从最新一轮往前取完整的轮次，总量不超过 HISTORY_TOKEN_BUDGET；更早的内容以摘要形式
+      放在历史最前面（摘要本身不超过 SUMMARY_MAX_TOKENS）
+    - 一轮对话保存后（响应已经流式返回，TTS 可能仍在输出），历史超过预算或接近条数上限时，
+      在后台线程把最早的若干轮连同旧摘要压缩成新摘要，再调用 store.compact 替换；请求路径上不调用模型
+    - 摘要尚未完成时窗口照样按预算截断，每轮输入 token 数不会随会话变长而增长
+
+配置（环境变量）:
+    HISTORY_TOKEN_BUDGET    历史消息的 token 预算（不含摘要，默认 1500）
+    HISTORY_SUMMARY         是否生成滚动摘要（默认 true；false 时超出预算的历史直接丢弃）
+    SUMMARY_MAX_TOKENS      摘要的最大 token 数（默认 300）
+    SUMMARY_MODEL           生成摘要的模型（默认与对话模型相同）
+
+示例:
+    messages.extend(build_history_window(conversation_store, session_id))
+    ...
+    conversation_store.append(session_id, user_message, assistant_message)
+    schedule_summary(conversation_store, session_id, client, MODEL)
+"""
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from request_encoder import create_chat_completion
+
+
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '1500'))
+HISTORY_SUMMARY = os.getenv('HISTORY_SUMMARY', 'true').lower() in ('1', 'true', 'yes')
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '300'))
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL') or None
+
+# 压缩后保留的最近历史占预算的比例（留出余量，避免每轮都触发一次摘要）
+_KEEP_RATIO = 0.75
+
+# 每条消息的固定开销（角色标记、分隔符）
+_MESSAGE_OVERHEAD = 4
+
+# 连续的 ASCII 字母数字按 4 个字符 1 个 token；其余非空白字符（中文、全角符号、标点）各算 1 个
+_WORD_PATTERN = re.compile(r'[A-Za-z0-9_]+')
+
+_SUMMARY_PROMPT = (
+    '你是对话摘要助手。请把已有摘要和新增对话合并成一段新的摘要，'
+    '保留用户的情况和表现、已经讨论过的内容、给出过的建议和尚未结束的话题，'
+    '用第三人称陈述，不要编造对话中没有的信息，不超过 {limit} 字，只输出摘要本身。'
+)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'windows': 0,
+    'window_tokens': 0,
+    'max_window_tokens': 0,
+    'truncated_messages': 0,
+    'summaries': 0,
+    'summary_failures': 0,
+    'summary_stale': 0,
+    'summary_seconds': 0.0,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = set()
+
+
+def estimate_tokens(text):
+    """
+    估算文本的 token 数（偏保守，用于预算控制，不追求与 tokenizer 完全一致）
+
+    示例:
+        estimate_tokens('你好，world')  # → 5
+    """
+    if not text:
+        return 0
+    words = _WORD_PATTERN.findall(text)
+    word_chars = sum(map(len, words))
+    non_space = len(''.join(text.split()))
+    return sum((len(word) + 3) // 4 for word in words) + non_space - word_chars
+
+
+def estimate_message_tokens(message):
+    """估算一条消息的 token 数（多模态 content 只计文本部分）"""
+    content = message.get('content')
+    if isinstance(content, list):
+        text = ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    else:
+        text = content or ''
+    return _MESSAGE_OVERHEAD + estimate_tokens(text)
+
+
+def _window_start(history, budget, max_messages=None):
+    """
+    返回窗口起点：从最新往前、以 user 消息开头的最早位置，使 history[start:] 不超过预算
+    （至少保留最新一轮，即使它本身超出预算）
+    """
+    start = None
+    tokens = 0
+    for i in range(len(history) - 1, -1, -1):
+        tokens += estimate_message_tokens(history[i])
+        if start is not None and (tokens > budget or (max_messages and len(history) - i > max_messages)):
+            break
+        if history[i].get('role') == 'user':
+            start = i
+    return start if start is not None else 0
+
+
+def _record(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+def build_history_window(store, session_id, budget=HISTORY_TOKEN_BUDGET):
+    """
+    构建本轮请求使用的历史消息
+
+    参数:
+        store: 会话存储（session_store）
+        session_id: 会话 ID
+        budget: 历史消息的 token 预算（不含摘要）
+
+    返回:
+        消息列表：[摘要消息（如有）] + 预算内最近的完整轮次
+    """
+    summary, history = store.get_context(session_id)
+    start = _window_start(history, budget)
+    messages = []
+    if summary:
+        messages.append({'role': 'assistant', 'content': f'（之前对话的摘要）{summary}'})
+    messages.extend(history[start:])
+
+    tokens = sum(estimate_message_tokens(m) for m in messages)
+    with _stats_lock:
+        _stats['windows'] += 1
+        _stats['window_tokens'] += tokens
+        _stats['max_window_tokens'] = max(_stats['max_window_tokens'], tokens)
+        _stats['truncated_messages'] += start
+    return messages
+
+
+def _messages_to_compact(history, max_history, budget):
+    """历史超出预算或即将超过条数上限时，返回需要压缩进摘要的最早若干条消息"""
+    total = sum(estimate_message_tokens(m) for m in history)
+    if total <= budget and len(history) + 2 <= max_history:
+        return []
+    start = _window_start(history, int(budget * _KEEP_RATIO), max_messages=max_history // 2)
+    return history[:start]
+
+
+def _format_transcript(messages):
+    lines = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, list):
+            content = ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+        speaker = '用户' if message.get('role') == 'user' else '助手'
+        lines.append(f'{speaker}: {content}')
+    return '\n'.join(lines)
+
+
+def summarize(client, model, summary, messages):
+    """
+    把旧摘要和新增消息合并成新摘要（同步调用模型）
+
+    返回:
+        新摘要文本
+
+    异常:
+        Exception: 模型调用失败或返回空摘要
+    """
+    prompt = (
+        f'已有摘要：{summary or "无"}\n\n'
+        f'新增对话：\n{_format_transcript(messages)}\n\n'
+        '请输出更新后的摘要。'
+    )
+    stream = create_chat_completion(
+        client,
+        model=SUMMARY_MODEL or model,
+        messages=[
+            {'role': 'system', 'content': _SUMMARY_PROMPT.format(limit=SUMMARY_MAX_TOKENS)},
+            {'role': 'user', 'content': prompt}
+        ],
+        modalities=['text'],
+        max_tokens=SUMMARY_MAX_TOKENS,
+        stream=True
+    )
+    parts = []
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+    text = ''.join(parts).strip()
+    if not text:
+        raise Exception('模型返回了空摘要')
+    return text
+
+
+def _summarize_job(key, store, session_id, client, model, summary, covered):
+    started = time.perf_counter()
+    try:
+        new_summary = summarize(client, model, summary, covered)
+        if store.compact(session_id, new_summary, covered):
+            _record('summaries')
+            print(f'🧾 会话 {session_id} 已压缩 {len(covered)} 条历史为摘要'
+                  f'（约 {estimate_tokens(new_summary)} tokens，{time.perf_counter() - started:.1f}s）')
+        else:
+            # 生成摘要期间会话被清空或继续追加导致最早的消息变化，下一轮保存时重新调度
+            _record('summary_stale')
+    except Exception as e:
+        _record('summary_failures')
+        print(f'❌ 生成会话摘要失败（{session_id}）: {e}')
+    finally:
+        _record('summary_seconds', time.perf_counter() - started)
+        with _executor_lock:
+            _in_flight.discard(key)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-summary')
+    return _executor
+
+
+def schedule_summary(store, session_id, client, model, budget=HISTORY_TOKEN_BUDGET):
+    """
+    保存一轮对话后调用：需要时在后台线程生成摘要并压缩历史，立即返回
+
+    参数:
+        store: 会话存储
+        session_id: 会话 ID
+        client: OpenAI 客户端
+        model: 对话模型（未设置 SUMMARY_MODEL 时用于生成摘要）
+        budget: 历史消息的 token 预算
+
+    返回:
+        是否提交了摘要任务（同一会话已有任务在进行时不重复提交）
+    """
+    if not HISTORY_SUMMARY:
+        return False
+    summary, history = store.get_context(session_id)
+    covered = _messages_to_compact(history, store.max_history, budget)
+    if not covered:
+        return False
+
+    key = (id(store), session_id)
+    with _executor_lock:
+        if key in _in_flight:
+            return False
+        _in_flight.add(key)
+        executor = _get_executor()
+    executor.submit(_summarize_job, key, store, session_id, client, model, summary, covered)
+    return True
+
+
+def get_history_window_stats():
+    """返回历史窗口和摘要统计"""
+    with _stats_lock:
+        stats = dict(_stats)
+    windows = stats.pop('windows')
+    window_tokens = stats.pop('window_tokens')
+    summary_seconds = stats.pop('summary_seconds')
+    finished = stats['summaries'] + stats['summary_failures'] + stats['summary_stale']
+    stats.update(
+        windows=windows,
+        avg_window_tokens=window_tokens / windows if windows else None,
+        avg_summary_seconds=summary_seconds / finished if finished else None,
+        summaries_in_flight=len(_in_flight),
+        config={
+            'token_budget': HISTORY_TOKEN_BUDGET,
+            'summary': HISTORY_SUMMARY,
+            'summary_max_tokens': SUMMARY_MAX_TOKENS,
+            'summary_model': SUMMARY_MODEL,
+        }
+    )
+    return stats
@@ -0,0 +1,159 @@
+"""
+视频媒体预算（按接口）
+
+客户端上传的视频可能是 1080p/60fps 甚至更长、更大，转码时按接口的预算统一限制:
+    max_width / max_height   最大分辨率（等比缩小，不放大）
+    max_fps                  最大帧率
+    max_duration             最长时长（秒，超出部分从尾部截掉）
+    max_bytes                输出大小上限（通过限制视频码率实现）
+
+超出预算时自动降分辨率 / 降帧率 / 截断 / 限码率；分辨率、帧率或大小超标时必须重编码，
+只需截断时直传或换封装即可。实际做了哪些处理会写入响应元数据（media_budget 字段）。
+
+配置（环境变量）:
+    MEDIA_MAX_WIDTH       默认 1280
+    MEDIA_MAX_HEIGHT      默认 720
+    MEDIA_MAX_FPS         默认 30（常见摄像头帧率不触发重编码，60fps 会被降到 30）
+    MEDIA_MAX_DURATION    默认 60
+    MEDIA_MAX_BYTES       默认 8MB
+    MEDIA_BUDGETS         按接口覆盖的 JSON，例如 {"video-auto-chat": {"max_height": 480, "max_fps": 10}}
+
+示例:
+    budget = get_budget('video-auto-chat-with-tts')
+    plan = plan_budget([info], budget, len(video_data))
+    args = video_budget_args(plan) + trim_args(plan)
+"""
+
+import json
+import os
+
+
+DEFAULT_BUDGET = {
+    'max_width': int(os.getenv('MEDIA_MAX_WIDTH', '1280')),
+    'max_height': int(os.getenv('MEDIA_MAX_HEIGHT', '720')),
+    'max_fps': float(os.getenv('MEDIA_MAX_FPS', '30')),
+    'max_duration': float(os.getenv('MEDIA_MAX_DURATION', '60')),
+    'max_bytes': int(os.getenv('MEDIA_MAX_BYTES', str(8 * 1024 * 1024))),
+}
+
+# 各接口的预算（未列出的项使用 DEFAULT_BUDGET）
+MEDIA_BUDGETS = {
+    'chat': {},
+    'video-auto-chat': {},
+    'video-auto-chat-with-tts': {},
+}
+MEDIA_BUDGETS.update(json.loads(os.getenv('MEDIA_BUDGETS', '{}')))
+
+# 重编码时给音频预留的码率（TRANSCODE_ARGS 中 aac 的默认码率约 128k）
+AUDIO_BITRATE = 128000
+
+# 超过该值的帧率视为容器时间基（如 WebM 的 1000/1），不可信
+_MAX_PLAUSIBLE_FPS = 240
+
+
+def get_budget(endpoint):
+    """返回接口的媒体预算"""
+    return {**DEFAULT_BUDGET, **MEDIA_BUDGETS.get(endpoint, {})}
+
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+
+def _parse_rate(rate):
+    try:
+        num, _, den = (rate or '0/0').partition('/')
+        fps = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return fps if 0 < fps <= _MAX_PLAUSIBLE_FPS else None
+
+
+def _duration(info):
+    try:
+        return float(info.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        return None
+
+
+def plan_budget(infos, budget, source_bytes):
+    """
+    根据探测结果计算需要做的处理
+
+    参数:
+        infos: ffprobe 结果列表（多片段时为各片段）
+        budget: get_budget 返回的预算
+        source_bytes: 输入总字节数
+
+    返回:
+        {'scale': (宽, 高) 或 None, 'fps', 'trim', 'max_video_bitrate', 'reencode', 'reductions', 'budget'}
+    """
+    plan = {'scale': None, 'fps': None, 'trim': None, 'max_video_bitrate': None,
+            'reencode': False, 'reductions': [], 'budget': budget}
+
+    videos = [s for info in infos for s in info.get('streams', []) if s.get('codec_type') == 'video']
+    width = max((s.get('width') or 0 for s in videos), default=0)
+    height = max((s.get('height') or 0 for s in videos), default=0)
+    rates = [fps for fps in (_parse_rate(s.get('avg_frame_rate')) for s in videos) if fps]
+    fps = max(rates, default=None)
+    durations = [_duration(info) for info in infos]
+    total = sum(durations) if durations and all(durations) else None
+
+    if width and height and (width > budget['max_width'] or height > budget['max_height']):
+        ratio = min(budget['max_width'] / width, budget['max_height'] / height)
+        plan['scale'] = (_even(width * ratio), _even(height * ratio))
+        plan['reductions'].append(f'分辨率 {width}x{height} → {plan["scale"][0]}x{plan["scale"][1]}')
+
+    if fps and fps > budget['max_fps'] + 0.5:
+        plan['fps'] = budget['max_fps']
+        plan['reductions'].append(f'帧率 {fps:g} → {budget["max_fps"]:g}')
+
+    # 时长未知（如 MediaRecorder 的 WebM）时也加 -t，超出才会生效
+    if total is None or total > budget['max_duration']:
+        plan['trim'] = budget['max_duration']
+        if total is not None:
+            plan['reductions'].append(f'时长 {total:.1f}s → {budget["max_duration"]:g}s')
+
+    effective = min(total, budget['max_duration']) if total else budget['max_duration']
+    expected_bytes = source_bytes * effective / total if total else source_bytes
+    if expected_bytes > budget['max_bytes']:
+        bitrate = int(budget['max_bytes'] * 8 * 0.9 / effective) - AUDIO_BITRATE
+        plan['max_video_bitrate'] = max(bitrate, 100000)
+        plan['reductions'].append(
+            f'视频码率 ≤ {plan["max_video_bitrate"] // 1000} kbps（大小上限 {budget["max_bytes"] / 1024 / 1024:.1f} MB）'
+        )
+
+    plan['reencode'] = bool(plan['scale'] or plan['fps'] or plan['max_video_bitrate'])
+    return plan
+
+
+def video_budget_args(plan):
+    """重编码时的视频滤镜和码率参数"""
+    filters = []
+    if plan['scale']:
+        filters.append(f'scale={plan["scale"][0]}:{plan["scale"][1]}')
+    if plan['fps']:
+        filters.append(f'fps={plan["fps"]:g}')
+
+    args = ['-vf', ','.join(filters)] if filters else []
+    if plan['max_video_bitrate']:
+        kbps = plan['max_video_bitrate'] // 1000
+        args += ['-maxrate', f'{kbps}k', '-bufsize', f'{kbps * 2}k']
+    return args
+
+
+def trim_args(plan):
+    """截断时长参数（可与 -c copy 同时使用）"""
+    return ['-t', f'{plan["trim"]:g}'] if plan['trim'] else []
+
+
+def budget_report(plan, source_bytes, output_bytes):
+    """生成写入响应元数据的预算报告"""
+    return {
+        'applied': bool(plan['reductions']),
+        'reductions': plan['reductions'],
+        'source_bytes': source_bytes,
+        'output_bytes': output_bytes,
+        'over_budget': output_bytes > plan['budget']['max_bytes'],
+        'budget': plan['budget'],
+    }
@@ -2,8 +2,14 @@
 Mock 数据 - 学生信息和知识点库
 
 用于开发阶段，后续可替换为真实数据库
+
+每条记录有一个版本号（get_record_version），通过 update_student / update_knowledge 修改记录时
+版本号加一并通知 add_update_listener 注册的回调（prompt_builder 据此作废已渲染的 Prompt 片段）。
+直接修改 get_student / get_knowledge 返回的字典不会更新版本号；替换为真实数据库时保持同样的接口即可。
 """
 
+import threading
+
 # Mock 学生数据
 MOCK_STUDENTS = {
     'student_001': {
@@ -239,6 +245,68 @@ MOCK_KNOWLEDGE = {
 }
 
 
+_version_lock = threading.Lock()
+_record_versions = {}   # {(kind, key): version}，kind 为 'student' / 'knowledge'
+_update_listeners = []
+
+
+def get_record_version(kind, key):
+    """
+    返回记录的版本号
+
+    参数:
+        kind: 'student' 或 'knowledge'
+        key: student_id 或 topic
+
+    返回:
+        版本号（从 1 开始，每次更新加一）；记录不存在时返回 None
+    """
+    records = MOCK_STUDENTS if kind == 'student' else MOCK_KNOWLEDGE
+    if key not in records:
+        return None
+    return _record_versions.get((kind, key), 1)
+
+
+def add_update_listener(callback):
+    """注册记录更新回调 callback(kind, key)，记录被修改或删除后调用"""
+    _update_listeners.append(callback)
+
+
+def _update_record(kind, records, key, fields):
+    with _version_lock:
+        if fields is None:
+            records.pop(key, None)
+        else:
+            records[key] = {**records.get(key, {}), **fields}
+        _record_versions[(kind, key)] = _record_versions.get((kind, key), 1) + 1
+    for callback in _update_listeners:
+        callback(kind, key)
+
+
+# 更新学生信息
+def update_student(student_id, fields):
+    """
+    更新学生信息（浅合并顶层字段；记录不存在时新建）
+
+    参数:
+        student_id: 学生 ID
+        fields: 要更新的字段字典；None 表示删除该学生
+    """
+    _update_record('student', MOCK_STUDENTS, student_id, fields)
+
+
+# 更新知识点
+def update_knowledge(topic, fields):
+    """
+    更新知识点（浅合并顶层字段；记录不存在时新建）
+
+    参数:
+        topic: 知识点 topic
+        fields: 要更新的字段字典；None 表示删除该知识点
+    """
+    _update_record('knowledge', MOCK_KNOWLEDGE, topic, fields)
+
+
 # 获取学生信息
 def get_student(student_id):
     """获取学生信息"""
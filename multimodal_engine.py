@@ -4,9 +4,12 @@
 提供基础的多模态 AI 能力，不对外暴露接口
 """
 
+import base64
 import dashscope
-from openai import OpenAI
 import os
+from request_encoder import create_chat_completion, acreate_chat_completion
+from upstream_http import get_openai_client, get_async_openai_client, dashscope_options, adashscope_options
+from tts_cache import cached_tts, acached_tts
 
 # 从环境变量读取配置
 API_KEY = os.getenv('API_KEY')  # 使用统一的 API_KEY 环境变量
@@ -16,11 +19,13 @@ if not API_KEY:
 API_BASE = os.getenv('API_BASE', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
 MODEL = os.getenv('MODEL', 'qwen3-omni-flash')
 
-# 初始化 OpenAI 客户端（兼容模式）
-client = OpenAI(
-    api_key=API_KEY,
-    base_url=API_BASE
-)
+# 初始化 OpenAI 客户端（兼容模式，共享连接池见 upstream_http）
+client = get_openai_client(API_KEY, API_BASE)
+
+# 异步客户端（供 ASGI 服务模式使用，见 app_agent_async.py）
+async_client = get_async_openai_client(API_KEY, API_BASE)
+
+TTS_MODEL = 'qwen3-tts-flash'
 
 # 配置 DashScope SDK
 dashscope.api_key = API_KEY
@@ -33,6 +38,7 @@ def multimodal_chat(messages, modalities=['text'], stream=False):
 
     参数:
         messages: 消息列表，支持 text/video_url/audio_url/image_url
+                  （媒体 url 可以是 request_encoder.DataURI，发送时边编码边上传）
         modalities: 输出模态 ['text'] 或 ['text', 'audio']
         stream: 是否流式返回
 
@@ -55,11 +61,14 @@ def multimodal_chat(messages, modalities=['text'], stream=False):
         )
     """
     try:
-        response = client.chat.completions.create(
+        response = create_chat_completion(
+            client,
             model=MODEL,
             messages=messages,
             modalities=modalities,
-            stream=stream
+            stream=stream,
+            # 流式时在最后一个 chunk 返回 usage（含前缀缓存命中的 token 数）
+            **({'stream_options': {'include_usage': True}} if stream else {})
         )
         return response
     except Exception as e:
@@ -83,31 +92,108 @@ def stream_tts(text, voice='Cherry', language='Chinese'):
         audio_stream = stream_tts("你好，我是数字人")
         for chunk in audio_stream:
             yield chunk
+
+    相同的 (文本, 音色, 语言) 合成过一次后从本地缓存直接产出（见 tts_cache.py）
+    """
+    try:
+        yield from cached_tts(text, voice, language, TTS_MODEL, _synthesize_tts)
+    except Exception as e:
+        print(f'❌ TTS 合成异常: {e}')
+        raise
+
+
+def _synthesize_tts(text, voice, language):
+    """调用 DashScope 流式合成（不经过缓存）"""
+    responses = dashscope.MultiModalConversation.call(
+        model=TTS_MODEL,
+        text=text,
+        voice=voice,
+        language_type=language,
+        stream=True,
+        **dashscope_options()
+    )
+
+    for response in responses:
+        pcm_chunk = _extract_tts_pcm(response)
+        if pcm_chunk:
+            yield pcm_chunk
+
+
+async def amultimodal_chat(messages, modalities=['text'], stream=False):
+    """
+    多模态对话（异步版本）
+
+    参数与返回值同 multimodal_chat，等待上游响应期间不占用线程
+
+    示例:
+        response = await amultimodal_chat(messages, modalities=['text'])
     """
     try:
-        responses = dashscope.MultiModalConversation.call(
-            model="qwen3-tts-flash",
-            text=text,
-            voice=voice,
-            language_type=language,
-            stream=True
+        response = await acreate_chat_completion(
+            async_client,
+            model=MODEL,
+            messages=messages,
+            modalities=modalities,
+            stream=stream,
+            **({'stream_options': {'include_usage': True}} if stream else {})
         )
+        return response
+    except Exception as e:
+        print(f'❌ 多模态对话失败: {e}')
+        raise
+
+
+async def astream_tts(text, voice='Cherry', language='Chinese'):
+    """
+    流式 TTS 合成（异步版本）
+
+    参数与 stream_tts 相同
 
-        for response in responses:
-            if response.status_code == 200:
-                # 返回音频数据
-                if hasattr(response, 'output') and 'audio' in response.output:
-                    for audio_chunk in response.output['audio']:
-                        yield audio_chunk
-            else:
-                print(f'❌ TTS 合成失败: {response.code} - {response.message}')
-                raise Exception(f'TTS 合成失败: {response.code} - {response.message}')
+    返回:
+        async generator: 音频流生成器，产出 PCM 格式音频数据
 
+    示例:
+        async for chunk in astream_tts("你好，我是数字人"):
+            yield chunk
+    """
+    try:
+        async for pcm_chunk in acached_tts(text, voice, language, TTS_MODEL, _asynthesize_tts):
+            yield pcm_chunk
     except Exception as e:
         print(f'❌ TTS 合成异常: {e}')
         raise
 
 
+async def _asynthesize_tts(text, voice, language):
+    """调用 DashScope 流式合成（异步版本，不经过缓存）"""
+    responses = await dashscope.AioMultiModalConversation.call(
+        model=TTS_MODEL,
+        text=text,
+        voice=voice,
+        language_type=language,
+        stream=True,
+        **(await adashscope_options())
+    )
+
+    async for response in responses:
+        pcm_chunk = _extract_tts_pcm(response)
+        if pcm_chunk:
+            yield pcm_chunk
+
+
+def _extract_tts_pcm(response):
+    """从一条 TTS 流式响应中取出 PCM 数据（DashScope 返回 base64 编码）"""
+    if response.status_code != 200:
+        print(f'❌ TTS 合成失败: {response.code} - {response.message}')
+        raise Exception(f'TTS 合成失败: {response.code} - {response.message}')
+
+    output = getattr(response, 'output', None)
+    audio = output.get('audio') if output else None
+    if audio and audio.get('data'):
+        return base64.b64decode(audio['data'])
+    return b''
+
+
 def text_chat(messages, stream=False):
     """
     纯文本对话（更快，不支持多模态输入）
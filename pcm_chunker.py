@@ -0,0 +1,151 @@
+"""
+PCM 分块器（预分配缓冲区 + 自适应块大小）
+
+各流式接口原来各自用 pcm_buffer += pcm_chunk 攒够 MIN_CHUNK_SIZE = 24000 字节（约 0.5 秒）再发送:
+    - bytes 不可变，每次 += 都要分配新对象并复制已累积的全部数据（每块内部是平方级复制）
+    - 第一块也要等满 0.5 秒音频才发出，白白推迟了首个音频到达客户端的时间
+这里统一成一个分块器:
+    - 缓冲区是一块预分配的 bytearray，通过 memoryview 原地写入，输入片段不产生新对象；
+      只有发出的块会分配一次（bytes 拷贝，之后缓冲区复用）
+    - 第一块很小（默认 4800 字节 ≈ 0.1 秒）以尽快开始播放，之后每块按倍数增长，直到上限
+      （默认 24000 字节，与原来的块大小一致，稳定后客户端播放队列的负担不变）
+    - 块大小按采样点（2 字节）对齐
+
+配置（环境变量）:
+    PCM_FIRST_CHUNK_BYTES   第一块的大小（默认 4800）
+    PCM_MAX_CHUNK_BYTES     块大小上限（默认 24000）
+    PCM_CHUNK_GROWTH        每块相对上一块的增长倍数（默认 2）
+
+示例:
+    chunker = PCMChunker()
+    for pcm_chunk in upstream:
+        for pcm in chunker.feed(pcm_chunk):
+            yield from output.audio(pcm)
+    pcm = chunker.flush()
+    if pcm:
+        yield from output.audio(pcm)
+"""
+
+import os
+import threading
+import time
+
+
+PCM_FIRST_CHUNK_BYTES = int(os.getenv('PCM_FIRST_CHUNK_BYTES', '4800'))
+PCM_MAX_CHUNK_BYTES = int(os.getenv('PCM_MAX_CHUNK_BYTES', '24000'))
+PCM_CHUNK_GROWTH = float(os.getenv('PCM_CHUNK_GROWTH', '2'))
+
+SAMPLE_WIDTH = 2  # 16-bit 单声道
+
+_stats_lock = threading.Lock()
+_stats = {'streams': 0, 'chunks': 0, 'bytes': 0, 'first_chunk_hold_seconds': 0.0, 'max_first_chunk_hold_seconds': 0.0}
+
+
+def _align(size):
+    """按采样点对齐（至少一个采样点）"""
+    return max(SAMPLE_WIDTH, int(size) // SAMPLE_WIDTH * SAMPLE_WIDTH)
+
+
+class PCMChunker:
+    """
+    把任意大小的 PCM 片段整理成逐渐变大的块
+
+    参数:
+        first_chunk_bytes: 第一块的大小
+        max_chunk_bytes: 块大小上限（缓冲区按此大小预分配）
+        growth: 每块相对上一块的增长倍数（1 表示固定块大小）
+
+    属性:
+        chunks: 已发出的块数（每块一次分配）
+        first_chunk_hold: 第一块从收到第一个字节到发出等待的秒数（尚未发出时为 None）
+    """
+
+    def __init__(self, first_chunk_bytes=None, max_chunk_bytes=None, growth=None):
+        self.max_chunk_bytes = _align(max_chunk_bytes or PCM_MAX_CHUNK_BYTES)
+        self.target = min(_align(first_chunk_bytes or PCM_FIRST_CHUNK_BYTES), self.max_chunk_bytes)
+        self.growth = growth or PCM_CHUNK_GROWTH
+        self._buffer = bytearray(self.max_chunk_bytes)
+        self._view = memoryview(self._buffer)
+        self._size = 0
+        self._first_input_at = None
+        self.chunks = 0
+        self.bytes = 0
+        self.first_chunk_hold = None
+
+    def feed(self, pcm):
+        """
+        写入一个 PCM 片段
+
+        返回:
+            凑满的块列表（bytes，可能为空；一个大片段可能凑满多块）
+        """
+        if not pcm:
+            return []
+        if self._first_input_at is None:
+            self._first_input_at = time.perf_counter()
+
+        size = self._size + len(pcm)
+        if size < self.target:
+            # 常见情况：片段放得下且凑不满一块，直接写入
+            self._view[self._size:size] = pcm
+            self._size = size
+            return []
+
+        data = memoryview(pcm)
+        chunks = []
+        offset = 0
+        while offset < len(data):
+            n = min(self.target - self._size, len(data) - offset)
+            self._view[self._size:self._size + n] = data[offset:offset + n]
+            self._size += n
+            offset += n
+            if self._size >= self.target:
+                chunks.append(self._emit())
+        return chunks
+
+    def flush(self):
+        """
+        取出剩余数据（流结束时调用）
+
+        返回:
+            最后一块；没有剩余数据时返回 None
+        """
+        chunk = self._emit() if self._size else None
+        if self._first_input_at is not None:
+            with _stats_lock:
+                _stats['streams'] += 1
+                _stats['chunks'] += self.chunks
+                _stats['bytes'] += self.bytes
+                if self.first_chunk_hold is not None:
+                    _stats['first_chunk_hold_seconds'] += self.first_chunk_hold
+                    _stats['max_first_chunk_hold_seconds'] = max(
+                        _stats['max_first_chunk_hold_seconds'], self.first_chunk_hold
+                    )
+            self._first_input_at = None
+        return chunk
+
+    def _emit(self):
+        chunk = bytes(self._view[:self._size])
+        self._size = 0
+        if self.chunks == 0:
+            self.first_chunk_hold = time.perf_counter() - self._first_input_at
+        self.chunks += 1
+        self.bytes += len(chunk)
+        self.target = min(_align(self.target * self.growth), self.max_chunk_bytes)
+        return chunk
+
+
+def get_chunker_stats():
+    """返回分块器统计：流数、块数、平均块大小、第一块的平均 / 最大等待时间（秒）"""
+    with _stats_lock:
+        stats = dict(_stats)
+    streams = stats['streams']
+    hold = stats.pop('first_chunk_hold_seconds')
+    stats.update(
+        avg_chunk_bytes=stats['bytes'] / stats['chunks'] if stats['chunks'] else None,
+        avg_first_chunk_hold_seconds=hold / streams if streams else None,
+        first_chunk_bytes=_align(PCM_FIRST_CHUNK_BYTES),
+        max_chunk_bytes=_align(PCM_MAX_CHUNK_BYTES),
+        growth=PCM_CHUNK_GROWTH,
+    )
+    return stats
@@ -2,28 +2,316 @@
 动态 Prompt 构建服务
 
 根据学生信息和知识点动态构建 System Prompt
+
+固定模板 system_prompt.md 缓存在内存中，每次构建只 stat 一次文件:
+mtime / 大小未变化时直接使用缓存；变化时重新读取并比较内容哈希，内容确实变化才替换缓存
+（编辑器保存但内容不变、touch 等不会触发重建）。模板与动态部分之间的分隔符在加载时一并拼好，
+构建时只做一次 join。
+
+学生信息 / 知识点片段按记录版本缓存（mock_data.get_record_version；没有版本的记录按内容哈希），
+完整 Prompt 按 (学生版本, 知识点版本, 模板哈希) 缓存，两者都是有界 LRU。mock_data 更新记录时
+通过回调立即作废相关缓存。get_prompt_cache_stats 返回各级缓存的命中 / 重新加载次数。
+
+上游（DashScope 兼容模式等）对请求的公共前缀做缓存，命中部分按 cached_tokens 计费且首包更快。
+PROMPT_LAYOUT=prefix（默认）时按变化频率从低到高排列：固定模板 → 知识点 → 学生信息（→ 历史对话），
+同一知识点的不同学生也能共享模板 + 知识点这段前缀；legacy 为原来的 模板 → 学生信息 → 知识点。
+record_prompt_usage 记录每次请求 usage 中的 prompt_tokens / cached_tokens，
+get_prefix_cache_stats 返回前缀缓存命中率。
+
+配置（环境变量）:
+    PROMPT_LAYOUT               prefix（默认）/ legacy
+    PROMPT_SECTION_CACHE_SIZE   缓存的学生信息 / 知识点片段数（默认 1024）
+    PROMPT_CACHE_SIZE           缓存的完整 Prompt 数（默认 256）
 """
 
+import hashlib
+import json
 import os
+import threading
+from collections import OrderedDict
+
+from mock_data import get_record_version, add_update_listener
+
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'system_prompt.md')
+PROMPT_SECTION_CACHE_SIZE = int(os.getenv('PROMPT_SECTION_CACHE_SIZE', '1024'))
+PROMPT_CACHE_SIZE = int(os.getenv('PROMPT_CACHE_SIZE', '256'))
+PROMPT_LAYOUT = os.getenv('PROMPT_LAYOUT', 'prefix').lower()
+
+_template_lock = threading.Lock()
+_template_cache = {
+    'signature': None,  # (mtime_ns, size)
+    'digest': None,
+    'text': None,
+    'head': None,       # 模板 + 分隔符，构建时直接作为第一段
+}
+_template_stats = {
+    'hits': 0,
+    'reloads': 0,
+    'unchanged': 0,
+    'errors': 0,
+}
+
+# 片段缓存 {(kind, record_id): (version, record, text)}；完整 Prompt 缓存 {key: (student, knowledge, text)}
+# 同时保存记录对象本身：mock_data 更新时替换为新字典，旧字典渲染的结果不会被当成新版本使用
+_cache_lock = threading.Lock()
+_section_cache = OrderedDict()
+_prompt_cache = OrderedDict()
+_cache_stats = {
+    'section_hits': 0,
+    'section_misses': 0,
+    'prompt_hits': 0,
+    'prompt_misses': 0,
+    'evictions': 0,
+    'invalidations': 0,
+}
+
+
+def _get_template_entry():
+    """返回 (模板文本, 模板 + 分隔符, 内容哈希)，文件变化时重新加载"""
+    try:
+        stat = os.stat(TEMPLATE_PATH)
+    except OSError:
+        with _template_lock:
+            if _template_cache['text'] is None:
+                raise
+            # 文件暂时不可读（如正在被替换）：继续使用上一次加载的内容
+            _template_stats['errors'] += 1
+            return _template_cache['text'], _template_cache['head'], _template_cache['digest']
+
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _template_lock:
+        if signature == _template_cache['signature']:
+            _template_stats['hits'] += 1
+            return _template_cache['text'], _template_cache['head'], _template_cache['digest']
+
+        with open(TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+            text = f.read()
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        _template_cache['signature'] = signature
+        if digest == _template_cache['digest']:
+            _template_stats['unchanged'] += 1
+        else:
+            if _template_cache['digest'] is not None:
+                print(f'🔄 系统提示词模板已更新，重新加载（{len(text)} 字符）')
+            _template_cache.update(digest=digest, text=text, head=text + "\n\n")
+            _template_stats['reloads'] += 1
+        return _template_cache['text'], _template_cache['head'], _template_cache['digest']
 
 
 # 读取 System Prompt 模板（固定部分）
 def load_system_prompt_template():
     """
-    加载系统提示词模板
+    加载系统提示词模板（带缓存，文件修改后自动重新加载）
 
     返回:
         template: 系统提示词模板文本
     """
-    template_path = os.path.join(os.path.dirname(__file__), 'system_prompt.md')
-    with open(template_path, 'r', encoding='utf-8') as f:
-        return f.read()
+    return _get_template_entry()[0]
+
+
+def get_prompt_cache_stats():
+    """返回缓存统计：模板命中 / 重新加载 / 文件变化但内容相同 / 读取失败次数，片段和完整 Prompt 的命中情况"""
+    with _template_lock:
+        stats = dict(_template_stats)
+        stats['template_chars'] = len(_template_cache['text']) if _template_cache['text'] else 0
+    checks = stats['hits'] + stats['reloads'] + stats['unchanged']
+    stats['hit_rate'] = stats['hits'] / checks if checks else None
+
+    with _cache_lock:
+        stats.update(_cache_stats)
+        stats.update(sections_cached=len(_section_cache), prompts_cached=len(_prompt_cache))
+    for level in ('section', 'prompt'):
+        total = stats[f'{level}_hits'] + stats[f'{level}_misses']
+        stats[f'{level}_hit_rate'] = stats[f'{level}_hits'] / total if total else None
+    return stats
+
+
+def _record_version(kind, record_id, record):
+    """记录的版本：mock_data 中的记录用版本号，其他（如直接传入的字典）用内容哈希"""
+    version = get_record_version(kind, record_id) if record_id is not None else None
+    if version is not None:
+        return version
+    content = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _same_record(version, cached, record):
+    """按版本号缓存的条目还要求是同一个记录对象；按内容哈希缓存的条目内容相同即可"""
+    return not isinstance(version, int) or cached is record
+
+
+def _lookup(cache, key, validate):
+    """LRU 查找，validate(entry) 为真时返回缓存的文本，否则返回 None（调用方持有 _cache_lock）"""
+    entry = cache.get(key)
+    if entry is None or not validate(entry):
+        return None
+    cache.move_to_end(key)
+    return entry[-1]
+
+
+def _store(cache, key, entry, limit):
+    """写入 LRU 缓存并淘汰超出的条目（调用方持有 _cache_lock）"""
+    cache[key] = entry
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+        _cache_stats['evictions'] += 1
+
+
+def _cached_section(kind, record_id, record, render):
+    version = _record_version(kind, record_id, record)
+    key = (kind, record_id)
+    with _cache_lock:
+        text = _lookup(_section_cache, key, lambda e: e[0] == version and _same_record(version, e[1], record))
+        if text is not None:
+            _cache_stats['section_hits'] += 1
+            return version, text
+        _cache_stats['section_misses'] += 1
+
+    text = render(record)
+    with _cache_lock:
+        _store(_section_cache, key, (version, record, text), PROMPT_SECTION_CACHE_SIZE)
+    return version, text
+
+
+def invalidate_prompt_cache(kind=None, key=None):
+    """
+    作废缓存的片段和完整 Prompt
+
+    参数:
+        kind: 'student' / 'knowledge'；为 None 时清空全部缓存
+        key: student_id / topic
+    """
+    with _cache_lock:
+        if kind is None:
+            _section_cache.clear()
+            _prompt_cache.clear()
+        else:
+            _section_cache.pop((kind, key), None)
+            position = 0 if kind == 'student' else 2
+            for prompt_key in [k for k in _prompt_cache if k[position] == key]:
+                del _prompt_cache[prompt_key]
+        _cache_stats['invalidations'] += 1
+
+
+# mock_data（或替换后的真实存储）更新记录时作废相关缓存
+add_update_listener(invalidate_prompt_cache)
+
+
+_usage_lock = threading.Lock()
+_usage_stats = {
+    'requests': 0,
+    'prompt_tokens': 0,
+    'cached_tokens': 0,
+    'cache_hit_requests': 0,
+    'missing_usage': 0,
+}
+
+
+def _usage_field(obj, name):
+    # usage 可能是 SDK 对象，也可能是 request_encoder 构造时保留的 dict
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def record_prompt_usage(usage):
+    """
+    记录一次请求的输入 token 数和前缀缓存命中的 token 数
+
+    参数:
+        usage: 响应的 usage（ChatCompletion.usage 或流式最后一个 chunk 的 usage）；None 表示上游未返回
+    """
+    prompt_tokens = _usage_field(usage, 'prompt_tokens') if usage is not None else None
+    with _usage_lock:
+        if prompt_tokens is None:
+            _usage_stats['missing_usage'] += 1
+            return
+        details = _usage_field(usage, 'prompt_tokens_details')
+        cached_tokens = (_usage_field(details, 'cached_tokens') if details is not None else None) or 0
+        _usage_stats['requests'] += 1
+        _usage_stats['prompt_tokens'] += prompt_tokens
+        _usage_stats['cached_tokens'] += cached_tokens
+        if cached_tokens:
+            _usage_stats['cache_hit_requests'] += 1
+    print(f'📊 输入 token {prompt_tokens}，前缀缓存命中 {cached_tokens}'
+          f'（{cached_tokens / prompt_tokens:.0%}）' if prompt_tokens else f'📊 输入 token {prompt_tokens}')
+
+
+def get_prefix_cache_stats():
+    """返回上游前缀缓存统计：请求数、输入 / 命中 token 总数、命中 token 占比、有命中的请求占比"""
+    with _usage_lock:
+        stats = dict(_usage_stats)
+    requests = stats['requests']
+    stats.update(
+        layout=PROMPT_LAYOUT,
+        cached_token_ratio=stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else None,
+        cache_hit_request_ratio=stats['cache_hit_requests'] / requests if requests else None,
+        avg_prompt_tokens=stats['prompt_tokens'] / requests if requests else None,
+    )
+    return stats
+
+
+def _render_student_section(student):
+    lines = [
+        "## 学生信息",
+        "",
+        f"- **姓名**: {student['name']}",
+        f"- **年龄**: {student['age']}",
+        f"- **水平**: {student['level']}",
+        f"- **背景**: {student['background']}",
+        f"- **学习目标**: {', '.join(student['goals'])}",
+        "",
+        "### 历史表现",
+        "",
+        f"- **总课时**: {student['history']['total_sessions']} 节",
+        f"- **总时长**: {student['history']['total_duration']} 秒",
+        f"- **优势**: {', '.join(student['history']['strengths'])}",
+        f"- **待改进**: {', '.join(student['history']['weaknesses'])}",
+        "",
+        "### 当前进度",
+        "",
+    ]
+    lines.extend(
+        f"- **{skill}**: {data['score']} 分（{data['trend']}）"
+        for skill, data in student['history']['progress'].items()
+    )
+    return "\n".join(lines).strip()
+
+
+def _render_knowledge_section(knowledge):
+    content = knowledge['content']
+    lines = [
+        "## 当前教学知识点",
+        "",
+        f"### {knowledge['title']}",
+        "",
+        f"**难度**: {knowledge['difficulty']}",
+        "",
+        "**理论基础**:",
+        content['theory'],
+        "",
+        "**教学方法**:",
+    ]
+    for i, method in enumerate(content['methods'], 1):
+        lines.extend((
+            "",
+            f"{i}. **{method['name']}**",
+            f"   - 描述: {method['description']}",
+            f"   - 示例: {method['example']}",
+        ))
+    lines.extend(("", "**常见错误**:"))
+    lines.extend(f"- {mistake}" for mistake in content['common_mistakes'])
+    lines.extend(("", "**练习建议**:"))
+    lines.extend(f"- {tip}" for tip in content['practice_tips'])
+    return "\n".join(lines).strip()
 
 
 # 构建学生信息部分
 def build_student_section(student):
     """
-    构建学生信息部分
+    构建学生信息部分（按记录版本缓存）
 
     参数:
         student: 学生信息字典
@@ -33,37 +321,13 @@ def build_student_section(student):
     """
     if not student:
         return ""
-
-    student_section = f"""
-## 学生信息
-
-- **姓名**: {student['name']}
-- **年龄**: {student['age']}
-- **水平**: {student['level']}
-- **背景**: {student['background']}
-- **学习目标**: {', '.join(student['goals'])}
-
-### 历史表现
-
-- **总课时**: {student['history']['total_sessions']} 节
-- **总时长**: {student['history']['total_duration']} 秒
-- **优势**: {', '.join(student['history']['strengths'])}
-- **待改进**: {', '.join(student['history']['weaknesses'])}
-
-### 当前进度
-
-"""
-
-    for skill, data in student['history']['progress'].items():
-        student_section += f"- **{skill}**: {data['score']} 分（{data['trend']}）\n"
-
-    return student_section.strip()
+    return _cached_section('student', student.get('student_id'), student, _render_student_section)[1]
 
 
 # 构建知识点部分
 def build_knowledge_section(knowledge):
     """
-    构建知识点部分
+    构建知识点部分（按记录版本缓存）
 
     参数:
         knowledge: 知识点信息字典
@@ -73,73 +337,59 @@ def build_knowledge_section(knowledge):
     """
     if not knowledge:
         return ""
-
-    knowledge_section = f"""
-## 当前教学知识点
-
-### {knowledge['title']}
-
-**难度**: {knowledge['difficulty']}
-
-**理论基础**:
-{knowledge['content']['theory']}
-
-**教学方法**:
-"""
-
-    for i, method in enumerate(knowledge['content']['methods'], 1):
-        knowledge_section += f"""
-{i}. **{method['name']}**
-   - 描述: {method['description']}
-   - 示例: {method['example']}
-"""
-
-    knowledge_section += f"""
-**常见错误**:
-"""
-    for mistake in knowledge['content']['common_mistakes']:
-        knowledge_section += f"- {mistake}\n"
-
-    knowledge_section += f"""
-**练习建议**:
-"""
-    for tip in knowledge['content']['practice_tips']:
-        knowledge_section += f"- {tip}\n"
-
-    return knowledge_section.strip()
+    return _cached_section('knowledge', knowledge.get('topic'), knowledge, _render_knowledge_section)[1]
 
 
 # 动态构建完整的 System Prompt
-def build_system_prompt(student, knowledge=None):
+def build_system_prompt(student, knowledge=None, layout=None):
     """
     动态构建完整的 System Prompt
 
     参数:
         student: 学生信息字典
         knowledge: 知识点信息字典（可选）
+        layout: prefix / legacy（默认 PROMPT_LAYOUT）
 
     返回:
         system_prompt: 完整的系统提示词
     """
-    # 1. 加载固定模板
-    template = load_system_prompt_template()
-
-    # 2. 构建学生信息部分
-    student_section = build_student_section(student)
-
-    # 3. 构建知识点部分（如果提供）
-    knowledge_section = build_knowledge_section(knowledge) if knowledge else ""
-
-    # 4. 拼接完整 Prompt
-    # 在模板中找到合适的位置插入动态内容
-    # 假设模板的最后是 "## 响应格式" 或其他固定部分
-
-    # 简单策略：在模板最后添加动态内容
-    system_prompt = template + "\n\n" + student_section
-
-    if knowledge_section:
-        system_prompt += "\n\n" + knowledge_section
-
+    # 1. 加载固定模板（缓存，head 已包含与动态部分之间的分隔符）
+    _, head, template_digest = _get_template_entry()
+    student_id = student.get('student_id') if student else None
+    topic = knowledge.get('topic') if knowledge else None
+
+    # 2. 学生信息、知识点片段（按记录版本缓存）
+    student_version, student_section = (
+        _cached_section('student', student_id, student, _render_student_section) if student else (None, "")
+    )
+    knowledge_version, knowledge_section = (
+        _cached_section('knowledge', topic, knowledge, _render_knowledge_section) if knowledge else (None, "")
+    )
+
+    # 3. 完整 Prompt 按 (学生版本, 知识点版本, 模板哈希, 布局) 缓存
+    layout = layout or PROMPT_LAYOUT
+    key = (student_id, student_version, topic, knowledge_version, template_digest, layout)
+    with _cache_lock:
+        system_prompt = _lookup(_prompt_cache, key, lambda e: (
+            _same_record(student_version, e[0], student) and _same_record(knowledge_version, e[1], knowledge)
+        ))
+        if system_prompt is not None:
+            _cache_stats['prompt_hits'] += 1
+            return system_prompt
+        _cache_stats['prompt_misses'] += 1
+
+    # 4. 拼接完整 Prompt：模板在前，动态内容按布局追加
+    if layout == 'legacy':
+        if knowledge_section:
+            system_prompt = ''.join((head, student_section, "\n\n", knowledge_section))
+        else:
+            system_prompt = head + student_section
+    else:
+        # 变化最少的放前面：知识点在各学生之间共享，学生信息放在最后
+        system_prompt = head + "\n\n".join(section for section in (knowledge_section, student_section) if section)
+
+    with _cache_lock:
+        _store(_prompt_cache, key, (student, knowledge, system_prompt), PROMPT_CACHE_SIZE)
     return system_prompt
 
 
@@ -0,0 +1,301 @@
+"""
+流式请求编码：data URI 边编码边发送
+
+原来的调用方式下，一段视频在发送前会同时存在多份拷贝:
+    原始 bytes → base64 str → f-string 拼出的 data URI → SDK json.dumps 的请求体 str → 编码后的 bytes
+大视频（几 MB ~ 几十 MB）时单个请求的内存峰值是视频大小的 4 倍以上。
+
+这里把消息中的媒体换成 DataURI 占位对象，请求体按块生成:
+    JSON 文本片段原样输出，遇到 DataURI 时按 3 字节对齐的块读取原始数据并 base64 编码后输出，
+    base64 字符不需要 JSON 转义，Content-Length 可以提前算出，不需要 chunked 编码。
+发送时内存中只保留原始数据（或文件）和一个编码块，响应按 SSE / JSON 解析为 SDK 的
+ChatCompletionChunk / ChatCompletion 对象，调用方的处理逻辑不变。
+
+配置（环境变量）:
+    STREAMING_UPLOAD   是否流式编码请求体（默认 true；false 时展开为普通字符串交给 OpenAI SDK 发送）
+
+示例:
+    uri = DataURI('video/mp4', video_data)          # 也可以是文件路径或文件对象
+    stream = create_chat_completion(
+        client,
+        model=MODEL,
+        messages=[{'role': 'user', 'content': [{'type': 'video_url', 'video_url': {'url': uri}}]}],
+        stream=True
+    )
+    for chunk in stream:
+        print(chunk.choices[0].delta.content)
+"""
+
+import base64
+import io
+import json
+import mmap
+import os
+import re
+import uuid
+
+from openai import APIStatusError
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from upstream_http import get_http_client, get_async_http_client
+
+
+STREAMING_UPLOAD = os.getenv('STREAMING_UPLOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# 每次读取的原始字节数（3 的倍数，保证分块编码后直接拼接等于整体编码）
+RAW_CHUNK_SIZE = 48 * 1024
+
+# 可以直接按 memoryview 切片的数据源（mmap 来自 upload_limits.read_upload）
+_BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+
+class DataURI:
+    """
+    延迟编码的 data URI
+
+    参数:
+        mime: MIME 类型（可以为空字符串，如 input_audio 的 'data:;base64,...'；
+              None 时只输出 base64，不带 'data:' 前缀）
+        source: bytes / bytearray / memoryview / mmap、文件路径，或可 seek 的二进制文件对象
+    """
+
+    def __init__(self, mime, source):
+        self.mime = mime
+        self.source = source
+        self.prefix = f'data:{mime};base64,'.encode('ascii') if mime is not None else b''
+
+    @property
+    def raw_size(self):
+        """原始数据字节数"""
+        if isinstance(self.source, _BUFFER_TYPES):
+            return len(self.source)
+        if isinstance(self.source, (str, os.PathLike)):
+            return os.path.getsize(self.source)
+        position = self.source.tell()
+        size = self.source.seek(0, io.SEEK_END)
+        self.source.seek(position)
+        return size
+
+    def __len__(self):
+        """编码后的长度（字符数 = 字节数）"""
+        return len(self.prefix) + (self.raw_size + 2) // 3 * 4
+
+    def __str__(self):
+        """完整展开（仅用于非流式发送）"""
+        return b''.join(self.iter_chunks()).decode('ascii')
+
+    def __repr__(self):
+        return f'<DataURI {self.mime or "-"} {self.raw_size} bytes>'
+
+    def _iter_raw(self):
+        if isinstance(self.source, _BUFFER_TYPES):
+            view = memoryview(self.source)
+            for offset in range(0, len(view), RAW_CHUNK_SIZE):
+                yield view[offset:offset + RAW_CHUNK_SIZE]
+            return
+
+        if isinstance(self.source, (str, os.PathLike)):
+            f = open(self.source, 'rb')
+        else:
+            f = self.source
+            f.seek(0)
+        try:
+            while True:
+                block = f.read(RAW_CHUNK_SIZE)
+                if not block:
+                    break
+                yield block
+        finally:
+            if f is not self.source:
+                f.close()
+
+    def iter_chunks(self):
+        """按块产出 data URI 的字节"""
+        yield self.prefix
+        for block in self._iter_raw():
+            yield base64.b64encode(block)
+
+
+def materialize(value):
+    """把消息中的 DataURI 展开为普通字符串（STREAMING_UPLOAD 关闭时使用）"""
+    if isinstance(value, DataURI):
+        return str(value)
+    if isinstance(value, dict):
+        return {k: materialize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [materialize(v) for v in value]
+    return value
+
+
+class StreamingJSONBody:
+    """
+    按块生成的 JSON 请求体（同步客户端直接迭代，异步客户端使用 aiter_chunks()）
+
+    参数:
+        payload: 请求参数 dict，任意位置可以包含 DataURI
+    """
+
+    def __init__(self, payload):
+        uris = []
+        token = uuid.uuid4().hex
+
+        def placeholder(obj):
+            if not isinstance(obj, DataURI):
+                raise TypeError(f'无法序列化 {type(obj).__name__}')
+            uris.append(obj)
+            return f'@@{token}:{len(uris) - 1}@@'
+
+        text = json.dumps(payload, ensure_ascii=False, default=placeholder)
+        pieces = re.split(f'@@{token}:(\\d+)@@', text)
+
+        # 偶数位是 JSON 文本，奇数位是 DataURI 序号（占位符两侧的引号留在文本中）
+        self.parts = [
+            piece.encode('utf-8') if i % 2 == 0 else uris[int(piece)]
+            for i, piece in enumerate(pieces)
+        ]
+        self.content_length = sum(len(part) for part in self.parts)
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, DataURI):
+                yield from part.iter_chunks()
+            elif part:
+                yield part
+
+    async def aiter_chunks(self):
+        for chunk in self:
+            yield chunk
+
+
+def _request(client, payload):
+    body = StreamingJSONBody(payload)
+    url = f'{str(client.base_url).rstrip("/")}/chat/completions'
+    headers = {
+        'Authorization': f'Bearer {client.api_key}',
+        'Content-Type': 'application/json',
+        'Content-Length': str(body.content_length),
+        'Accept': 'text/event-stream' if payload.get('stream') else 'application/json',
+    }
+    return url, headers, body
+
+
+def _status_error(response):
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text
+    message = body.get('error', {}).get('message') if isinstance(body, dict) else None
+    return APIStatusError(
+        f'Error code: {response.status_code} - {message or body}',
+        response=response,
+        body=body
+    )
+
+
+def _parse_event(line):
+    """解析一行 SSE，返回 ChatCompletionChunk；非数据行返回 None，流结束返回 False"""
+    if not line.startswith('data:'):
+        return None
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return False
+    event = json.loads(data)
+    if 'error' in event:
+        raise Exception(f'上游流式响应错误: {event["error"]}')
+    return ChatCompletionChunk.construct(**event)
+
+
+def _iter_events(response):
+    # [DONE] 之后继续把响应体（通常只剩 chunked 结束标记）读完再关闭，
+    # 否则 httpx 会丢弃这条连接，下一个请求又要重新建立 TCP + TLS 连接
+    done = False
+    try:
+        for line in response.iter_lines():
+            if done:
+                continue
+            chunk = _parse_event(line)
+            if chunk is False:
+                done = True
+            elif chunk is not None:
+                yield chunk
+    finally:
+        response.close()
+
+
+async def _aiter_events(response):
+    done = False
+    try:
+        async for line in response.aiter_lines():
+            if done:
+                continue
+            chunk = _parse_event(line)
+            if chunk is False:
+                done = True
+            elif chunk is not None:
+                yield chunk
+    finally:
+        await response.aclose()
+
+
+def create_chat_completion(client, **params):
+    """
+    调用 chat/completions，消息中的 DataURI 边编码边发送
+
+    参数:
+        client: OpenAI 客户端（使用其 base_url 和 api_key；STREAMING_UPLOAD 关闭时直接用它发送）
+        **params: 同 client.chat.completions.create
+
+    返回:
+        stream=True 时为 ChatCompletionChunk 迭代器，否则为 ChatCompletion
+
+    异常:
+        APIStatusError: 上游返回错误状态码
+    """
+    if not STREAMING_UPLOAD:
+        return client.chat.completions.create(**materialize(params))
+
+    url, headers, body = _request(client, params)
+    http = get_http_client()
+    response = http.send(http.build_request('POST', url, headers=headers, content=body), stream=True)
+    if response.status_code >= 400:
+        response.read()
+        response.close()
+        raise _status_error(response)
+
+    if params.get('stream'):
+        return _iter_events(response)
+
+    try:
+        response.read()
+        return ChatCompletion.construct(**response.json())
+    finally:
+        response.close()
+
+
+async def acreate_chat_completion(async_client, **params):
+    """
+    create_chat_completion 的异步版本
+
+    返回:
+        stream=True 时为 ChatCompletionChunk 异步迭代器，否则为 ChatCompletion
+    """
+    if not STREAMING_UPLOAD:
+        return await async_client.chat.completions.create(**materialize(params))
+
+    url, headers, body = _request(async_client, params)
+    http = get_async_http_client()
+    request = http.build_request('POST', url, headers=headers, content=body.aiter_chunks())
+    response = await http.send(request, stream=True)
+    if response.status_code >= 400:
+        await response.aread()
+        await response.aclose()
+        raise _status_error(response)
+
+    if params.get('stream'):
+        return _aiter_events(response)
+
+    try:
+        await response.aread()
+        return ChatCompletion.construct(**response.json())
+    finally:
+        await response.aclose()
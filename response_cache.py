@@ -0,0 +1,294 @@
+"""
+磁盘响应缓存（内容寻址 + LRU）
+
+同一张图片、同一个模型 / 音色 / 提示词得到的点评基本相同，但每次上传都会完整调用一次
+带音频输出的全模态模型（演示用的固定样图反复提交时尤其浪费配额，首包也要几秒）。
+这里按 (图片内容哈希, 模型, 音色, 提示词版本) 缓存一次完整响应:
+    - 文本 + 按原样切好的 PCM 块（每块在 .pcm 文件中的长度）+ 每块相对第一块的发出时间
+    - 命中时用 mmap 读取 PCM，按原来的块大小和节奏重放（第一块立即发出，之后按原间隔），
+      客户端的播放队列和未命中时的行为一致
+    - 只缓存完整结束的响应（上游出错、客户端中途断开的不缓存）
+    - 写入先写临时文件再 rename，多个 worker 共用同一目录也不会读到半个文件
+    - 总大小超过 RESPONSE_CACHE_MAX_BYTES 时删除最久未命中的条目（按文件 mtime，命中时更新）
+
+配置（环境变量）:
+    RESPONSE_CACHE_ENABLED     是否启用（默认 true）
+    RESPONSE_CACHE_DIR         缓存目录（默认 data/response_cache）
+    RESPONSE_CACHE_MAX_BYTES   缓存总大小上限（默认 256MB）
+    RESPONSE_CACHE_PACED       命中时是否按原节奏重放（默认 true；false 时一次性发出全部块）
+
+示例:
+    key = cache.make_key(image_data, MODEL, 'Cherry', PROMPT)
+    cached = cache.get(key)
+    if cached:
+        for pcm in cached.replay():
+            yield add_wav_header(pcm)
+    else:
+        writer = cache.writer(key)
+
+        def generate():
+            for pcm in live_chunks():
+                writer.add_chunk(pcm)
+                yield add_wav_header(pcm)
+            writer.commit(text)
+
+        return Response(writer.guard(generate()))
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR', 'data/response_cache')
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+RESPONSE_CACHE_PACED = os.getenv('RESPONSE_CACHE_PACED', 'true').lower() in ('1', 'true', 'yes')
+
+
+class CachedResponse:
+    """一条缓存的响应：text、chunk_sizes、offsets（每块相对第一块的发出时间，秒）"""
+
+    def __init__(self, file, meta):
+        self._file = file
+        self.text = meta['text']
+        self.chunk_sizes = meta['chunk_sizes']
+        self.offsets = meta['offsets']
+
+    def replay(self, paced=RESPONSE_CACHE_PACED):
+        """按原来的块大小（和节奏）产出 PCM 块"""
+        with self._file as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                started = time.perf_counter()
+                position = 0
+                for size, offset in zip(self.chunk_sizes, self.offsets):
+                    if paced:
+                        delay = offset - (time.perf_counter() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+                    yield data[position:position + size]
+                    position += size
+
+
+class _CacheWriter:
+    """边生成边写入缓存；commit 之前的内容对读取方不可见"""
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+        self._tmp = os.path.join(cache.directory, f'.{key}.{uuid.uuid4().hex}.tmp')
+        # 第一块数据到达时才创建临时文件：响应体没被迭代时（客户端提前断开）不会留下 .tmp
+        self._file = None
+        self._sizes = []
+        self._offsets = []
+        self._started = None
+        self._finished = False
+
+    def add_chunk(self, pcm):
+        now = time.perf_counter()
+        if self._started is None:
+            self._started = now
+        if self._file is None:
+            if self._finished:
+                return
+            self._file = open(self._tmp, 'wb')
+        self._file.write(pcm)
+        self._sizes.append(len(pcm))
+        self._offsets.append(round(now - self._started, 3))
+
+    def commit(self, text):
+        """响应完整结束后调用，写入缓存"""
+        self._finished = True
+        if self._file is not None:
+            self._file.close()
+        if not self._sizes:
+            self.abort()
+            return
+        meta = {'text': text, 'chunk_sizes': self._sizes, 'offsets': self._offsets, 'created': time.time()}
+        self._cache._commit(self._key, self._tmp, meta)
+
+    def abort(self):
+        """响应未完整结束（出错 / 客户端断开），丢弃已写入的内容"""
+        self._finished = True
+        if self._file is None:
+            return
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.unlink(self._tmp)
+        except FileNotFoundError:
+            pass
+
+    def guard(self, chunks):
+        """包装响应生成器：生成器没有走到 commit 就结束（出错 / 客户端断开）时放弃写入"""
+        try:
+            yield from chunks
+        finally:
+            if not self._finished:
+                self.abort()
+
+    async def aguard(self, chunks):
+        """guard 的异步版本（chunks 为 async generator）"""
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            if not self._finished:
+                self.abort()
+
+
+class ResponseCache:
+    """
+    磁盘 LRU 响应缓存
+
+    参数:
+        directory: 缓存目录
+        max_bytes: 缓存总大小上限
+    """
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {key: bytes}，按最近使用排序
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._load_index()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.pcm', base + '.json'
+
+    def _load_index(self):
+        """启动时按 mtime 重建 LRU 顺序，并清理上次残留的临时文件"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.unlink(path)
+            elif name.endswith('.json'):
+                key = name[:-5]
+                pcm_path, meta_path = self._paths(key)
+                try:
+                    entries.append((os.path.getmtime(meta_path), key,
+                                    os.path.getsize(pcm_path) + os.path.getsize(meta_path)))
+                except OSError:
+                    continue
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+
+    @staticmethod
+    def make_key(content, *parts):
+        """
+        缓存键：内容（bytes / mmap）的 SHA-256 + 其他影响结果的参数（模型、音色、提示词等）
+
+        返回:
+            十六进制字符串
+        """
+        content_hash = hashlib.sha256(content).hexdigest()
+        return hashlib.sha256('\0'.join([content_hash, *map(str, parts)]).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        查找缓存
+
+        返回:
+            CachedResponse；未命中返回 None
+        """
+        pcm_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            # 先打开 PCM：之后即使条目被淘汰或替换，重放仍读取这一份
+            pcm_file = open(pcm_path, 'rb')
+            if os.fstat(pcm_file.fileno()).st_size != sum(meta['chunk_sizes']):
+                # 元数据和 PCM 不是同一次写入（另一个 worker 正在替换该条目）
+                pcm_file.close()
+                raise ValueError('缓存条目不完整')
+            os.utime(meta_path)  # 更新 LRU 顺序（其他 worker 重启后也能看到）
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self._stats['misses'] += 1
+                self._entries.pop(key, None)
+            return None
+
+        with self._lock:
+            self._stats['hits'] += 1
+            if key not in self._entries:
+                # 其他 worker 写入的条目
+                try:
+                    self._entries[key] = os.path.getsize(pcm_path) + os.path.getsize(meta_path)
+                except OSError:
+                    pass
+            else:
+                self._entries.move_to_end(key)
+        return CachedResponse(pcm_file, meta)
+
+    def writer(self, key):
+        """返回写入器：add_chunk(pcm) 逐块写入，commit(text) 完成，abort() 放弃"""
+        return _CacheWriter(self, key)
+
+    def _commit(self, key, tmp_path, meta):
+        pcm_path, meta_path = self._paths(key)
+        meta_tmp = f'{tmp_path[:-len(".tmp")]}.meta.tmp'
+        with open(meta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        # 先放 PCM 再放元数据：读取方以元数据存在作为条目完整的标志
+        os.replace(tmp_path, pcm_path)
+        os.replace(meta_tmp, meta_path)
+        size = os.path.getsize(pcm_path) + os.path.getsize(meta_path)
+
+        with self._lock:
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._stats['stores'] += 1
+            evicted = []
+            total = sum(self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                total -= old_size
+                evicted.append(old_key)
+            self._stats['evictions'] += len(evicted)
+
+        for old_key in evicted:
+            for path in reversed(self._paths(old_key)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def get_stats(self):
+        """返回命中 / 未命中 / 写入 / 淘汰次数、条目数和总大小"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=sum(self._entries.values()))
+        lookups = stats['hits'] + stats['misses']
+        stats.update(
+            hit_rate=stats['hits'] / lookups if lookups else None,
+            max_bytes=self.max_bytes,
+            directory=self.directory,
+            paced=RESPONSE_CACHE_PACED,
+        )
+        return stats
+
+
+def create_response_cache(subdir):
+    """
+    按环境变量创建响应缓存
+
+    参数:
+        subdir: RESPONSE_CACHE_DIR 下的子目录（每个接口一个）
+
+    返回:
+        ResponseCache；RESPONSE_CACHE_ENABLED 关闭时返回 None
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    cache = ResponseCache(os.path.join(RESPONSE_CACHE_DIR, subdir))
+    print(f'💾 响应缓存: {cache.directory}（{cache.get_stats()["entries"]} 条，上限 {cache.max_bytes // 1024 // 1024} MB）')
+    return cache
@@ -0,0 +1,398 @@
+"""
+{message, actions} 响应的增量流式解析器
+
+system_prompt.md 约定模型返回:
+    {"message": "给用户的文字说明", "actions": [操作数组]}
+
+ResponseStreamParser 逐 token 输入模型输出，一旦在语法上完整就产出事件:
+    ('message', 文本增量)   message 字段的新内容（已完成 JSON 反转义）
+    ('action', 操作字典)     actions 数组中的一个完整元素
+    ('end', None)            顶层对象结束，之后的内容（代码块结尾、多余文字）全部忽略
+
+兼容 ```json 代码块包裹；首个非空字符不是 '{' 或 '`' 时按纯文本处理，整段都作为 message。
+遇到非法转义（如 \\x、\\u 后不足 4 位十六进制）时停止解析，不再产出事件，failed 置为 True；
+parse_response 此时按纯文本返回原文。
+解析器只保留尚未完整的片段（当前转义序列、当前 action 元素等），不缓存整段响应。
+
+示例:
+    parser = ResponseStreamParser()
+    for delta in token_stream:
+        for kind, value in parser.feed(delta):
+            ...
+    message, actions = parser.result()
+"""
+
+import json
+import re
+
+
+# 字符串内需要特殊处理的字符
+_STRING_SPECIAL = re.compile(r'["\\]')
+# 字符串外影响嵌套结构的字符
+_VALUE_SPECIAL = re.compile(r'[\[\]{}",]')
+
+# 状态
+_PREAMBLE = 'preamble'   # 等待顶层 '{'（跳过代码块标记等前缀）
+_OBJECT = 'object'       # 顶层对象中，等待 key 或 '}'
+_KEY = 'key'             # 读取 key
+_COLON = 'colon'         # 等待 ':'
+_VALUE = 'value'         # 等待 value 的首字符
+_MESSAGE = 'message'     # 读取 message 字符串
+_ACTIONS = 'actions'     # actions 数组中，等待元素或 ']'
+_ELEMENT = 'element'     # 读取一个 action 元素
+_SKIP = 'skip'           # 跳过不关心的 value
+_DONE = 'done'           # 顶层对象已结束
+_PLAIN = 'plain'         # 非 JSON 响应
+_FAILED = 'failed'       # 遇到非法转义，停止解析
+
+
+class ResponseStreamParser:
+    """增量解析 {message, actions} 响应"""
+
+    def __init__(self):
+        self.message = ''       # 已解析出的 message
+        self.actions = []       # 已解析出的 actions
+        self.complete = False   # 顶层对象是否已完整结束
+        self.is_json = None     # None（还未确定）/ True / False
+        self.failed = False     # 是否因非法转义停止了解析
+
+        self._state = _PREAMBLE
+        self._buf = ''          # 尚未消费的输入
+        self._key = None        # 当前 value 所属的 key
+        self._capture = []      # 当前 action 元素的原始文本片段
+
+        # 通用 value 扫描状态
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    # ------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------
+
+    def feed(self, delta):
+        """输入一段文本，返回本次新产生的事件列表"""
+        if self._state is _DONE or self._state is _FAILED or not delta:
+            return []
+
+        if self._state is _PLAIN:
+            self.message += delta
+            return [('message', delta)]
+
+        self._buf += delta
+        events = []
+        try:
+            self._run(events)
+        except ValueError:
+            # key 中的非法转义（json.JSONDecodeError 是 ValueError 的子类）
+            self._fail()
+        return events
+
+    def result(self):
+        """
+        返回 (message, actions)
+
+        响应不是 JSON，或 JSON 中没有解析到 message 时，message 退化为整段原文
+        （仅当调用方通过 feed 输入过完整文本时有意义）
+        """
+        return self.message, self.actions
+
+    # ------------------------------------------------------------
+    # 状态机
+    # ------------------------------------------------------------
+
+    def _run(self, events):
+        buf = self._buf
+        i = 0
+        n = len(buf)
+
+        while i < n:
+            state = self._state
+
+            if state is _PREAMBLE:
+                if self.is_json is None:
+                    stripped_at = _skip_ws(buf, i)
+                    if stripped_at >= n:
+                        i = n
+                        break
+                    first = buf[stripped_at]
+                    if first not in '{`':
+                        # 纯文本响应：全部作为 message
+                        self.is_json = False
+                        self._state = _PLAIN
+                        text = buf[i:]
+                        self.message += text
+                        events.append(('message', text))
+                        i = n
+                        break
+                    self.is_json = True
+                brace = buf.find('{', i)
+                if brace < 0:
+                    i = n
+                    break
+                i = brace + 1
+                self._state = _OBJECT
+
+            elif state is _OBJECT:
+                i = _skip_ws_and_commas(buf, i)
+                if i >= n:
+                    break
+                ch = buf[i]
+                if ch == '"':
+                    self._state = _KEY
+                    i += 1
+                elif ch == '}':
+                    self._state = _DONE
+                    self.complete = True
+                    events.append(('end', None))
+                    i = n
+                    break
+                else:
+                    # 非法字符，跳过
+                    i += 1
+
+            elif state is _KEY:
+                end = _find_string_end(buf, i)
+                if end < 0:
+                    break
+                self._key = json.loads('"' + buf[i:end] + '"')
+                i = end + 1
+                self._state = _COLON
+
+            elif state is _COLON:
+                i = _skip_ws(buf, i)
+                if i >= n:
+                    break
+                if buf[i] == ':':
+                    i += 1
+                self._state = _VALUE
+
+            elif state is _VALUE:
+                i = _skip_ws(buf, i)
+                if i >= n:
+                    break
+                ch = buf[i]
+                if self._key == 'message' and ch == '"':
+                    self._state = _MESSAGE
+                    i += 1
+                elif self._key == 'actions' and ch == '[':
+                    self._state = _ACTIONS
+                    i += 1
+                else:
+                    self._state = _SKIP
+                    self._reset_scan()
+
+            elif state is _MESSAGE:
+                i = self._read_message(buf, i, events)
+                if self._state is _MESSAGE:
+                    break
+
+            elif state is _ACTIONS:
+                i = _skip_ws_and_commas(buf, i)
+                if i >= n:
+                    break
+                if buf[i] == ']':
+                    self._state = _OBJECT
+                    i += 1
+                else:
+                    self._state = _ELEMENT
+                    self._capture = []
+                    self._reset_scan()
+
+            elif state is _ELEMENT:
+                end = self._scan_value(buf, i)
+                if end < 0:
+                    self._capture.append(buf[i:])
+                    i = n
+                    break
+                self._capture.append(buf[i:end])
+                i = end
+                raw = ''.join(self._capture)
+                self._capture = []
+                self._state = _ACTIONS
+                try:
+                    action = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                self.actions.append(action)
+                events.append(('action', action))
+
+            elif state is _SKIP:
+                end = self._scan_value(buf, i)
+                if end < 0:
+                    i = n
+                    break
+                i = end
+                self._state = _OBJECT
+
+            else:
+                i = n
+                break
+
+        self._buf = buf[i:] if i < n else ''
+
+    def _read_message(self, buf, i, events):
+        """读取 message 字符串内容，返回新的消费位置"""
+        n = len(buf)
+        parts = []
+        while i < n:
+            m = _STRING_SPECIAL.search(buf, i)
+            if m is None:
+                parts.append(buf[i:])
+                i = n
+                break
+            j = m.start()
+            if j > i:
+                parts.append(buf[i:j])
+            if buf[j] == '"':
+                i = j + 1
+                self._state = _OBJECT
+                break
+
+            # 转义序列：不完整时等待更多输入
+            try:
+                length = _escape_length(buf, j)
+                if length < 0:
+                    i = j
+                    break
+                parts.append(json.loads('"' + buf[j:j + length] + '"'))
+            except ValueError:
+                # 非法转义：之前的内容照常产出，之后不再产出 message 增量
+                self._fail()
+                i = n
+                break
+            i = j + length
+
+        if parts:
+            text = ''.join(parts)
+            self.message += text
+            events.append(('message', text))
+        return i
+
+    def _fail(self):
+        self._state = _FAILED
+        self.failed = True
+        self._buf = ''
+        self._capture = []
+
+    def _reset_scan(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _scan_value(self, buf, i):
+        """
+        扫描一个 JSON value，返回其结束位置（不含分隔符）；value 尚不完整时返回 -1
+
+        扫描状态跨 feed 保留，已扫描过的内容不会重复扫描
+        """
+        n = len(buf)
+        while i < n:
+            if self._escape:
+                self._escape = False
+                i += 1
+                continue
+
+            if self._in_string:
+                m = _STRING_SPECIAL.search(buf, i)
+                if m is None:
+                    return -1
+                j = m.start()
+                if buf[j] == '\\':
+                    self._escape = True
+                    i = j + 1
+                    continue
+                self._in_string = False
+                i = j + 1
+                if self._depth == 0:
+                    return i
+                continue
+
+            m = _VALUE_SPECIAL.search(buf, i)
+            if m is None:
+                return -1
+            j = m.start()
+            ch = buf[j]
+            if ch == '"':
+                self._in_string = True
+                i = j + 1
+            elif ch == '{' or ch == '[':
+                self._depth += 1
+                i = j + 1
+            elif ch == '}' or ch == ']':
+                if self._depth == 0:
+                    # 标量值结束，分隔符属于外层
+                    return j
+                self._depth -= 1
+                i = j + 1
+                if self._depth == 0:
+                    return i
+            else:  # ','
+                if self._depth == 0:
+                    return j
+                i = j + 1
+        return -1
+
+
+def _skip_ws(buf, i):
+    n = len(buf)
+    while i < n and buf[i] in ' \t\r\n':
+        i += 1
+    return i
+
+
+def _skip_ws_and_commas(buf, i):
+    n = len(buf)
+    while i < n and buf[i] in ' \t\r\n,':
+        i += 1
+    return i
+
+
+def _find_string_end(buf, i):
+    """返回字符串结束引号的位置，未结束时返回 -1"""
+    n = len(buf)
+    while i < n:
+        m = _STRING_SPECIAL.search(buf, i)
+        if m is None:
+            return -1
+        j = m.start()
+        if buf[j] == '"':
+            return j
+        i = j + 2
+    return -1
+
+
+def _escape_length(buf, j):
+    """返回从 buf[j]（反斜杠）开始的完整转义序列长度，不完整时返回 -1"""
+    n = len(buf)
+    if j + 1 >= n:
+        return -1
+    if buf[j + 1] != 'u':
+        return 2
+    if j + 6 > n:
+        return -1
+    # UTF-16 代理对（如 emoji）需要连同低位一起解码
+    if 0xD800 <= int(buf[j + 2:j + 6], 16) <= 0xDBFF:
+        if j + 12 > n:
+            return -1
+        return 12
+    return 6
+
+
+def parse_response(text):
+    """
+    解析完整的模型响应
+
+    返回:
+        (message, actions, is_json)：无法解析出 message 或遇到非法转义时 message 为原文本
+    """
+    parser = ResponseStreamParser()
+    parser.feed(text)
+    if parser.failed:
+        return text, [], False
+    message, actions = parser.result()
+    if parser.is_json and not parser.complete and not message:
+        return text, actions, False
+    if parser.is_json and not message and not actions:
+        return text, actions, parser.complete
+    return message, actions, bool(parser.is_json)
@@ -0,0 +1,614 @@
+"""
+会话历史存储（有界、线程安全）
+
+原来 app.py / app_agent.py 各自用一个只增不减的 dict 保存对话历史，出现过的 session_id
+永远不会被清理，进程内存随运行时间持续增长。这里统一实现:
+    - 最多保留 SESSION_MAX_COUNT 个会话，超出时淘汰最久未访问的（LRU）
+    - 空闲超过 SESSION_TTL 秒的会话过期删除（访问时顺带清理，并定期全量清理）
+    - 每个会话最多保留 SESSION_MAX_HISTORY 条消息
+    - 按 session_id 哈希分成 SESSION_LOCK_STRIPES 个分段，每段一把锁，不同会话的读写互不阻塞
+      （LRU 在分段内进行，每段容量为总容量 / 分段数）
+    - 每个会话可以附带一段滚动摘要（summary），compact 把已被摘要覆盖的最早几条消息删除（见 history_window）
+    - get_stats 返回会话数、消息数、估算内存占用和淘汰次数
+
+多个 worker 进程（如 gunicorn -w 4）时内存存储无法共享，同一用户的下一轮可能落到没见过该会话的
+worker 上。SESSION_BACKEND=sqlite 时改用本地 SQLite（WAL 模式，多进程可同时读、串行写，无需外部服务）:
+    - 写入：后台写线程把同时到达的追加合并到一个事务提交（group commit），append 在提交后返回
+    - 读取：按 (session_id, id) 索引读取；每个 worker 有一个小的 LRU 缓存，
+      读取时只查一次 sessions 表的 version（= 会话最后一条消息的 id，主键查询），未变化时直接用缓存；
+      本 worker 的写入提交后直接更新缓存（期间没有其他进程写入该会话时），下一轮读取不必回表
+    - 过期 / 超量会话由写线程定期清理
+
+配置（环境变量）:
+    SESSION_BACKEND         memory（默认）/ sqlite
+    SESSION_MAX_COUNT       最大会话数（默认 10000）
+    SESSION_TTL             会话空闲过期时间（秒，默认 3600，0 表示不过期）
+    SESSION_MAX_HISTORY     每个会话保留的消息数（默认 20）
+    SESSION_LOCK_STRIPES    锁分段数（默认 16，memory）
+    SESSION_DB_PATH         SQLite 数据库文件（默认 data/sessions.db，sqlite）
+    SESSION_CACHE_SIZE      每个 worker 的读缓存会话数（默认 256，sqlite）
+    SESSION_BATCH_SIZE      单个事务最多合并的写操作数（默认 64，sqlite）
+
+示例:
+    store = create_session_store()
+    history = store.get_history(session_id)        # 返回副本
+    store.append(session_id, {'role': 'user', 'content': '...'}, {'role': 'assistant', 'content': '...'})
+    summary, history = store.get_context(session_id)
+    store.compact(session_id, new_summary, history[:4])
+"""
+
+import json
+import math
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', '10000'))
+SESSION_TTL = float(os.getenv('SESSION_TTL', '3600'))
+SESSION_MAX_HISTORY = int(os.getenv('SESSION_MAX_HISTORY', '20'))
+SESSION_LOCK_STRIPES = int(os.getenv('SESSION_LOCK_STRIPES', '16'))
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory').lower()
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'data/sessions.db')
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '256'))
+SESSION_BATCH_SIZE = int(os.getenv('SESSION_BATCH_SIZE', '64'))
+
+# 全量清理过期会话的最小间隔（秒）
+_SWEEP_INTERVAL = 60
+
+
+def _message_size(message):
+    """估算一条消息占用的内存（字节）"""
+    content = message.get('content')
+    size = sys.getsizeof(message)
+    if isinstance(content, str):
+        size += sys.getsizeof(content)
+    elif isinstance(content, list):
+        size += sum(sys.getsizeof(part.get('text', '')) for part in content if isinstance(part, dict))
+    return size
+
+
+class _Session:
+    __slots__ = ('messages', 'summary', 'size', 'last_access', 'updated_at')
+
+    def __init__(self, max_history):
+        self.messages = deque(maxlen=max_history)
+        self.summary = None
+        self.size = 0
+        self.last_access = time.monotonic()
+        self.updated_at = time.time()
+
+
+class _Stripe:
+    __slots__ = ('lock', 'sessions')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # 按最近访问排序，最久未访问的在最前
+
+
+class MemorySessionStore:
+    """
+    内存会话存储
+
+    参数:
+        max_sessions: 最大会话数
+        ttl: 空闲过期时间（秒，0 表示不过期）
+        max_history: 每个会话保留的消息数
+        stripes: 锁分段数
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX_COUNT, ttl=SESSION_TTL,
+                 max_history=SESSION_MAX_HISTORY, stripes=SESSION_LOCK_STRIPES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_history = max_history
+        self._stripes = [_Stripe() for _ in range(max(1, stripes))]
+        self._stripe_capacity = max(1, math.ceil(max_sessions / len(self._stripes)))
+
+        self._stats_lock = threading.Lock()
+        self._evicted_lru = 0
+        self._evicted_ttl = 0
+        self._last_sweep = time.monotonic()
+
+    def _stripe(self, session_id):
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    def _count_evictions(self, lru=0, ttl=0):
+        if lru or ttl:
+            with self._stats_lock:
+                self._evicted_lru += lru
+                self._evicted_ttl += ttl
+
+    def _expire(self, stripe, now):
+        """删除分段内过期的会话（调用方持有 stripe.lock），返回删除数"""
+        if not self.ttl:
+            return 0
+        expired = 0
+        while stripe.sessions:
+            session = next(iter(stripe.sessions.values()))
+            if now - session.last_access <= self.ttl:
+                break
+            stripe.sessions.popitem(last=False)
+            expired += 1
+        return expired
+
+    def _maybe_sweep(self, now):
+        if not self.ttl or now - self._last_sweep < _SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        self.sweep()
+
+    def sweep(self):
+        """清理所有分段中的过期会话，返回删除数"""
+        now = time.monotonic()
+        expired = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                expired += self._expire(stripe, now)
+        self._count_evictions(ttl=expired)
+        return expired
+
+    def get_context(self, session_id):
+        """返回 (摘要或 None, 会话历史副本)；会话不存在时返回 (None, [])，不会创建会话"""
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            expired = self._expire(stripe, now)
+            session = stripe.sessions.get(session_id)
+            if session is not None:
+                session.last_access = now
+                stripe.sessions.move_to_end(session_id)
+                context = (session.summary, list(session.messages))
+            else:
+                context = (None, [])
+        self._count_evictions(ttl=expired)
+        return context
+
+    def get_history(self, session_id):
+        """返回会话历史的副本（会话不存在时返回空列表，不会创建会话）"""
+        return self.get_context(session_id)[1]
+
+    def compact(self, session_id, summary, covered):
+        """
+        用摘要替换最早的几条消息
+
+        参数:
+            summary: 新摘要（应已包含旧摘要的内容）
+            covered: 摘要覆盖的消息，必须仍是会话最早的 len(covered) 条
+
+        返回:
+            是否成功（期间会话被清空、淘汰或最早的消息已变化时返回 False）
+        """
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = stripe.sessions.get(session_id)
+            if session is None or list(session.messages)[:len(covered)] != list(covered):
+                return False
+            for _ in covered:
+                session.size -= _message_size(session.messages.popleft())
+            if session.summary:
+                session.size -= sys.getsizeof(session.summary)
+            session.summary = summary
+            session.size += sys.getsizeof(summary)
+            return True
+
+    def append(self, session_id, *messages):
+        """
+        追加消息（同一次调用的多条消息原子写入，超出 max_history 时丢弃最早的）
+
+        返回:
+            会话当前消息数
+        """
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        stripe = self._stripe(session_id)
+        evicted = 0
+        with stripe.lock:
+            expired = self._expire(stripe, now)
+            session = stripe.sessions.get(session_id)
+            if session is None:
+                session = stripe.sessions[session_id] = _Session(self.max_history)
+                while len(stripe.sessions) > self._stripe_capacity:
+                    stripe.sessions.popitem(last=False)
+                    evicted += 1
+            else:
+                stripe.sessions.move_to_end(session_id)
+
+            for message in messages:
+                if len(session.messages) == session.messages.maxlen:
+                    session.size -= _message_size(session.messages[0])
+                session.messages.append(message)
+                session.size += _message_size(message)
+            session.last_access = now
+            session.updated_at = time.time()
+            count = len(session.messages)
+        self._count_evictions(lru=evicted, ttl=expired)
+        return count
+
+    def clear(self, session_id):
+        """清空会话（删除该会话）"""
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            stripe.sessions.pop(session_id, None)
+
+    def sessions(self):
+        """返回所有未过期会话的概要 [{'session_id', 'message_count', 'last_update'}]"""
+        self.sweep()
+        result = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                for session_id, session in stripe.sessions.items():
+                    result.append({
+                        'session_id': session_id,
+                        'message_count': len(session.messages),
+                        'last_update': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(session.updated_at)),
+                    })
+        return result
+
+    def get_stats(self):
+        """返回会话数、消息数、估算内存占用（字节）和淘汰次数"""
+        self.sweep()
+        sessions = messages = size = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                sessions += len(stripe.sessions)
+                for session in stripe.sessions.values():
+                    messages += len(session.messages)
+                    size += session.size
+        with self._stats_lock:
+            evicted_lru, evicted_ttl = self._evicted_lru, self._evicted_ttl
+        return {
+            'backend': 'memory',
+            'sessions': sessions,
+            'messages': messages,
+            'approx_bytes': size,
+            'evicted_lru': evicted_lru,
+            'evicted_ttl': evicted_ttl,
+            'max_sessions': self.max_sessions,
+            'ttl': self.ttl,
+            'max_history': self.max_history,
+        }
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+"""
+
+
+class SQLiteSessionStore:
+    """
+    SQLite（WAL）会话存储，多个 worker 进程共享同一个数据库文件
+
+    参数:
+        path: 数据库文件路径
+        max_sessions / ttl / max_history: 同 MemorySessionStore
+        cache_size: 每个 worker 的读缓存会话数
+        batch_size: 单个事务最多合并的写操作数
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, max_sessions=SESSION_MAX_COUNT, ttl=SESSION_TTL,
+                 max_history=SESSION_MAX_HISTORY, cache_size=SESSION_CACHE_SIZE,
+                 batch_size=SESSION_BATCH_SIZE):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_history = max_history
+        self.cache_size = cache_size
+        self.batch_size = max(1, batch_size)
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(sessions)')]
+        if 'summary' not in columns:
+            conn.execute('ALTER TABLE sessions ADD COLUMN summary TEXT')
+        conn.close()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'cache_hits': 0, 'cache_misses': 0, 'batches': 0, 'batched_ops': 0,
+                       'evicted_lru': 0, 'evicted_ttl': 0}
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        # fork 之后（如 gunicorn --preload）线程和连接都不能沿用，按进程重新创建
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._cache_lock = threading.Lock()
+        self._cache = OrderedDict()  # {session_id: (version, summary, messages)}
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            self._reset_process_state()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _incr(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    # ---------- 写入（group commit） ----------
+
+    def _submit(self, op, session_id, messages=()):
+        self._check_pid()
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name='session-writer', daemon=True)
+                self._writer.start()
+        future = Future()
+        self._queue.put((op, session_id, messages, future))
+        return future.result()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                results = [self._apply(conn, op, session_id, messages) for op, session_id, messages, _ in batch]
+                conn.execute('COMMIT')
+            except Exception as e:
+                # 整批回滚，同批的调用方都收到异常
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self._incr('batches')
+            self._incr('batched_ops', len(batch))
+            for (op, session_id, messages, future), result in zip(batch, results):
+                if op == 'append':
+                    count, previous_version, version = result
+                    self._cache_append(session_id, previous_version, version, messages)
+                    future.set_result(count)
+                else:
+                    # clear / compact 很少发生，直接作废缓存
+                    self._invalidate(session_id)
+                    future.set_result(result)
+            self._maybe_sweep(conn)
+
+    def _apply(self, conn, op, session_id, messages):
+        if op == 'clear':
+            conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            return 0
+        if op == 'compact':
+            return self._apply_compact(conn, session_id, *messages)
+
+        row = conn.execute('SELECT version FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        previous_version = row[0] if row else None
+        conn.executemany(
+            'INSERT INTO messages (session_id, message) VALUES (?, ?)',
+            [(session_id, json.dumps(message, ensure_ascii=False)) for message in messages]
+        )
+        # AUTOINCREMENT 的 id 不会复用，最后一条消息的 id 可以唯一标识会话当前内容
+        version = conn.execute('SELECT MAX(id) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+        # 只保留最近 max_history 条
+        conn.execute(
+            'DELETE FROM messages WHERE session_id = ? AND id <= ('
+            'SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+            (session_id, session_id, self.max_history)
+        )
+        count = conn.execute('SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+        conn.execute(
+            'INSERT INTO sessions (session_id, version, message_count, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(session_id) DO UPDATE SET version = excluded.version, '
+            'message_count = excluded.message_count, updated_at = excluded.updated_at',
+            (session_id, version, count, time.time())
+        )
+        return count, previous_version, version
+
+    def _apply_compact(self, conn, session_id, summary, covered):
+        rows = conn.execute(
+            'SELECT message FROM messages WHERE session_id = ? ORDER BY id', (session_id,)
+        ).fetchall()
+        history = [json.loads(message) for (message,) in rows]
+        remaining = history[len(covered):]
+        if not remaining or history[:len(covered)] != list(covered):
+            return False
+
+        # 剩余消息重新插入，获得新的 id，version（最后一条消息的 id）随之变化，其他 worker 的缓存会失效
+        conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+        conn.executemany(
+            'INSERT INTO messages (session_id, message) VALUES (?, ?)',
+            [(session_id, json.dumps(message, ensure_ascii=False)) for message in remaining]
+        )
+        version = conn.execute('SELECT MAX(id) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+        conn.execute(
+            'UPDATE sessions SET version = ?, message_count = ?, summary = ? WHERE session_id = ?',
+            (version, len(remaining), summary, session_id)
+        )
+        return True
+
+    def _delete_sessions(self, conn, where, params):
+        ids = [row[0] for row in conn.execute(f'SELECT session_id FROM sessions WHERE {where}', params)]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            conn.execute(f'DELETE FROM messages WHERE session_id IN ({marks})', chunk)
+            conn.execute(f'DELETE FROM sessions WHERE session_id IN ({marks})', chunk)
+        for session_id in ids:
+            self._invalidate(session_id)
+        return len(ids)
+
+    def _maybe_sweep(self, conn):
+        now = time.time()
+        if now - self._last_sweep < _SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            expired = self._delete_sessions(conn, 'updated_at < ?', (now - self.ttl,)) if self.ttl else 0
+            overflow = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] - self.max_sessions
+            evicted = self._delete_sessions(
+                conn, 'session_id IN (SELECT session_id FROM sessions ORDER BY updated_at LIMIT ?)', (overflow,)
+            ) if overflow > 0 else 0
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            print(f'⚠️ 会话清理失败: {e}')
+            return
+        self._incr('evicted_ttl', expired)
+        self._incr('evicted_lru', evicted)
+
+    # ---------- 读取（read-through 缓存） ----------
+
+    def _invalidate(self, session_id):
+        with self._cache_lock:
+            self._cache.pop(session_id, None)
+
+    def _cache_append(self, session_id, previous_version, version, messages):
+        """写入提交后更新缓存；缓存的不是写入前的版本（其他进程也写过）时作废"""
+        with self._cache_lock:
+            cached = self._cache.get(session_id)
+            if previous_version is None:
+                summary, history = None, list(messages)
+            elif cached and cached[0] == previous_version:
+                summary, history = cached[1], cached[2] + list(messages)
+            else:
+                self._cache.pop(session_id, None)
+                return
+            self._cache[session_id] = (version, summary, history[-self.max_history:])
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get_context(self, session_id):
+        """返回 (摘要或 None, 会话历史副本)；会话不存在或已过期时返回 (None, [])"""
+        self._check_pid()
+        conn = self._reader()
+        row = conn.execute(
+            'SELECT version, updated_at, summary FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            return None, []
+
+        version, _, summary = row
+        with self._cache_lock:
+            cached = self._cache.get(session_id)
+            if cached and cached[0] == version:
+                self._cache.move_to_end(session_id)
+                self._incr('cache_hits')
+                return cached[1], list(cached[2])
+
+        self._incr('cache_misses')
+        messages = [json.loads(message) for (message,) in conn.execute(
+            'SELECT message FROM messages WHERE session_id = ? ORDER BY id', (session_id,)
+        )]
+        with self._cache_lock:
+            self._cache[session_id] = (version, summary, messages)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return summary, list(messages)
+
+    def get_history(self, session_id):
+        """返回会话历史的副本（会话不存在或已过期时返回空列表）"""
+        return self.get_context(session_id)[1]
+
+    def compact(self, session_id, summary, covered):
+        """用摘要替换最早的几条消息（参数和返回值同 MemorySessionStore.compact）"""
+        return self._submit('compact', session_id, (summary, list(covered)))
+
+    def append(self, session_id, *messages):
+        """追加消息（同一次调用的多条消息在同一事务中写入），提交后返回会话当前消息数"""
+        return self._submit('append', session_id, messages)
+
+    def clear(self, session_id):
+        """清空会话（删除该会话）"""
+        self._submit('clear', session_id)
+
+    def sessions(self):
+        """返回所有未过期会话的概要 [{'session_id', 'message_count', 'last_update'}]"""
+        self._check_pid()
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        rows = self._reader().execute(
+            'SELECT session_id, message_count, updated_at FROM sessions WHERE updated_at >= ? '
+            'ORDER BY updated_at DESC', (cutoff,)
+        ).fetchall()
+        return [{
+            'session_id': session_id,
+            'message_count': message_count,
+            'last_update': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(updated_at)),
+        } for session_id, message_count, updated_at in rows]
+
+    def get_stats(self):
+        """返回会话数、消息数、数据库大小、本 worker 的缓存命中和批量写入统计"""
+        self._check_pid()
+        conn = self._reader()
+        sessions, messages = conn.execute('SELECT COUNT(*), COALESCE(SUM(message_count), 0) FROM sessions').fetchone()
+        db_bytes = sum(os.path.getsize(self.path + suffix) for suffix in ('', '-wal')
+                       if os.path.exists(self.path + suffix))
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._cache_lock:
+            cached = len(self._cache)
+            cache_bytes = sum(_message_size(m) for _, _, msgs in self._cache.values() for m in msgs)
+        lookups = stats['cache_hits'] + stats['cache_misses']
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'sessions': sessions,
+            'messages': messages,
+            'approx_bytes': cache_bytes,
+            'db_bytes': db_bytes,
+            'cached_sessions': cached,
+            'cache_hit_rate': stats['cache_hits'] / lookups if lookups else None,
+            'avg_batch_size': stats['batched_ops'] / stats['batches'] if stats['batches'] else None,
+            'batches': stats['batches'],
+            'evicted_lru': stats['evicted_lru'],
+            'evicted_ttl': stats['evicted_ttl'],
+            'max_sessions': self.max_sessions,
+            'ttl': self.ttl,
+            'max_history': self.max_history,
+        }
+
+
+def create_session_store():
+    """按环境变量 SESSION_BACKEND 创建会话存储（memory / sqlite）"""
+    if SESSION_BACKEND == 'sqlite':
+        print(f'💾 会话存储: SQLite ({SESSION_DB_PATH})')
+        return SQLiteSessionStore()
+    return MemorySessionStore()
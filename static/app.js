@@ -1,5 +1,6 @@
 // 导入数字人组件（从本地克隆的仓库）
 import { DigitalHuman, parseAudioStream } from '../digital-human-component/src/index.js';
+import { audioAccept, isFrameStream, readFrameStream } from './stream_protocol.js';
 
 // 全局变量
 let mediaRecorder;
@@ -176,6 +177,12 @@ async function initCamera() {
     }
 }
 
+// 选择录制格式：优先 H.264（服务端只需换封装，无需重新编码），不支持时退回 VP8
+function pickVideoMimeType() {
+    const candidates = ['video/webm;codecs=h264,opus', 'video/webm;codecs=vp8,opus'];
+    return candidates.find(type => MediaRecorder.isTypeSupported(type)) || 'video/webm';
+}
+
 // 开始录制
 function startRecording() {
     try {
@@ -183,7 +190,7 @@ function startRecording() {
         const stream = videoPreview.srcObject;
 
         mediaRecorder = new MediaRecorder(stream, {
-            mimeType: 'video/webm;codecs=vp8,opus'
+            mimeType: pickVideoMimeType()
         });
 
         mediaRecorder.ondataavailable = (event) => {
@@ -333,6 +340,8 @@ async function sendAudio() {
 
         const formData = new FormData();
         formData.append('audio', blob, 'recording.webm');
+        formData.append('protocol', '2');  // 类型化帧协议（服务端不支持时返回原格式）
+        formData.append('audio_accept', await audioAccept());  // 可解码的压缩音频格式（Opus / MP3）
 
         showStatus('正在上传并处理...', 'info');
         addChatMessage('user', '(已发送音频)');
@@ -370,8 +379,10 @@ async function sendAudio() {
             }
         }
 
-        // ✅ 使用 parseAudioStream 包装，解决 HTTP 分块问题
-        const parsedStream = parseAudioStream(rawAudioStream());
+        // v2：按帧解析，音频帧为裸 PCM；旧格式：使用 parseAudioStream 包装，解决 HTTP 分块问题
+        const parsedStream = isFrameStream(response)
+            ? readFrameStream(response, frameStreamHandlers())
+            : parseAudioStream(rawAudioStream());
 
         // 使用数字人的流式播放功能
         if (avatar) {
@@ -398,6 +409,24 @@ async function sendAudio() {
     }
 }
 
+/**
+ * v2 帧协议的默认回调：记录文本 / actions / 统计，服务端报错时显示在状态栏
+ */
+function frameStreamHandlers(overrides = {}) {
+    return {
+        onMetadata: (metadata) => console.log('📋 收到元数据:', metadata),
+        onText: (delta) => console.log('📝 文本:', delta),
+        onActions: (actions) => actions.forEach(action => console.log(`  ✅ Action: ${action.type}`, action)),
+        onFiller: (text) => console.log('🗨️ 垫话:', text),
+        onError: ({ error, stage }) => {
+            console.error(`❌ 服务端错误（${stage}）:`, error);
+            showStatus('处理失败: ' + error, 'error');
+        },
+        onStats: (stats) => console.log('📊 响应统计:', stats),
+        ...overrides
+    };
+}
+
 // 事件监听
 requestCameraBtn.addEventListener('click', initCamera);
 
@@ -498,6 +527,8 @@ async function sendImageForCommentary(imageFile) {
         // 准备表单数据
         const formData = new FormData();
         formData.append('image', imageFile);
+        formData.append('protocol', '2');  // 类型化帧协议（服务端不支持时返回原格式）
+        formData.append('audio_accept', await audioAccept());  // 可解码的压缩音频格式（Opus / MP3）
 
         // 发送请求（流式接口）
         const response = await fetch('/api/image-commentary-streaming', {
@@ -521,8 +552,10 @@ async function sendImageForCommentary(imageFile) {
             }
         }
 
-        // ✅ 使用 parseAudioStream 包装，解决 HTTP 分块问题
-        const parsedStream = parseAudioStream(rawAudioStream());
+        // v2：按帧解析，音频帧为裸 PCM；旧格式：使用 parseAudioStream 包装，解决 HTTP 分块问题
+        const parsedStream = isFrameStream(response)
+            ? readFrameStream(response, frameStreamHandlers())
+            : parseAudioStream(rawAudioStream());
 
         // 使用流式播放
         const controller = await avatar.speakStreaming({
@@ -684,6 +717,8 @@ async function handleVideoCapture(videoGroups) {
         // 添加会话 ID 和学生 ID
         formData.append('session_id', currentSessionId);
         formData.append('student_id', 'student_001');  // 默认学生 ID，后续可改为动态选择
+        formData.append('protocol', '2');  // 类型化帧协议（服务端不支持时返回原格式）
+        formData.append('audio_accept', await audioAccept());  // 可解码的压缩音频格式（Opus / MP3）
         console.log('🔑 [DEBUG] 会话 ID:', currentSessionId);
         console.log('👤 [DEBUG] 学生 ID: student_001');
 
@@ -781,8 +816,22 @@ async function handleVideoCapture(videoGroups) {
             }
         }
 
-        // 使用 parseAudioStream 包装，解决 HTTP 分块问题
-        const parsedStream = parseAudioStream(rawAudioStream());
+        // v2：元数据、actions、错误都是独立的帧；旧格式：使用 parseAudioStream 包装，解决 HTTP 分块问题
+        const parsedStream = isFrameStream(response)
+            ? readFrameStream(response, frameStreamHandlers({
+                onMetadata: (metadata) => {
+                    console.log('📋 [INFO] 收到元数据:', metadata);
+                    if (metadata.message) {
+                        addChatMessage('avatar', metadata.message);
+                        showStatus('数字人正在说话...', 'success');
+                    }
+                    (metadata.actions || []).forEach(action => {
+                        console.log(`  ✅ Action: ${action.type}`, action);
+                        // TODO: 根据 action.type 执行相应操作
+                    });
+                }
+            }))
+            : parseAudioStream(rawAudioStream());
 
         // 使用数字人的流式播放功能
         if (avatar) {
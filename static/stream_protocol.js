@@ -0,0 +1,353 @@
+// 流式响应协议 v2 解析器（格式见 stream_protocol.py）
+//
+// 请求时带上 protocol=2（表单字段）；服务端支持时响应头带 X-Stream-Protocol: 2，
+// 响应体为 b'DHF\x02' 前导 + [1字节类型][4字节长度][负载] 帧。
+// readFrameStream 把 AUDIO 帧（裸 PCM）补上 WAV 头后逐个产出，可以直接交给 avatar.speakStreaming，
+// 其他帧通过回调通知。服务端不支持 v2 时调用方继续使用原来的 parseAudioStream。
+//
+// 请求时再带上 audio_accept（见 audioAccept()）可以让服务端发送 Opus / MP3 压缩音频（见 audio_encoder.py），
+// 此时 AUDIO 帧为 [2字节长度][编码包]...，用 WebCodecs AudioDecoder 解码成 PCM 后同样产出 WAV。
+
+export const STREAM_PROTOCOL_VERSION = 2;
+
+const PREAMBLE = [0x44, 0x48, 0x46, STREAM_PROTOCOL_VERSION];  // 'DHF' + 版本号
+const FRAME_HEADER_SIZE = 5;
+
+export const FrameType = {
+    METADATA: 0x01,
+    TEXT: 0x02,
+    ACTIONS: 0x03,
+    AUDIO: 0x04,
+    END: 0x05,
+    ERROR: 0x06,
+    STATS: 0x07,
+    FILLER: 0x08
+};
+
+/**
+ * 响应是否为 v2 帧格式
+ */
+export function isFrameStream(response) {
+    return response.headers.get('X-Stream-Protocol') === String(STREAM_PROTOCOL_VERSION);
+}
+
+/**
+ * 增量帧解析器
+ *
+ * push(chunk) 输入任意切分的网络数据，返回其中已完整的帧 { type, payload }。
+ * payload 是内部缓冲区的视图，只在下一次 push 之前有效（需要保留时自行复制）。
+ * 缓冲区按需翻倍扩容并复用，不会每收到一个片段就重新拼接全部数据。
+ */
+export class FrameParser {
+    constructor(initialCapacity = 64 * 1024) {
+        this.buffer = new Uint8Array(initialCapacity);
+        this.start = 0;
+        this.end = 0;
+        this.preambleChecked = false;
+    }
+
+    _reserve(size) {
+        const pending = this.end - this.start;
+        if (this.end + size <= this.buffer.length) {
+            return;
+        }
+        if (pending + size <= this.buffer.length) {
+            // 空间够用，把未处理的数据移到开头
+            this.buffer.copyWithin(0, this.start, this.end);
+        } else {
+            let capacity = this.buffer.length * 2;
+            while (capacity < pending + size) {
+                capacity *= 2;
+            }
+            const buffer = new Uint8Array(capacity);
+            buffer.set(this.buffer.subarray(this.start, this.end));
+            this.buffer = buffer;
+        }
+        this.start = 0;
+        this.end = pending;
+    }
+
+    push(chunk) {
+        const bytes = chunk instanceof Uint8Array ? chunk : new Uint8Array(chunk);
+        this._reserve(bytes.length);
+        this.buffer.set(bytes, this.end);
+        this.end += bytes.length;
+
+        if (!this.preambleChecked) {
+            if (this.end - this.start < PREAMBLE.length) {
+                return [];
+            }
+            PREAMBLE.forEach((value, i) => {
+                if (this.buffer[this.start + i] !== value) {
+                    throw new Error('不是 v2 帧格式的响应');
+                }
+            });
+            this.start += PREAMBLE.length;
+            this.preambleChecked = true;
+        }
+
+        const frames = [];
+        const view = new DataView(this.buffer.buffer);
+        while (this.end - this.start >= FRAME_HEADER_SIZE) {
+            const type = this.buffer[this.start];
+            const length = view.getUint32(this.start + 1);  // big-endian
+            const payloadStart = this.start + FRAME_HEADER_SIZE;
+            if (this.end - payloadStart < length) {
+                break;
+            }
+            frames.push({ type, payload: this.buffer.subarray(payloadStart, payloadStart + length) });
+            this.start = payloadStart + length;
+        }
+        return frames;
+    }
+
+    /** 流结束时是否还有不完整的帧 */
+    get pending() {
+        return this.end - this.start;
+    }
+}
+
+/**
+ * 给 PCM 加上 44 字节 WAV 头（一次分配，直接从帧负载复制）
+ */
+export function pcmToWav(pcm, { sample_rate = 24000, channels = 1 } = {}) {
+    const wav = new ArrayBuffer(44 + pcm.byteLength);
+    const view = new DataView(wav);
+    const writeString = (offset, text) => {
+        for (let i = 0; i < text.length; i++) {
+            view.setUint8(offset + i, text.charCodeAt(i));
+        }
+    };
+    writeString(0, 'RIFF');
+    view.setUint32(4, 36 + pcm.byteLength, true);
+    writeString(8, 'WAVE');
+    writeString(12, 'fmt ');
+    view.setUint32(16, 16, true);
+    view.setUint16(20, 1, true);                          // PCM
+    view.setUint16(22, channels, true);
+    view.setUint32(24, sample_rate, true);
+    view.setUint32(28, sample_rate * channels * 2, true); // byte rate
+    view.setUint16(32, channels * 2, true);               // block align
+    view.setUint16(34, 16, true);                         // bits per sample
+    writeString(36, 'data');
+    view.setUint32(40, pcm.byteLength, true);
+    new Uint8Array(wav, 44).set(pcm);
+    return wav;
+}
+
+/**
+ * 浏览器能解码的音频格式（audio_accept 表单字段的值），按压缩率排序；不支持 WebCodecs 时只接受 PCM
+ */
+let audioAcceptPromise = null;
+
+export function audioAccept() {
+    if (!audioAcceptPromise) {
+        audioAcceptPromise = detectAudioAccept();
+    }
+    return audioAcceptPromise;
+}
+
+async function detectAudioAccept() {
+    if (typeof AudioDecoder === 'undefined') {
+        return 'pcm';
+    }
+    const accepted = [];
+    for (const [codec, sampleRate] of [['opus', 48000], ['mp3', 24000]]) {
+        try {
+            const { supported } = await AudioDecoder.isConfigSupported({ codec, sampleRate, numberOfChannels: 1 });
+            if (supported) {
+                accepted.push(accepted.length ? `${codec};q=0.9` : codec);
+            }
+        } catch (error) {
+            // 不支持的格式
+        }
+    }
+    accepted.push('pcm;q=0.5');
+    return accepted.join(', ');
+}
+
+/**
+ * 压缩音频解码器：AUDIO 帧负载 → 16-bit PCM 的 WAV
+ *
+ * 解码器状态在整个响应中保持（Opus / MP3 帧之间有依赖），每个 AUDIO 帧产出此时已解码的部分，
+ * 剩余部分在 flush() 时产出。
+ */
+class CompressedAudioDecoder {
+    constructor(format) {
+        this.format = format;
+        this.frameDuration = (format.frame_ms || 20) * 1000;  // 微秒
+        this.timestamp = 0;
+        this.pieces = [];
+        this.sampleRate = format.sample_rate;
+        this.error = null;
+        this.decoder = new AudioDecoder({
+            output: (data) => {
+                this.sampleRate = data.sampleRate;
+                const samples = new Float32Array(data.numberOfFrames);
+                data.copyTo(samples, { planeIndex: 0, format: 'f32-planar' });  // 单声道
+                data.close();
+                const pcm = new Int16Array(samples.length);
+                for (let i = 0; i < samples.length; i++) {
+                    const value = Math.max(-1, Math.min(1, samples[i]));
+                    pcm[i] = value < 0 ? value * 0x8000 : value * 0x7fff;
+                }
+                this.pieces.push(pcm);
+            },
+            error: (error) => {
+                this.error = error;
+            }
+        });
+        this.decoder.configure({
+            codec: format.encoding,
+            sampleRate: format.sample_rate,
+            numberOfChannels: format.channels
+        });
+    }
+
+    /** 解码一个 AUDIO 帧的负载，返回已解码部分的 WAV（可能为 null） */
+    async decode(payload) {
+        const view = new DataView(payload.buffer, payload.byteOffset, payload.byteLength);
+        let offset = 0;
+        while (offset + 2 <= payload.byteLength) {
+            const length = view.getUint16(offset);  // big-endian
+            offset += 2;
+            // EncodedAudioChunk 会复制数据，payload 之后失效也没关系
+            this.decoder.decode(new EncodedAudioChunk({
+                type: 'key',
+                timestamp: this.timestamp,
+                duration: this.frameDuration,
+                data: payload.subarray(offset, offset + length)
+            }));
+            this.timestamp += this.frameDuration;
+            offset += length;
+        }
+        while (this.decoder.decodeQueueSize > 0) {
+            await new Promise(resolve => this.decoder.addEventListener('dequeue', resolve, { once: true }));
+        }
+        await new Promise(resolve => setTimeout(resolve, 0));  // 让 output 回调先执行
+        return this.take();
+    }
+
+    /** 流结束：取出解码器中剩余的部分 */
+    async flush() {
+        if (this.decoder.state === 'configured') {
+            await this.decoder.flush();
+            this.decoder.close();
+        }
+        return this.take();
+    }
+
+    take() {
+        if (this.error) {
+            throw this.error;
+        }
+        if (!this.pieces.length) {
+            return null;
+        }
+        const total = this.pieces.reduce((sum, piece) => sum + piece.length, 0);
+        const pcm = new Int16Array(total);
+        let offset = 0;
+        for (const piece of this.pieces) {
+            pcm.set(piece, offset);
+            offset += piece.length;
+        }
+        this.pieces = [];
+        return pcmToWav(new Uint8Array(pcm.buffer), { sample_rate: this.sampleRate, channels: 1 });
+    }
+}
+
+const textDecoder = new TextDecoder();
+
+function decodeJson(payload) {
+    return JSON.parse(textDecoder.decode(payload));
+}
+
+/**
+ * 读取 v2 响应，产出可播放的 WAV ArrayBuffer（每个 AUDIO 帧一个）
+ *
+ * handlers（均可选）:
+ *   onMetadata(metadata, isUpdate)  首帧 / 更新帧（更新帧按字段覆盖）
+ *   onText(delta)                   文本增量
+ *   onActions(actions)              追加的 actions
+ *   onFiller(text)                  垫话（随后的音频是垫话）
+ *   onError(error)                  { error, stage }
+ *   onStats(stats)                  本次响应的统计
+ *   onEnd(status)                   'ok' / 'error'；连接中途断开时为 'aborted'
+ */
+export async function* readFrameStream(response, handlers = {}) {
+    const reader = response.body.getReader();
+    const parser = new FrameParser();
+    let audioFormat = {};
+    let audioDecoder = null;  // 压缩音频时的解码器
+    let metadataSeen = false;
+    let ended = false;
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+
+        for (const { type, payload } of parser.push(value)) {
+            switch (type) {
+                case FrameType.METADATA: {
+                    const metadata = decodeJson(payload);
+                    if (!metadataSeen) {
+                        audioFormat = metadata.audio || {};
+                        if (audioFormat.encoding && audioFormat.encoding !== 'pcm_s16le') {
+                            audioDecoder = new CompressedAudioDecoder(audioFormat);
+                        }
+                    }
+                    handlers.onMetadata?.(metadata, metadataSeen);
+                    metadataSeen = true;
+                    break;
+                }
+                case FrameType.TEXT:
+                    handlers.onText?.(textDecoder.decode(payload));
+                    break;
+                case FrameType.ACTIONS:
+                    handlers.onActions?.(decodeJson(payload).actions);
+                    break;
+                case FrameType.AUDIO:
+                    if (audioDecoder) {
+                        const wav = await audioDecoder.decode(payload);
+                        if (wav) {
+                            yield wav;
+                        }
+                    } else {
+                        // 先复制成 WAV，payload 在下一次 push 之后失效
+                        yield pcmToWav(payload, audioFormat);
+                    }
+                    break;
+                case FrameType.FILLER:
+                    handlers.onFiller?.(decodeJson(payload).text);
+                    break;
+                case FrameType.ERROR:
+                    handlers.onError?.(decodeJson(payload));
+                    break;
+                case FrameType.STATS:
+                    handlers.onStats?.(decodeJson(payload));
+                    break;
+                case FrameType.END:
+                    ended = true;
+                    handlers.onEnd?.(decodeJson(payload).status);
+                    break;
+                default:
+                    // 未知帧类型：跳过（向前兼容）
+                    break;
+            }
+        }
+    }
+
+    if (audioDecoder) {
+        const wav = await audioDecoder.flush();
+        if (wav) {
+            yield wav;
+        }
+    }
+
+    if (!ended) {
+        console.warn(`⚠️ 流在 END 帧之前中断（剩余 ${parser.pending} 字节未解析）`);
+        handlers.onEnd?.('aborted');
+    }
+}
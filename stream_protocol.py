@@ -0,0 +1,341 @@
+"""
+流式响应协议 v2（类型化二进制帧）
+
+v1 的返回格式按接口各不相同（裸 WAV 块 / 元数据 + WAV / 元数据 + PCM / 长度前缀块，见 tts_pipeline），
+每个音频块都带 44 字节 WAV 头，也无法在流中途发送文本增量、结束标记或错误:
+TTS 失败只打印日志、流直接结束，客户端分不清"说完了"和"出错了"。
+
+请求参数 protocol=2（或请求头 X-Stream-Protocol: 2）时，流式接口统一返回:
+    b'DHF\\x02'                                  4 字节前导（魔数 + 版本号）
+    [1字节类型][4字节长度（big-endian）][负载]    帧，重复直到 END
+响应头带 X-Stream-Protocol: 2；不带参数时仍返回 v1 格式，旧客户端不受影响。
+v2 请求还可以带 audio_accept（或请求头 X-Audio-Accept）协商压缩的音频格式，响应头 X-Audio-Encoding 为协商结果
+（编码器在发送首帧时启动，启动失败时退回 PCM，以首个 METADATA 帧的 audio 字段为准）。
+
+帧类型:
+    0x01 METADATA   JSON。首帧含 protocol、audio（PCM 格式）和接口原有的元数据字段；
+                    之后再出现时为更新，按字段覆盖（如流水线结束时的完整 message / actions）
+    0x02 TEXT       UTF-8 文本增量（模型输出的文字 / 流水线中开始合成的句子）
+    0x03 ACTIONS    JSON {"actions": [...]}，追加的 actions（流水线中解析完整即发送）
+    0x04 AUDIO      裸 PCM，格式见首帧的 audio 字段（24kHz 16-bit 单声道小端），不带 WAV 头；
+                    协商了压缩格式时（audio.encoding 为 opus / mp3，见 audio_encoder）为一个或多个
+                    [2字节长度（big-endian）][编码包]
+    0x05 END        JSON {"status": "ok" | "error"}，最后一帧；没有收到 END 说明连接中途断开
+    0x06 ERROR      JSON {"error": 错误信息, "stage": "model" | "tts"}，之后仍会发送 STATS 和 END
+    0x07 STATS      JSON，本次响应的音频字节数 / 帧数 / 首个音频帧延迟等，紧接在 END 之前
+    0x08 FILLER     JSON {"text": 垫话文本}，紧随其后的 AUDIO 帧是垫话音频（见 filler_audio）
+
+客户端必须跳过不认识的帧类型（以后增加帧类型不需要升级版本号）。浏览器端解析器见 static/stream_protocol.js。
+
+示例:
+    output = open_response_stream(request.form, request.headers, LEGACY_BLOCKS)
+
+    def generate():
+        yield from output.start(metadata)
+        for pcm in stream_tts(text):
+            yield from output.audio(pcm)
+        yield from output.end()
+
+    return Response(output.guard(generate()), mimetype='application/octet-stream', headers=output.headers)
+
+响应生成器都要经过 guard()（ASGI 为 aguard()）：中途异常时补发 ERROR / END，中途断开时终止编码进程。
+"""
+
+import json
+import struct
+import threading
+import time
+
+from tts_pipeline import encode_json_block, pcm_to_wav, wav_block
+from audio_encoder import negotiate_audio_codec, open_audio_encoder
+
+
+PROTOCOL_VERSION = 2
+PREAMBLE = b'DHF' + bytes([PROTOCOL_VERSION])
+
+FRAME_METADATA = 0x01
+FRAME_TEXT = 0x02
+FRAME_ACTIONS = 0x03
+FRAME_AUDIO = 0x04
+FRAME_END = 0x05
+FRAME_ERROR = 0x06
+FRAME_STATS = 0x07
+FRAME_FILLER = 0x08
+
+AUDIO_FORMAT = {'encoding': 'pcm_s16le', 'sample_rate': 24000, 'channels': 1}
+_BYTES_PER_SECOND = AUDIO_FORMAT['sample_rate'] * AUDIO_FORMAT['channels'] * 2
+
+# v1 各接口的原有格式
+LEGACY_WAV = 'wav'                    # 裸 WAV 块（图片点评 / 音频对话 / 视频自动对话）
+LEGACY_METADATA_WAV = 'metadata+wav'  # [4字节长度][元数据 JSON] + 裸 WAV 块（视频理解 + TTS）
+LEGACY_METADATA_PCM = 'metadata+pcm'  # [4字节长度][元数据 JSON] + 裸 PCM（Agent /api/chat）
+LEGACY_BLOCKS = 'blocks'              # 长度前缀块（流水线 / 垫话模式，见 tts_pipeline）
+
+_FRAME_HEADER = struct.Struct('>BI')
+
+_stats_lock = threading.Lock()
+_stats = {
+    'v1_responses': 0, 'v2_responses': 0, 'v2_errors': 0,
+    'v2_audio_frames': 0, 'v2_audio_bytes': 0, 'v2_encoded_bytes': 0,
+}
+
+
+def resolve_stream_protocol(form, headers=None):
+    """
+    按请求参数 protocol 或请求头 X-Stream-Protocol 协商协议版本
+
+    返回:
+        2（请求了 v2）或 1
+    """
+    value = form.get('protocol') or (headers.get('X-Stream-Protocol') if headers is not None else None)
+    return PROTOCOL_VERSION if (value or '').strip() == str(PROTOCOL_VERSION) else 1
+
+
+def encode_frame(frame_type, payload):
+    """编码一帧：[1字节类型][4字节长度（big-endian）][负载]（payload 可以是 bytes / bytearray / memoryview）"""
+    return b''.join((_FRAME_HEADER.pack(frame_type, len(payload)), payload))
+
+
+def encode_json_frame(frame_type, data):
+    """编码一个 JSON 负载的帧"""
+    return encode_frame(frame_type, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+def _without_type(metadata):
+    return {key: value for key, value in metadata.items() if key != 'type'}
+
+
+class FrameStream:
+    """
+    v2 帧编码器
+
+    每个方法返回要发送的帧（元组），生成器中用 yield from 发送；同时统计本次响应的音频量和首帧延迟，
+    在 end() 时以 STATS 帧发送
+
+    参数:
+        started_at: 请求开始时间（time.perf_counter()，用于首个音频帧延迟；默认为创建时）
+        codec: 协商出的压缩格式（'opus' / 'mp3'；None 表示发送裸 PCM）。编码器在 start() 时才启动，
+               启动失败时退回 PCM；end() 取出编码器剩余数据，没有调用 end() 时由 close() 终止
+    """
+
+    version = PROTOCOL_VERSION
+
+    def __init__(self, started_at=None, codec=None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.codec = codec
+        self.encoder = None
+        self.audio_format = AUDIO_FORMAT
+        self.headers = {
+            'X-Stream-Protocol': str(PROTOCOL_VERSION),
+            'X-Audio-Encoding': codec or AUDIO_FORMAT['encoding'],
+            'Cache-Control': 'no-cache',
+        }
+        self.audio_bytes = 0
+        self.encoded_bytes = 0
+        self.audio_frames = 0
+        self.first_audio_at = None
+        self.status = 'ok'
+
+    def start(self, metadata=None):
+        """前导 + 首个 METADATA 帧（协商了压缩格式时在这里启动编码器）"""
+        if self.codec is not None and self.encoder is None:
+            self.encoder = open_audio_encoder(self.codec)
+            if self.encoder is None:
+                self.codec = None
+            else:
+                self.audio_format = self.encoder.format
+        data = _without_type(metadata or {})
+        data.update(protocol=PROTOCOL_VERSION, audio=self.audio_format)
+        return PREAMBLE + encode_json_frame(FRAME_METADATA, data),
+
+    def text(self, delta):
+        if not delta:
+            return ()
+        return encode_frame(FRAME_TEXT, delta.encode('utf-8')),
+
+    def action(self, action):
+        return encode_json_frame(FRAME_ACTIONS, {'actions': [action]}),
+
+    def audio(self, pcm):
+        if not pcm:
+            return ()
+        self.audio_bytes += len(pcm)
+        if self.encoder is None:
+            return self._audio_frame(pcm)
+        return self._audio_frame(self.encoder.encode(pcm))
+
+    def _audio_frame(self, payload):
+        if not payload:
+            return ()
+        if self.first_audio_at is None:
+            self.first_audio_at = time.perf_counter()
+        if self.encoder is not None:
+            self.encoded_bytes += len(payload)
+        self.audio_frames += 1
+        return encode_frame(FRAME_AUDIO, payload),
+
+    def filler(self, phrase, pcm):
+        return (encode_json_frame(FRAME_FILLER, {'text': phrase}),) + self.audio(pcm)
+
+    def update(self, metadata):
+        """METADATA 更新帧（按字段覆盖首帧）"""
+        return encode_json_frame(FRAME_METADATA, _without_type(metadata)),
+
+    def error(self, message, stage):
+        self.status = 'error'
+        return encode_json_frame(FRAME_ERROR, {'error': str(message), 'stage': stage}),
+
+    def end(self, **extra):
+        """（编码器剩余的 AUDIO 帧）+ STATS + END 帧（extra 为附加统计，如 sentences、cache_hit）"""
+        tail = self._audio_frame(self.encoder.close()) if self.encoder is not None else ()
+        now = time.perf_counter()
+        stats = {
+            'audio_bytes': self.audio_bytes,
+            'audio_frames': self.audio_frames,
+            'audio_seconds': round(self.audio_bytes / _BYTES_PER_SECOND, 3),
+            'first_audio_ms': round((self.first_audio_at - self.started_at) * 1000, 1)
+            if self.first_audio_at is not None else None,
+            'elapsed_ms': round((now - self.started_at) * 1000, 1),
+        }
+        if self.encoder is not None:
+            stats.update(audio_encoding=self.audio_format['encoding'], encoded_bytes=self.encoded_bytes)
+        stats.update(extra)
+        with _stats_lock:
+            _stats['v2_responses'] += 1
+            _stats['v2_audio_frames'] += self.audio_frames
+            _stats['v2_audio_bytes'] += self.audio_bytes
+            _stats['v2_encoded_bytes'] += self.encoded_bytes
+            if self.status != 'ok':
+                _stats['v2_errors'] += 1
+        return tail + (encode_json_frame(FRAME_STATS, stats), encode_json_frame(FRAME_END, {'status': self.status}))
+
+    def close(self):
+        """终止没有正常结束（没有调用 end()）的编码器并归还名额"""
+        if self.encoder is not None:
+            self.encoder.abort()
+
+    def guard(self, chunks, stage='model'):
+        """
+        包装响应生成器：中途抛出异常时发送 ERROR、STATS 和 END 帧，而不是直接断开连接；
+        生成器结束或被关闭（客户端断开）时调用 close()
+        """
+        try:
+            yield from chunks
+        except Exception as e:
+            print(f'❌ 流式响应中途失败: {e}')
+            yield from self.error(e, stage)
+            yield from self.end()
+        finally:
+            self.close()
+
+    async def aguard(self, chunks, stage='model'):
+        """guard 的异步版本（chunks 为异步生成器；出错时直接终止编码器，不等待剩余数据）"""
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            print(f'❌ 流式响应中途失败: {e}')
+            self.close()
+            for frame in self.error(e, stage) + self.end():
+                yield frame
+        finally:
+            self.close()
+
+
+class LegacyStream:
+    """
+    v1 编码器：与 FrameStream 接口相同，按接口原有格式输出（字节与引入 v2 之前一致），
+    v1 中没有对应表示的事件（文本增量、统计、结束标记等）不输出
+
+    参数:
+        layout: LEGACY_WAV / LEGACY_METADATA_WAV / LEGACY_METADATA_PCM / LEGACY_BLOCKS
+    """
+
+    version = 1
+    headers = {}
+    codec = None    # v1 始终是 WAV / PCM，不协商压缩格式
+    encoder = None
+
+    def __init__(self, layout):
+        self.layout = layout
+
+    def start(self, metadata=None):
+        if self.layout == LEGACY_WAV:
+            return ()
+        return encode_json_block(metadata),
+
+    def text(self, delta):
+        return ()
+
+    def action(self, action):
+        if self.layout != LEGACY_BLOCKS:
+            return ()
+        return encode_json_block({'type': 'action', 'action': action}),
+
+    def audio(self, pcm):
+        if not pcm:
+            return ()
+        if self.layout == LEGACY_BLOCKS:
+            return wav_block(pcm),
+        if self.layout == LEGACY_METADATA_PCM:
+            return pcm,
+        return pcm_to_wav(pcm),
+
+    def filler(self, phrase, pcm):
+        if self.layout != LEGACY_BLOCKS:
+            return ()
+        return encode_json_block({'type': 'filler', 'text': phrase}), wav_block(pcm)
+
+    def update(self, metadata):
+        if self.layout != LEGACY_BLOCKS:
+            return ()
+        return encode_json_block(dict(metadata, type='metadata_update')),
+
+    def error(self, message, stage):
+        # v1 只在模型调用失败时发送 error 块（TTS 失败只记录日志），保持原样
+        if self.layout != LEGACY_BLOCKS or stage != 'model':
+            return ()
+        return encode_json_block({'type': 'error', 'error': str(message)}),
+
+    def end(self, **extra):
+        with _stats_lock:
+            _stats['v1_responses'] += 1
+        return ()
+
+    def close(self):
+        pass
+
+    def guard(self, chunks, stage='model'):
+        # v1 没有错误的表示方式，异常照旧向上抛出（连接中断）
+        return chunks
+
+    def aguard(self, chunks, stage='model'):
+        return chunks
+
+
+def open_response_stream(form, headers, legacy, started_at=None):
+    """
+    按协商结果创建编码器
+
+    参数:
+        form: 请求表单（读取 protocol / audio_accept 参数）
+        headers: 请求头（读取 X-Stream-Protocol / X-Audio-Accept）
+        legacy: 不使用 v2 时该接口的 v1 格式（LEGACY_*）
+        started_at: 请求开始时间（time.perf_counter()）
+
+    返回:
+        FrameStream（协商了压缩格式时在 start() 中启动流式编码器）或 LegacyStream；响应头使用 stream.headers
+    """
+    if resolve_stream_protocol(form, headers) == PROTOCOL_VERSION:
+        return FrameStream(started_at, negotiate_audio_codec(form, headers))
+    return LegacyStream(legacy)
+
+
+def get_stream_stats():
+    """返回 v1 / v2 响应数、v2 出错的响应数和发送的音频帧 / 字节数（v2_audio_bytes 为编码前的 PCM 字节数）"""
+    with _stats_lock:
+        stats = dict(_stats)
+    frames = stats['v2_audio_frames']
+    # v1 每个音频块带 44 字节 WAV 头（分块格式另有 4 字节长度），v2 帧头 5 字节
+    stats['v2_header_bytes_saved'] = frames * (44 - _FRAME_HEADER.size)
+    return stats
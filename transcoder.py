@@ -0,0 +1,260 @@
+"""
+FFmpeg 转码服务（进程内）
+
+所有 ffmpeg 调用都经过这里，统一做:
+    - 并发限制：常驻工作线程池，默认与 CPU 核数相同，同一时刻最多这么多个编码进程
+    - 准入控制：排队任务超过上限时直接拒绝（TranscodeRejected，接口返回 503）
+    - 超时：单个任务超过时限会被终止（TranscodeTimeout）
+    - 预检：编码前用 ffprobe 快速检查输入（文件或内存数据），损坏的片段直接拒绝（CorruptMediaError）；
+      单独的探测（probe_media）同样经过工作线程池和排队上限
+    - 指标：排队等待时间、编码耗时、各类失败计数（见 get_transcode_stats）
+
+配置（环境变量）:
+    FFMPEG_WORKERS       工作线程数（默认 CPU 核数）
+    FFMPEG_MAX_QUEUE     最多排队任务数（默认 工作线程数 × 4）
+    FFMPEG_TIMEOUT       单个任务超时秒数（默认 60）
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+FFMPEG_WORKERS = int(os.getenv('FFMPEG_WORKERS', os.cpu_count() or 2))
+FFMPEG_MAX_QUEUE = int(os.getenv('FFMPEG_MAX_QUEUE', FFMPEG_WORKERS * 4))
+FFMPEG_TIMEOUT = float(os.getenv('FFMPEG_TIMEOUT', '60'))
+FFPROBE_TIMEOUT = 10
+
+
+class TranscodeError(Exception):
+    """转码失败"""
+
+
+class TranscodeRejected(TranscodeError):
+    """转码队列已满，拒绝新任务"""
+
+
+class TranscodeTimeout(TranscodeError):
+    """转码超时"""
+
+
+class CorruptMediaError(TranscodeError):
+    """ffprobe 预检失败（输入损坏或不是有效媒体文件）"""
+
+
+class TranscodeService:
+    """
+    有界 ffmpeg 工作池
+
+    用法:
+        result = transcoder.run(['ffmpeg', '-y', '-i', src, dst], probe_path=src)
+    """
+
+    def __init__(self, workers=FFMPEG_WORKERS, max_queue=FFMPEG_MAX_QUEUE, timeout=FFMPEG_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ffmpeg')
+        # 正在编码 + 排队中的任务总数上限
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'corrupt': 0,
+            'probes': 0,
+            'queued': 0,
+            'running': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'encode_time_total': 0.0,
+            'encode_time_max': 0.0,
+            'probe_time_total': 0.0,
+        }
+
+    def submit(self, args, probe_path=None, timeout=None, input_data=None, probe_input=False):
+        """
+        提交一个 ffmpeg 任务
+
+        参数:
+            args: 完整的命令行参数列表（以 'ffmpeg' 开头）
+            probe_path: 需要预检的输入文件（可选）
+            timeout: 超时秒数（默认使用服务配置）
+            input_data: 写入 ffmpeg stdin 的数据（可选，配合 '-i pipe:0'）
+            probe_input: 是否预检 input_data（通过 stdin 交给 ffprobe）
+
+        返回:
+            Future，结果为 subprocess.CompletedProcess（stdout/stderr 为 bytes）
+
+        异常:
+            TranscodeRejected: 队列已满
+        """
+        return self._submit(self._transcode, args, probe_path, timeout or self.timeout, input_data, probe_input)
+
+    def _submit(self, job, *args):
+        """占用一个名额（正在执行 + 排队），交给工作线程池执行 job(*args)"""
+        if not self._slots.acquire(blocking=False):
+            self._incr('rejected')
+            raise TranscodeRejected(f'转码队列已满（{self.workers} 个工作线程，最多排队 {self.max_queue} 个任务）')
+
+        self._incr('submitted')
+        self._incr('queued')
+        submitted_at = time.perf_counter()
+        try:
+            return self._executor.submit(self._run_job, submitted_at, job, *args)
+        except Exception:
+            self._incr('queued', -1)
+            self._slots.release()
+            raise
+
+    def run(self, args, probe_path=None, timeout=None, input_data=None, probe_input=False):
+        """提交任务并等待结果（参数同 submit）"""
+        return self.submit(
+            args, probe_path=probe_path, timeout=timeout, input_data=input_data, probe_input=probe_input
+        ).result()
+
+    def probe(self, path=None, data=None):
+        """
+        ffprobe 探测（与转码任务共用工作线程池和排队上限）
+
+        参数:
+            path: 输入文件路径
+            data: 输入数据（bytes，通过 stdin 传入，不落盘）
+
+        返回:
+            {'format': {...}, 'streams': [...]}
+
+        异常:
+            TranscodeRejected: 队列已满
+            CorruptMediaError: 无法解析或没有任何音视频流
+        """
+        return self._submit(self._probe_job, path, data).result()
+
+    def _probe_job(self, path, data):
+        self._incr('probes')
+        return self._probe(path, data)
+
+    def _probe(self, path=None, data=None):
+        """执行 ffprobe（在工作线程中调用，已占用名额）"""
+        started = time.perf_counter()
+        try:
+            result = subprocess.run([
+                'ffprobe', '-v', 'error',
+                '-show_entries', 'format=format_name,duration,bit_rate:stream=index,codec_type,codec_name,width,height,avg_frame_rate',
+                '-of', 'json',
+                path if data is None else 'pipe:0'
+            ], input=data, capture_output=True, timeout=FFPROBE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._incr('corrupt')
+            raise CorruptMediaError(f'ffprobe 超时: {path or "pipe:0"}')
+        finally:
+            self._incr('probe_time_total', time.perf_counter() - started)
+
+        info = {}
+        if result.returncode == 0:
+            try:
+                info = json.loads(result.stdout or b'{}')
+            except json.JSONDecodeError:
+                info = {}
+
+        if result.returncode != 0 or not info.get('streams'):
+            self._incr('corrupt')
+            stderr = result.stderr.decode('utf-8', errors='replace')[:200]
+            raise CorruptMediaError(f'媒体预检失败: {stderr or "没有可用的音视频流"}')
+
+        return info
+
+    def _run_job(self, submitted_at, job, *args):
+        queue_wait = time.perf_counter() - submitted_at
+        with self._lock:
+            self._stats['queued'] -= 1
+            self._stats['running'] += 1
+            self._stats['queue_wait_total'] += queue_wait
+            self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], queue_wait)
+
+        try:
+            return job(*args)
+        finally:
+            self._incr('running', -1)
+            self._slots.release()
+
+    def _transcode(self, args, probe_path, timeout, input_data, probe_input):
+        try:
+            if probe_path:
+                self._probe(probe_path)
+            elif probe_input and input_data is not None:
+                self._probe(data=input_data)
+
+            encode_started = time.perf_counter()
+            try:
+                result = subprocess.run(args, input=input_data, capture_output=True, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self._incr('timeouts')
+                raise TranscodeTimeout(f'ffmpeg 超过 {timeout:g} 秒未完成，已终止')
+            encode_time = time.perf_counter() - encode_started
+
+            with self._lock:
+                self._stats['encode_time_total'] += encode_time
+                self._stats['encode_time_max'] = max(self._stats['encode_time_max'], encode_time)
+
+            if result.returncode != 0:
+                raise subprocess.CalledProcessError(
+                    result.returncode, args,
+                    output=result.stdout.decode('utf-8', errors='replace'),
+                    stderr=result.stderr.decode('utf-8', errors='replace')
+                )
+
+            self._incr('completed')
+            return result
+        except Exception:
+            self._incr('failed')
+            raise
+
+    def _incr(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def stats(self):
+        """返回转码指标快照"""
+        with self._lock:
+            stats = dict(self._stats)
+        finished = stats['completed'] + stats['failed'] + stats['probes']
+        stats['workers'] = self.workers
+        stats['max_queue'] = self.max_queue
+        stats['queue_wait_avg'] = stats['queue_wait_total'] / finished if finished else 0.0
+        stats['encode_time_avg'] = stats['encode_time_total'] / stats['completed'] if stats['completed'] else 0.0
+        return stats
+
+
+# 进程内共享的转码服务
+transcoder = TranscodeService()
+
+
+def run_ffmpeg(args, probe_path=None, timeout=None, input_data=None, probe_input=False):
+    """通过共享转码服务执行 ffmpeg（参数同 TranscodeService.submit）"""
+    return transcoder.run(
+        args, probe_path=probe_path, timeout=timeout, input_data=input_data, probe_input=probe_input
+    )
+
+
+def submit_ffmpeg(args, probe_path=None, timeout=None, input_data=None, probe_input=False):
+    """向共享转码服务提交 ffmpeg 任务，返回 Future（参数同 TranscodeService.submit）"""
+    return transcoder.submit(
+        args, probe_path=probe_path, timeout=timeout, input_data=input_data, probe_input=probe_input
+    )
+
+
+def probe_media(path=None, data=None):
+    """用 ffprobe 探测输入的容器和音视频流（参数同 TranscodeService.probe）"""
+    return transcoder.probe(path=path, data=data)
+
+
+def get_transcode_stats():
+    """返回共享转码服务的指标"""
+    return transcoder.stats()
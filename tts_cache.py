@@ -0,0 +1,159 @@
+"""
+TTS 合成结果的磁盘缓存
+
+数字人的回复里有大量重复的句子（"你好，我是你的面试教练。"、"很好，继续保持。"、固定的开场白和
+结束语），每次都完整调用一次 qwen3-tts-flash，既花配额又要等首包。这里按
+(规范化后的文本, 音色, 语言, TTS 模型) 缓存合成出的 PCM:
+    - 存储复用 response_cache.ResponseCache（内容寻址、按大小 LRU 淘汰、mmap 读取、原子写入）
+    - 命中时立即按原来的块大小一次性产出全部块（不按原节奏等待，播放端按队列顺序播放）
+    - 未命中时边合成边写入，只有上游正常结束才写入缓存（出错、调用方中途停止迭代的不缓存）
+    - 文本规范化只合并空白、去掉首尾空白；送给 TTS 的仍是原文本
+    - 超过 TTS_CACHE_MAX_CHARS 的长文本不缓存（按句合成时每句都很短，长文本几乎不会重复）
+
+配置（环境变量）:
+    TTS_CACHE_ENABLED      是否启用（默认 true）
+    TTS_CACHE_DIR          缓存目录（默认 data/tts_cache）
+    TTS_CACHE_MAX_BYTES    缓存总大小上限（默认 128MB）
+    TTS_CACHE_MAX_CHARS    可缓存文本的最大长度（默认 200 字符）
+
+示例:
+    def stream_tts(text, voice='Cherry', language='Chinese'):
+        yield from cached_tts(text, voice, language, TTS_MODEL, _synthesize)
+"""
+
+import os
+import threading
+
+from response_cache import ResponseCache
+
+
+TTS_CACHE_ENABLED = os.getenv('TTS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', 'data/tts_cache')
+TTS_CACHE_MAX_BYTES = int(os.getenv('TTS_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+TTS_CACHE_MAX_CHARS = int(os.getenv('TTS_CACHE_MAX_CHARS', '200'))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {'bypassed': 0, 'hit_bytes': 0}
+
+
+def normalize_tts_text(text):
+    """合并连续空白并去掉首尾空白（只用于缓存键）"""
+    return ' '.join(text.split())
+
+
+def _get_cache():
+    """首次使用时创建缓存（未启用时返回 None）"""
+    global _cache
+    if not TTS_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+            print(f'💾 TTS 缓存: {_cache.directory}（{_cache.get_stats()["entries"]} 条，'
+                  f'上限 {_cache.max_bytes // 1024 // 1024} MB）')
+        return _cache
+
+
+def _lookup(text, voice, language, model):
+    """
+    返回 (cache, key, normalized, cached)
+
+    不缓存（未启用 / 空文本 / 文本过长）时 cache 为 None
+    """
+    normalized = normalize_tts_text(text)
+    cache = _get_cache() if normalized else None
+    if cache is None or len(normalized) > TTS_CACHE_MAX_CHARS:
+        if cache is not None:
+            with _stats_lock:
+                _stats['bypassed'] += 1
+        return None, None, normalized, None
+    key = cache.make_key(normalized.encode('utf-8'), voice, language, model)
+    return cache, key, normalized, cache.get(key)
+
+
+def _record_hit(size):
+    with _stats_lock:
+        _stats['hit_bytes'] += size
+
+
+def cached_tts(text, voice, language, model, synthesize):
+    """
+    带缓存的流式 TTS
+
+    参数:
+        text: 要合成的文本
+        voice: 音色
+        language: 语言
+        model: TTS 模型（参与缓存键）
+        synthesize: 未命中时调用 synthesize(text, voice, language)，返回 PCM 块生成器；
+                    上游出错时应抛出异常（正常结束的生成器会被写入缓存）
+
+    返回:
+        generator: 产出 PCM 块，命中时与首次合成的块大小一致
+    """
+    cache, key, normalized, cached = _lookup(text, voice, language, model)
+    if cached:
+        _record_hit(sum(cached.chunk_sizes))
+        yield from cached.replay(paced=False)
+        return
+    if cache is None:
+        yield from synthesize(text, voice, language)
+        return
+
+    writer = cache.writer(key)
+
+    def generate():
+        for pcm in synthesize(text, voice, language):
+            writer.add_chunk(pcm)
+            yield pcm
+        writer.commit(normalized)
+
+    yield from writer.guard(generate())
+
+
+async def acached_tts(text, voice, language, model, synthesize):
+    """
+    带缓存的流式 TTS（异步版本）
+
+    参数与 cached_tts 相同，synthesize 返回 async generator
+
+    返回:
+        async generator: 产出 PCM 块
+    """
+    cache, key, normalized, cached = _lookup(text, voice, language, model)
+    if cached:
+        _record_hit(sum(cached.chunk_sizes))
+        for pcm in cached.replay(paced=False):
+            yield pcm
+        return
+    if cache is None:
+        async for pcm in synthesize(text, voice, language):
+            yield pcm
+        return
+
+    writer = cache.writer(key)
+
+    async def generate():
+        async for pcm in synthesize(text, voice, language):
+            writer.add_chunk(pcm)
+            yield pcm
+        writer.commit(normalized)
+
+    async for pcm in writer.aguard(generate()):
+        yield pcm
+
+
+def get_tts_cache_stats():
+    """返回 TTS 缓存统计（未启用时 enabled 为 False）"""
+    cache = _get_cache()
+    if cache is None:
+        return {'enabled': False}
+    stats = cache.get_stats()
+    stats.pop('paced', None)
+    with _stats_lock:
+        stats.update(_stats)
+    stats.update(enabled=True, max_chars=TTS_CACHE_MAX_CHARS)
+    return stats
@@ -0,0 +1,333 @@
+"""
+句子级流水线 TTS
+
+边接收大模型的流式输出，边从 JSON 响应的 message 字段中切出完整句子送去 TTS，
+第一句话的音频在模型生成完全部内容之前就可以返回给客户端。
+
+流水线模式的返回格式（请求参数 pipeline=1）:
+    [4字节长度][元数据 JSON]          首块，message 为空，pipeline 为 true
+    [4字节长度][WAV 音频块]            以 b'RIFF' 开头
+    [4字节长度][action JSON]           以 b'{' 开头，type 为 action，
+                                        actions 中的元素一解析完整就立即发送
+    ...
+    [4字节长度][元数据更新 JSON]       以 b'{' 开头，type 为 metadata_update，
+                                        携带完整 message 和 actions
+
+客户端按长度前缀逐块读取，用首字节区分音频块和 JSON 块。
+
+垫话模式（请求参数 filler=1，见 filler_audio）使用同样的分块格式，首块带 filler: true，
+随后立即发送:
+    [4字节长度][filler JSON]           type 为 filler，text 为垫话文本（垫话尚未就绪时不发送）
+    [4字节长度][WAV 音频块]            垫话音频，之后是正常的回答
+模型调用失败时发送 type 为 error 的 JSON 块并结束。
+
+以上为 v1 格式；请求参数 protocol=2 时使用类型化帧（见 stream_protocol）。
+"""
+
+import asyncio
+import json
+import queue
+import struct
+import threading
+
+from response_parser import ResponseStreamParser, parse_response
+
+
+# 句末标点（中英文）
+SENTENCE_ENDINGS = '。！？!?；;…\n'
+
+# 太短的句子与下一句合并后再送 TTS（避免 "好。" 这类碎片单独请求）
+MIN_SENTENCE_CHARS = 6
+
+# 提前结束（客户端断开 / TTS 失败）时等待读取线程退出的最长时间（秒）；
+# 读取线程在收到下一个 token 时检查停止标志，超时后它仍会在那时自行关闭 token 流并退出
+READER_JOIN_TIMEOUT = 1.0
+
+
+def is_pipeline_requested(form):
+    """判断请求是否开启流水线模式（pipeline=1/true）"""
+    return form.get('pipeline', '').lower() in ('1', 'true', 'yes')
+
+
+def iter_content_deltas(stream, on_usage=None):
+    """
+    从 OpenAI 兼容的流式响应中取出文本增量
+
+    参数:
+        stream: ChatCompletionChunk 迭代器
+        on_usage: 收到 usage 时的回调（请求时需带 stream_options={'include_usage': True}）
+    """
+    for chunk in stream:
+        content = _content_delta(chunk, on_usage)
+        if content:
+            yield content
+
+
+async def aiter_content_deltas(stream, on_usage=None):
+    """iter_content_deltas 的异步版本（stream 为 ChatCompletionChunk 异步迭代器）"""
+    async for chunk in stream:
+        content = _content_delta(chunk, on_usage)
+        if content:
+            yield content
+
+
+def _content_delta(chunk, on_usage):
+    if on_usage and getattr(chunk, 'usage', None):
+        on_usage(chunk.usage)
+    if chunk.choices:
+        return getattr(chunk.choices[0].delta, 'content', None)
+    return None
+
+
+class SentenceSplitter:
+    """把增量文本切分成完整句子"""
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ''
+
+    def feed(self, text):
+        """输入文本，返回已完整的句子列表"""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for i, ch in enumerate(self._buffer):
+            if ch in SENTENCE_ENDINGS and i + 1 - start >= self.min_chars:
+                sentence = self._buffer[start:i + 1].strip()
+                if sentence:
+                    sentences.append(sentence)
+                start = i + 1
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """返回剩余的不完整句子"""
+        rest = self._buffer.strip()
+        self._buffer = ''
+        return [rest] if rest else []
+
+
+class _BaseSentencePipeline:
+    """SentencePipeline / AsyncSentencePipeline 共用的解析与切句逻辑"""
+
+    _END = object()
+
+    def __init__(self, token_stream, synthesize):
+        self._token_stream = token_stream
+        self._synthesize = synthesize
+        self._actions = queue.Queue()
+        self._parser = ResponseStreamParser()
+        self._deltas = []
+        self.sentence_count = 0
+
+    @property
+    def text(self):
+        return ''.join(self._deltas)
+
+    @property
+    def message(self):
+        return self._parser.message
+
+    @property
+    def actions(self):
+        return self._parser.actions
+
+    def _feed_delta(self, splitter, delta):
+        """输入一段模型输出，返回新切出的完整句子（解析完整的 action 放入队列）"""
+        self._deltas.append(delta)
+        sentences = []
+        for kind, value in self._parser.feed(delta):
+            if kind == 'message':
+                sentences.extend(splitter.feed(value))
+            elif kind == 'action':
+                self._actions.put(value)
+        return sentences
+
+    def _rest_sentences(self, splitter):
+        """模型输出结束后剩余的句子"""
+        rest = splitter.flush()
+        if not self._parser.message:
+            # 没有解析到 message（格式异常），退化为整段解析
+            message, _, _ = parse_response(self.text)
+            rest = splitter.feed(message) + splitter.flush()
+        return rest
+
+    def _drain_actions(self):
+        while True:
+            try:
+                yield ('action', self._actions.get_nowait())
+            except queue.Empty:
+                return
+
+    def _next_sentence(self, item):
+        if isinstance(item, Exception):
+            raise item
+        self.sentence_count += 1
+        print(f'🗣️  句子 #{self.sentence_count} 开始合成: {item[:30]}')
+        return item
+
+
+class SentencePipeline(_BaseSentencePipeline):
+    """
+    句子级 TTS 流水线
+
+    后台线程用 ResponseStreamParser 消费大模型 token 流并切分句子，
+    当前线程逐句调用 TTS，因此第 N 句在合成时，模型仍在继续生成后面的内容。
+
+    迭代产出事件:
+        ('text', sentence)     开始合成的句子（在该句的音频之前产出）
+        ('audio', pcm_chunk)   TTS 音频
+        ('action', action)     actions 中解析完整的元素（在音频片段之间尽早产出）
+
+    用法:
+        pipeline = SentencePipeline(iter_content_deltas(stream), stream_tts)
+        for kind, value in pipeline:
+            ...
+        pipeline.text   # 模型完整原始输出（用于解析 actions、保存历史）
+
+    生成器中途被关闭（客户端断开）时通知读取线程停止，由它关闭 token 流（释放上游连接）；
+    TTS 失败时仍等模型输出读完再抛出异常（调用方用 text 保存完整回复）
+    """
+
+    def __init__(self, token_stream, synthesize):
+        super().__init__(token_stream, synthesize)
+        self._sentences = queue.Queue()
+        self._stop = threading.Event()
+
+    def _read_tokens(self):
+        splitter = SentenceSplitter()
+        try:
+            for delta in self._token_stream:
+                if self._stop.is_set():
+                    return
+                for sentence in self._feed_delta(splitter, delta):
+                    self._sentences.put(sentence)
+            for sentence in self._rest_sentences(splitter):
+                self._sentences.put(sentence)
+            self._sentences.put(self._END)
+        except Exception as e:
+            self._sentences.put(e)
+        finally:
+            # 生成器只能在正在迭代它的线程中关闭
+            close = getattr(self._token_stream, 'close', None)
+            if close is not None:
+                close()
+
+    def __iter__(self):
+        reader = threading.Thread(target=self._read_tokens, daemon=True, name='sentence-pipeline')
+        reader.start()
+        closed = True
+
+        try:
+            while True:
+                item = self._sentences.get()
+                yield from self._drain_actions()
+                if item is self._END:
+                    break
+
+                sentence = self._next_sentence(item)
+                yield ('text', sentence)
+                for pcm_chunk in self._synthesize(sentence):
+                    yield ('audio', pcm_chunk)
+                    yield from self._drain_actions()
+            closed = False
+        except Exception:
+            closed = False
+            raise
+        finally:
+            if closed:
+                self._stop.set()
+            reader.join(READER_JOIN_TIMEOUT if closed else None)
+
+        yield from self._drain_actions()
+
+
+class AsyncSentencePipeline(_BaseSentencePipeline):
+    """
+    SentencePipeline 的异步版本（ASGI 服务使用）
+
+    token_stream 为异步迭代器（如 aiter_content_deltas），synthesize 为异步生成器函数（如 astream_tts）；
+    消费 token 流的是事件循环中的任务而不是线程，中途关闭（客户端断开）时取消该任务并关闭 token 流，
+    TTS 失败时同样先等模型输出读完再抛出异常。
+
+    用法:
+        pipeline = AsyncSentencePipeline(aiter_content_deltas(stream), astream_tts)
+        async for kind, value in pipeline:
+            ...
+    """
+
+    def __init__(self, token_stream, synthesize):
+        super().__init__(token_stream, synthesize)
+        self._sentences = asyncio.Queue()
+
+    async def _read_tokens(self):
+        splitter = SentenceSplitter()
+        try:
+            async for delta in self._token_stream:
+                for sentence in self._feed_delta(splitter, delta):
+                    self._sentences.put_nowait(sentence)
+            for sentence in self._rest_sentences(splitter):
+                self._sentences.put_nowait(sentence)
+            self._sentences.put_nowait(self._END)
+        except Exception as e:
+            self._sentences.put_nowait(e)
+        finally:
+            aclose = getattr(self._token_stream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    async def __aiter__(self):
+        reader = asyncio.create_task(self._read_tokens())
+        try:
+            while True:
+                item = await self._sentences.get()
+                for event in self._drain_actions():
+                    yield event
+                if item is self._END:
+                    break
+
+                sentence = self._next_sentence(item)
+                yield ('text', sentence)
+                async for pcm_chunk in self._synthesize(sentence):
+                    yield ('audio', pcm_chunk)
+                    for event in self._drain_actions():
+                        yield event
+            await reader
+        except Exception:
+            await reader
+            raise
+        finally:
+            # 客户端断开时不再继续读取模型输出
+            if not reader.done():
+                reader.cancel()
+
+        for event in self._drain_actions():
+            yield event
+
+
+def encode_block(payload):
+    """编码一个长度前缀块：[4字节长度（big-endian）][数据]"""
+    return len(payload).to_bytes(4, byteorder='big') + payload
+
+
+def encode_json_block(data):
+    """编码一个 JSON 长度前缀块"""
+    return encode_block(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+def pcm_to_wav(pcm_data, sample_rate=24000, bits_per_sample=16, channels=1):
+    """给 PCM 加上 44 字节 WAV 文件头（各接口共用；app.add_wav_header 在此基础上打印日志）"""
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    header = struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', len(pcm_data) + 36, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample,
+        b'data', len(pcm_data)
+    )
+    return header + pcm_data
+
+
+def wav_block(pcm_data, sample_rate=24000, bits_per_sample=16, channels=1):
+    """给 PCM 加上 WAV 文件头并编码为长度前缀块"""
+    return encode_block(pcm_to_wav(pcm_data, sample_rate, bits_per_sample, channels))
@@ -0,0 +1,235 @@
+"""
+上传文件落盘与大小限制
+
+原来各接口 request.files[...].read() 把整个上传读进 Python 内存，且没有任何大小上限，
+几个超大的上传就能让 worker 内存耗尽。这里统一处理:
+    - 按接口限制请求体大小（MAX_CONTENT_LENGTH），Content-Length 超限时不读取请求体直接 413，
+      没有 Content-Length（chunked）时边接收边计数，超限立即 413
+    - 上传先写入 SpooledTemporaryFile（小于 UPLOAD_SPOOL_BYTES 留在内存，更大的落盘）
+    - read_upload 对落盘的文件返回只读 mmap，数据留在页缓存里，不占 Python 堆；
+      mmap 支持 len / 切片 / buffer 协议，可直接交给 ffmpeg stdin、写临时文件或 DataURI
+    - 同时在处理中的上传总量不超过 UPLOAD_SPOOL_QUOTA，超出时返回 503；
+      流式响应在视图返回之后才读取上传数据，配额要等响应发送完（或客户端断开）才释放
+
+配置（环境变量）:
+    UPLOAD_MAX_BYTES      未单独配置的接口的请求体上限（默认 64MB）
+    UPLOAD_LIMITS         按接口（Flask endpoint 名）覆盖的 JSON，例如 {"audio_chat": 8388608}
+    UPLOAD_SPOOL_BYTES    上传在内存中保留的最大字节数，超出后落盘（默认 1MB）
+    UPLOAD_SPOOL_QUOTA    同时处理中的上传总字节数上限（默认 512MB）
+    UPLOAD_TMP_DIR        落盘目录（默认系统临时目录）
+
+示例:
+    install_upload_limits(app)
+    ...
+    video_data = read_upload(request.files['video'])
+"""
+
+import io
+import json
+import mmap
+import os
+import threading
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, request, jsonify, g
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(64 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_BYTES', str(1024 * 1024)))
+UPLOAD_SPOOL_QUOTA = int(os.getenv('UPLOAD_SPOOL_QUOTA', str(512 * 1024 * 1024)))
+UPLOAD_TMP_DIR = os.getenv('UPLOAD_TMP_DIR') or None
+
+# 各接口的请求体上限（key 为 Flask endpoint 名，即视图函数名）
+UPLOAD_LIMITS = {
+    'image_commentary_streaming': 10 * 1024 * 1024,
+    'audio_chat': 16 * 1024 * 1024,
+    'audio_chat_streaming': 16 * 1024 * 1024,
+    'chat': 64 * 1024 * 1024,
+    'video_auto_chat': 64 * 1024 * 1024,
+    'video_auto_chat_with_tts': 64 * 1024 * 1024,
+    'agent_chat': 64 * 1024 * 1024,
+}
+UPLOAD_LIMITS.update({k: int(v) for k, v in json.loads(os.getenv('UPLOAD_LIMITS', '{}')).items()})
+
+_stats_lock = threading.Lock()
+_stats = {
+    'in_flight_bytes': 0,
+    'peak_in_flight_bytes': 0,
+    'uploads': 0,
+    'rejected_too_large': 0,
+    'rejected_quota': 0,
+}
+
+
+class UploadQuotaExceeded(Exception):
+    """同时处理中的上传总量超过 UPLOAD_SPOOL_QUOTA"""
+    pass
+
+
+def get_upload_limit(endpoint):
+    """返回接口的请求体上限（字节）"""
+    return UPLOAD_LIMITS.get(endpoint, UPLOAD_MAX_BYTES)
+
+
+def spool_stream_factory(total_content_length=None, content_type=None, filename=None, content_length=None):
+    """multipart 解析时每个上传文件的存储（参数同 werkzeug 的 stream_factory）"""
+    return SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode='rb+', dir=UPLOAD_TMP_DIR)
+
+
+def read_upload(file):
+    """
+    读取上传文件
+
+    参数:
+        file: FileStorage
+
+    返回:
+        bytes（小文件，仍在内存中）或只读 mmap（已落盘的文件）
+    """
+    stream = file.stream
+    size = stream.seek(0, io.SEEK_END)
+    stream.seek(0)
+    if size <= UPLOAD_SPOOL_BYTES:
+        return stream.read()
+    try:
+        # 大于 UPLOAD_SPOOL_BYTES 时 SpooledTemporaryFile 已经落盘，fileno() 不会再复制数据
+        return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return stream.read()
+
+
+def reserve_upload(nbytes):
+    """
+    为一个请求预留上传配额
+
+    异常:
+        UploadQuotaExceeded: 预留后总量会超过 UPLOAD_SPOOL_QUOTA
+    """
+    with _stats_lock:
+        if _stats['in_flight_bytes'] + nbytes > UPLOAD_SPOOL_QUOTA:
+            _stats['rejected_quota'] += 1
+            raise UploadQuotaExceeded(
+                f'服务器正在处理的上传过多（{_stats["in_flight_bytes"]} bytes），请稍后重试'
+            )
+        _stats['in_flight_bytes'] += nbytes
+        _stats['peak_in_flight_bytes'] = max(_stats['peak_in_flight_bytes'], _stats['in_flight_bytes'])
+        _stats['uploads'] += 1
+
+
+def release_upload(nbytes):
+    """释放 reserve_upload 预留的配额"""
+    with _stats_lock:
+        _stats['in_flight_bytes'] -= nbytes
+
+
+def settle_upload(reserved, form, files):
+    """
+    multipart 解析完成后，把预留的配额调整为实际收到的字节数（文件大小 + 表单字段长度）
+
+    有 Content-Length 时解析前已按它预留，这里只会减少；没有 Content-Length（chunked）时解析前
+    不预留（接收时仍受接口上限约束），这里按实际大小补上。按接口上限预留的话，几百字节的请求
+    在整个流式响应期间都要占住几十 MB 配额，几个并发请求就会把配额占满
+
+    返回:
+        调整后预留的字节数
+
+    异常:
+        UploadQuotaExceeded: 补上差额后总量会超过 UPLOAD_SPOOL_QUOTA（原预留不变）
+    """
+    actual = sum(len(value.encode('utf-8')) for _, value in form.items(multi=True))
+    for _, file in files.items(multi=True):
+        actual += file.stream.seek(0, io.SEEK_END)
+        file.stream.seek(0)
+    if actual > reserved:
+        reserve_upload(actual - reserved)
+    elif actual < reserved:
+        release_upload(reserved - actual)
+    return actual
+
+
+def record_rejected():
+    """记录一次因超过大小上限被拒绝的上传"""
+    with _stats_lock:
+        _stats['rejected_too_large'] += 1
+
+
+def get_upload_stats():
+    """返回上传统计和当前配置"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update(quota_bytes=UPLOAD_SPOOL_QUOTA, spool_bytes=UPLOAD_SPOOL_BYTES, limits=dict(UPLOAD_LIMITS))
+    return stats
+
+
+def too_large_message(limit):
+    """413 响应的错误信息"""
+    size = f'{limit / 1024 / 1024:g} MB' if limit >= 1024 * 1024 else f'{limit / 1024:.0f} KB'
+    return f'上传内容过大，该接口上限 {size}'
+
+
+class SpooledRequest(Request):
+    """按接口限制请求体大小、上传写入 spool_stream_factory 的 Request"""
+
+    @property
+    def max_content_length(self):
+        return get_upload_limit(self.endpoint)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return spool_stream_factory(total_content_length, content_type, filename, content_length)
+
+
+def install_upload_limits(app):
+    """
+    为 Flask 应用启用上传限制
+
+    受限接口（UPLOAD_LIMITS 中的 endpoint）在进入视图前完成 multipart 解析，
+    这样超限的 413 由错误处理器返回，而不会被视图里的 except Exception 变成 500。
+    """
+    app.request_class = SpooledRequest
+    app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES
+
+    @app.before_request
+    def _spool_upload():
+        if request.endpoint not in UPLOAD_LIMITS or request.method != 'POST':
+            return None
+
+        limit = get_upload_limit(request.endpoint)
+        if request.content_length is not None and request.content_length > limit:
+            raise RequestEntityTooLarge()
+
+        # 没有 Content-Length 时解析完再按实际大小预留（见 settle_upload）
+        nbytes = request.content_length or 0
+        if nbytes:
+            reserve_upload(nbytes)
+            g.upload_reserved = nbytes
+        # 边接收边解析，超限时抛出 RequestEntityTooLarge
+        g.upload_reserved = settle_upload(nbytes, request.form, request.files)
+        return None
+
+    @app.after_request
+    def _release_upload_on_close(response):
+        # teardown_request 在开始发送流式响应体之前就执行了，改为响应关闭时释放
+        nbytes = g.pop('upload_reserved', 0)
+        if nbytes:
+            response.call_on_close(lambda: release_upload(nbytes))
+        return response
+
+    @app.teardown_request
+    def _release_upload(exc=None):
+        # 没有生成响应（未处理的异常，after_request 不执行）时在这里释放
+        nbytes = g.pop('upload_reserved', 0)
+        if nbytes:
+            release_upload(nbytes)
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def _too_large(e):
+        record_rejected()
+        limit = get_upload_limit(request.endpoint)
+        print(f'🚫 上传超过上限: {request.endpoint}（上限 {limit} bytes，Content-Length {request.content_length}）')
+        return jsonify({'success': False, 'error': too_large_message(limit)}), 413
+
+    @app.errorhandler(UploadQuotaExceeded)
+    def _quota_exceeded(e):
+        print(f'🚫 {e}')
+        return jsonify({'success': False, 'error': str(e)}), 503
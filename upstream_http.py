@@ -0,0 +1,408 @@
+"""
+上游 HTTP 客户端工厂（连接池 + keep-alive + 超时 + 可选 HTTP/2 + 连接池统计）
+
+原来 app.py 和 multimodal_engine.py 各自创建 OpenAI 客户端，request_encoder 又有自己的 httpx 客户端，
+DashScope（TTS）走 SDK 默认的传输，连接池大小、keep-alive、超时都无法配置，各路径之间也不复用连接。
+httpx 默认空闲连接 5 秒就关闭，突发请求到来时经常要重新建立 TCP + TLS 连接。这里统一创建:
+    - get_http_client / get_async_http_client: 共享的 httpx 客户端（OpenAI 兼容接口、request_encoder 共用）
+    - get_openai_client / get_async_openai_client: 使用上面 httpx 客户端的 OpenAI 客户端（同一组参数只创建一个）
+    - dashscope_options / adashscope_options: DashScope 调用参数（共享的 requests / aiohttp 会话 + 超时）
+每个连接池统计请求数、进行中的请求数及峰值、新建连接数（其余为复用）、需要等待空闲连接的次数和
+等待超时次数，用于判断连接池是否饱和。
+
+配置（环境变量）:
+    UPSTREAM_MAX_CONNECTIONS    每个连接池的最大连接数（默认 100）
+    UPSTREAM_MAX_KEEPALIVE      保持的空闲连接数（默认 20）
+    UPSTREAM_KEEPALIVE_EXPIRY   空闲连接保持时间（秒，默认 60）
+    UPSTREAM_CONNECT_TIMEOUT    连接超时（秒，默认 5）
+    UPSTREAM_READ_TIMEOUT       读取超时（秒，默认 600；流式响应为两个数据块之间的最长间隔）
+    UPSTREAM_POOL_TIMEOUT       等待空闲连接的超时（秒，默认 30）
+    UPSTREAM_HTTP2              OpenAI 兼容接口是否使用 HTTP/2（默认 false，需要安装 h2）
+
+示例:
+    client = get_openai_client(API_KEY, API_BASE)
+    responses = dashscope.MultiModalConversation.call(model=..., text=text, stream=True, **dashscope_options())
+"""
+
+import asyncio
+import os
+import socket
+import threading
+
+import httpx
+import requests
+from openai import OpenAI, AsyncOpenAI
+from requests.adapters import HTTPAdapter
+
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '100'))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv('UPSTREAM_MAX_KEEPALIVE', '20'))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv('UPSTREAM_KEEPALIVE_EXPIRY', '60'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '600'))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv('UPSTREAM_POOL_TIMEOUT', '30'))
+UPSTREAM_HTTP2 = os.getenv('UPSTREAM_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+
+TIMEOUT = httpx.Timeout(
+    UPSTREAM_READ_TIMEOUT,
+    connect=UPSTREAM_CONNECT_TIMEOUT,
+    pool=UPSTREAM_POOL_TIMEOUT,
+)
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_openai_clients = {}
+_dashscope_session = None
+_dashscope_aio_sessions = {}  # {event loop: aiohttp.ClientSession}
+
+_stats = {}
+
+
+def _pool_stats(name):
+    """返回（必要时创建）某个连接池的计数器，调用方需持有 _lock"""
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = {
+            'requests': 0,
+            'in_flight': 0,
+            'peak_in_flight': 0,
+            'new_connections': 0,
+            'pool_waits': 0,
+            'pool_timeouts': 0,
+        }
+    return stats
+
+
+def _record(name, key, value=1):
+    with _lock:
+        _pool_stats(name)[key] += value
+
+
+def _begin(name):
+    with _lock:
+        stats = _pool_stats(name)
+        if stats['in_flight'] >= UPSTREAM_MAX_CONNECTIONS:
+            stats['pool_waits'] += 1
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+
+
+def _end(name):
+    with _lock:
+        _pool_stats(name)['in_flight'] -= 1
+
+
+# 空闲连接开启 TCP keepalive（被 NAT / 负载均衡静默断开时尽快发现），并关闭 Nagle
+_SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+
+def _use_http2():
+    if not UPSTREAM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print('⚠️ UPSTREAM_HTTP2 需要安装 h2（pip install httpx[http2]），已退回 HTTP/1.1')
+        return False
+    return True
+
+
+def _transport_options():
+    return {
+        'limits': httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        'http2': _use_http2(),
+        'socket_options': _SOCKET_OPTIONS,
+    }
+
+
+def _on_trace_event(name, event):
+    if event == 'connection.connect_tcp.complete':
+        _record(name, 'new_connections')
+
+
+class _MeteredStream(httpx.SyncByteStream):
+    """响应体读完或关闭时结束计数（流式响应期间连接一直被占用）"""
+
+    def __init__(self, stream, name):
+        self._stream = stream
+        self._name = name
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                _end(self._name)
+
+
+class _AsyncMeteredStream(httpx.AsyncByteStream):
+    def __init__(self, stream, name):
+        self._stream = stream
+        self._name = name
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                _end(self._name)
+
+
+class _MeteredTransport(httpx.BaseTransport):
+    """httpx 传输层包装：统计请求数、进行中的请求、新建连接和等待超时"""
+
+    def __init__(self, name):
+        self._name = name
+        self._transport = httpx.HTTPTransport(**_transport_options())
+
+    def handle_request(self, request):
+        _begin(self._name)
+        request.extensions['trace'] = lambda event, info: _on_trace_event(self._name, event)
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException as e:
+            if isinstance(e, httpx.PoolTimeout):
+                _record(self._name, 'pool_timeouts')
+            _end(self._name)
+            raise
+        response.stream = _MeteredStream(response.stream, self._name)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class _AsyncMeteredTransport(httpx.AsyncBaseTransport):
+    def __init__(self, name):
+        self._name = name
+        self._transport = httpx.AsyncHTTPTransport(**_transport_options())
+
+    async def handle_async_request(self, request):
+        _begin(self._name)
+
+        async def trace(event, info):
+            _on_trace_event(self._name, event)
+
+        request.extensions['trace'] = trace
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException as e:
+            if isinstance(e, httpx.PoolTimeout):
+                _record(self._name, 'pool_timeouts')
+            _end(self._name)
+            raise
+        response.stream = _AsyncMeteredStream(response.stream, self._name)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def get_http_client():
+    """共享的 httpx 同步客户端（OpenAI 兼容接口）"""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(transport=_MeteredTransport('openai'), timeout=TIMEOUT)
+        return _http_client
+
+
+def get_async_http_client():
+    """共享的 httpx 异步客户端（OpenAI 兼容接口，ASGI 服务模式）"""
+    global _async_http_client
+    with _lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(transport=_AsyncMeteredTransport('openai_async'), timeout=TIMEOUT)
+        return _async_http_client
+
+
+def get_openai_client(api_key, base_url):
+    """
+    返回使用共享连接池的 OpenAI 客户端（相同的 api_key / base_url 返回同一个实例）
+
+    示例:
+        client = get_openai_client(API_KEY, API_BASE)
+    """
+    key = ('sync', api_key, base_url)
+    client = _openai_clients.get(key)
+    if client is None:
+        client = OpenAI(api_key=api_key, base_url=base_url, http_client=get_http_client(), timeout=TIMEOUT)
+        client = _openai_clients.setdefault(key, client)
+    return client
+
+
+def get_async_openai_client(api_key, base_url):
+    """get_openai_client 的异步版本"""
+    key = ('async', api_key, base_url)
+    client = _openai_clients.get(key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=get_async_http_client(), timeout=TIMEOUT)
+        client = _openai_clients.setdefault(key, client)
+    return client
+
+
+class _MeteredAdapter(HTTPAdapter):
+    """
+    requests 连接池（DashScope 同步调用）
+
+    连接数达到上限时等待空闲连接（pool_block），而不是临时新建一个用完即弃的连接
+    """
+
+    def __init__(self):
+        super().__init__(pool_connections=4, pool_maxsize=UPSTREAM_MAX_CONNECTIONS, pool_block=True)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **kwargs):
+        kwargs.setdefault('socket_options', _SOCKET_OPTIONS)
+        super().init_poolmanager(connections, maxsize, block=block, **kwargs)
+
+    def pool_usage(self):
+        """返回 (使用中的连接数, 累计新建连接数)"""
+        in_use = 0
+        created = 0
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            if pool.pool is not None:
+                in_use += pool.pool.maxsize - pool.pool.qsize()
+            created += pool.num_connections
+        return in_use, created
+
+    def send(self, request, **kwargs):
+        in_use, _ = self.pool_usage()
+        with _lock:
+            stats = _pool_stats('dashscope')
+            stats['requests'] += 1
+            if in_use >= UPSTREAM_MAX_CONNECTIONS:
+                stats['pool_waits'] += 1
+            stats['peak_in_flight'] = max(stats['peak_in_flight'], in_use + 1)
+        return super().send(request, **kwargs)
+
+
+def _get_dashscope_session():
+    global _dashscope_session
+    with _lock:
+        if _dashscope_session is None:
+            session = requests.Session()
+            adapter = _MeteredAdapter()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _dashscope_session = session
+        return _dashscope_session
+
+
+def dashscope_options():
+    """
+    DashScope 同步调用的公共参数（共享会话 + 超时）
+
+    返回:
+        dict，展开传给 dashscope.MultiModalConversation.call
+    """
+    return {'session': _get_dashscope_session(), 'request_timeout': UPSTREAM_READ_TIMEOUT}
+
+
+async def adashscope_options():
+    """
+    DashScope 异步调用的公共参数（当前事件循环共享的 aiohttp 会话 + 超时）
+
+    返回:
+        dict，展开传给 dashscope.AioMultiModalConversation.call
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _dashscope_aio_sessions.get(loop)
+    if session is None or session.closed:
+        async def on_request_start(session, context, params):
+            _record('dashscope_async', 'requests')
+
+        async def on_queued(session, context, params):
+            _record('dashscope_async', 'pool_waits')
+
+        async def on_connection_created(session, context, params):
+            _record('dashscope_async', 'new_connections')
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_queued_start.append(on_queued)
+        trace.on_connection_create_end.append(on_connection_created)
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=UPSTREAM_MAX_CONNECTIONS,
+                keepalive_timeout=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=aiohttp.ClientTimeout(connect=UPSTREAM_CONNECT_TIMEOUT),
+            trace_configs=[trace],
+            trust_env=True,
+        )
+        _dashscope_aio_sessions[loop] = session
+    return {'session': session, 'request_timeout': UPSTREAM_READ_TIMEOUT}
+
+
+async def aclose_upstream_sessions():
+    """关闭当前事件循环的 DashScope aiohttp 会话（ASGI 服务停止时调用）"""
+    session = _dashscope_aio_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def get_upstream_stats():
+    """
+    返回各连接池统计
+
+    返回:
+        {连接池名: {requests, in_flight, peak_in_flight, new_connections, reuse_rate, pool_waits,
+                   pool_timeouts, saturation}, 'config': {...}}
+        saturation 为进行中的请求数 / 最大连接数
+    """
+    adapter = _dashscope_session.get_adapter('https://') if _dashscope_session else None
+    usage = adapter.pool_usage() if adapter else None
+    aio_in_use = sum(len(getattr(s.connector, '_acquired', ()) or ())
+                     for s in list(_dashscope_aio_sessions.values()) if not s.closed and s.connector)
+
+    with _lock:
+        pools = {name: dict(stats) for name, stats in _stats.items()}
+    if usage and 'dashscope' in pools:
+        pools['dashscope'].update(in_flight=usage[0], new_connections=usage[1])
+    if 'dashscope_async' in pools:
+        pools['dashscope_async']['in_flight'] = aio_in_use
+        pools['dashscope_async']['peak_in_flight'] = None
+
+    for stats in pools.values():
+        requests_made = stats['requests']
+        stats.update(
+            reuse_rate=max(0.0, 1 - stats['new_connections'] / requests_made) if requests_made else None,
+            saturation=stats['in_flight'] / UPSTREAM_MAX_CONNECTIONS,
+        )
+    pools['config'] = {
+        'max_connections': UPSTREAM_MAX_CONNECTIONS,
+        'max_keepalive': UPSTREAM_MAX_KEEPALIVE,
+        'keepalive_expiry': UPSTREAM_KEEPALIVE_EXPIRY,
+        'connect_timeout': UPSTREAM_CONNECT_TIMEOUT,
+        'read_timeout': UPSTREAM_READ_TIMEOUT,
+        'pool_timeout': UPSTREAM_POOL_TIMEOUT,
+        'http2': UPSTREAM_HTTP2,
+    }
+    return pools
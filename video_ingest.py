@@ -0,0 +1,112 @@
+"""
+视频输入处理策略
+
+根据 ffprobe 探测到的容器和音视频编码，为输入视频选择代价最低的处理方式:
+    passthrough  容器和编码上游都能直接接受，原样发送，不启动 ffmpeg
+    remux        视频编码可接受，只换容器（视频 -c copy）；音频编码不可接受时只重编码音频
+    transcode    视频编码不可接受，完整重编码（libx264 + aac，CPU 开销最大）
+
+配置（环境变量，逗号分隔）:
+    UPSTREAM_VIDEO_CODECS       上游接受的视频编码（默认 h264）
+    UPSTREAM_AUDIO_CODECS       上游接受的音频编码（默认 aac,mp3）
+    UPSTREAM_VIDEO_CONTAINERS   上游接受的容器（默认 mp4）
+    VIDEO_FAST_PATH             是否启用 passthrough / remux（默认 true，false 时总是重编码）
+
+示例:
+    info = probe_media(data=webm_data)
+    strategy = choose_strategy([info])
+    args = codec_args(strategy, [info])
+"""
+
+import os
+import threading
+
+
+def _env_set(name, default):
+    return {item.strip().lower() for item in os.getenv(name, default).split(',') if item.strip()}
+
+
+UPSTREAM_VIDEO_CODECS = _env_set('UPSTREAM_VIDEO_CODECS', 'h264')
+UPSTREAM_AUDIO_CODECS = _env_set('UPSTREAM_AUDIO_CODECS', 'aac,mp3')
+UPSTREAM_VIDEO_CONTAINERS = _env_set('UPSTREAM_VIDEO_CONTAINERS', 'mp4')
+VIDEO_FAST_PATH = os.getenv('VIDEO_FAST_PATH', 'true').lower() in ('1', 'true', 'yes')
+
+PASSTHROUGH = 'passthrough'
+REMUX = 'remux'
+TRANSCODE = 'transcode'
+
+# 完整重编码参数（与原有转换保持一致）
+TRANSCODE_ARGS = [
+    '-vcodec', 'libx264', '-acodec', 'aac',
+    '-preset', 'ultrafast', '-crf', '28'
+]
+
+_stats_lock = threading.Lock()
+_strategy_counts = {PASSTHROUGH: 0, REMUX: 0, TRANSCODE: 0}
+
+
+def _streams(info, codec_type):
+    return [s for s in info.get('streams', []) if s.get('codec_type') == codec_type]
+
+
+def _codecs_accepted(infos, codec_type, accepted):
+    return all(
+        (stream.get('codec_name') or '').lower() in accepted
+        for info in infos
+        for stream in _streams(info, codec_type)
+    )
+
+
+def accepted_container(info):
+    """返回上游可接受的容器名（如 'mp4'），不可接受时返回 None"""
+    names = (info.get('format', {}).get('format_name') or '').lower().split(',')
+    for name in names:
+        if name in UPSTREAM_VIDEO_CONTAINERS:
+            return name
+    return None
+
+
+def describe(info):
+    """输入编码的简短描述，用于日志，例如 'matroska,webm: vp8/opus'"""
+    codecs = '/'.join(s.get('codec_name') or '?' for s in info.get('streams', []))
+    return f"{info.get('format', {}).get('format_name', '?')}: {codecs}"
+
+
+def choose_strategy(infos):
+    """
+    为一组片段选择处理方式
+
+    参数:
+        infos: ffprobe 结果列表（单个视频传一个元素；多片段合并时所有片段统一策略，
+               保证 concat 时参数一致）
+
+    返回:
+        PASSTHROUGH / REMUX / TRANSCODE
+    """
+    if not VIDEO_FAST_PATH or not _codecs_accepted(infos, 'video', UPSTREAM_VIDEO_CODECS):
+        return TRANSCODE
+    if (len(infos) == 1 and accepted_container(infos[0])
+            and _codecs_accepted(infos, 'audio', UPSTREAM_AUDIO_CODECS)):
+        return PASSTHROUGH
+    return REMUX
+
+
+def codec_args(strategy, infos):
+    """返回对应策略的 ffmpeg 编码参数（输出容器参数由调用方添加）"""
+    if strategy == TRANSCODE:
+        return list(TRANSCODE_ARGS)
+    if _codecs_accepted(infos, 'audio', UPSTREAM_AUDIO_CODECS):
+        return ['-c:v', 'copy', '-c:a', 'copy']
+    return ['-c:v', 'copy', '-c:a', 'aac']
+
+
+def record_strategy(strategy):
+    """记录一次策略选择"""
+    with _stats_lock:
+        _strategy_counts[strategy] += 1
+
+
+def get_strategy_stats():
+    """返回各策略的使用次数"""
+    with _stats_lock:
+        return dict(_strategy_counts)